@@ -0,0 +1,29 @@
+# benchmark_date_parser.py
+#
+# Compares the per-value convert_date apply with the batched DateParser.
+# Run from the project root: python benchmarks/benchmark_date_parser.py
+
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'v2_ETL'))
+from date_parser import DateParser, convert_date
+from synthetic_data import make_dates
+
+def time_call(func, values):
+    start = time.perf_counter()
+    result = func(values)
+    return result, time.perf_counter() - start
+
+def main():
+    for n_rows in (10_000, 100_000):
+        values = make_dates(n_rows)
+        expected, apply_time = time_call(lambda v: v.apply(convert_date), values)
+        result, parser_time = time_call(DateParser().parse, values)
+        pd.testing.assert_series_equal(expected, result)
+        print(f"{n_rows:>8} rows: apply {apply_time:.3f}s, DateParser {parser_time:.3f}s, speedup {apply_time / parser_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
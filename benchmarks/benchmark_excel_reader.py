@@ -0,0 +1,50 @@
+# benchmark_excel_reader.py
+#
+# Compares the throughput of the Excel engines of excel_reader, reading every column and only the used ones,
+# and the time of the header-only probe.
+# Run from the project root: python benchmarks/benchmark_excel_reader.py --sizes 10000 100000
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+from pipeline_common.excel_reader import available_engines, read_excel, read_header, used_columns
+from synthetic_data import make_spending
+
+with open(os.path.join(ROOT, 'config.json')) as f:
+    CONFIG = json.load(f)
+USECOLS = used_columns({'spending': CONFIG['spending_required_cols']}, {'spending': ['Amount']})['spending']
+
+def time_call(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Excel engines on a synthetic spending workbook.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    args = parser.parse_args()
+
+    print(f"Engines available: {', '.join(available_engines())}")
+    for n_rows in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'spending.xlsx')
+            make_spending(n_rows).to_excel(path, index=False)
+            print(f"{n_rows} rows, {os.path.getsize(path) / 1e6:.1f} MB, header probe {time_call(lambda: read_header(path))[1] * 1000:.1f} ms")
+
+            expected = pd.read_excel(path)
+            for engine in available_engines():
+                df, all_time = time_call(lambda: read_excel(path, engine=engine))
+                pd.testing.assert_frame_equal(df, expected)
+                _, used_time = time_call(lambda: read_excel(path, USECOLS, engine))
+                print(f"{engine:>20}: all columns {all_time:.2f}s ({n_rows / all_time:,.0f} rows/s), "
+                      f"{len(USECOLS)} columns {used_time:.2f}s ({n_rows / used_time:,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
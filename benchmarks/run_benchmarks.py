@@ -0,0 +1,231 @@
+# run_benchmarks.py
+#
+# Times the pipeline stages on synthetic data of growing size and stores the results per commit.
+# Run from the project root:
+#   python benchmarks/run_benchmarks.py --sizes 10000 100000 1000000
+#   python benchmarks/run_benchmarks.py --suites clean_data validate_data --compare benchmarks/results/<earlier run>.json
+# The load step runs against a local SQLite database, so no server is needed.
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('src', os.path.join('src', 'v1_DataProcessor'), os.path.join('src', 'v2_ETL')):
+    sys.path.insert(0, os.path.join(ROOT, folder))
+from transform import DataTransformer
+from extract import parse_object
+from load import DataLoader
+from data_analyzer import DataAnalyzer
+from synthetic_data import make_spending, make_places, make_fx_rates
+from pipeline_common.fx_rates import FxRates
+from time_series import SpendingTimeSeries
+
+with open(os.path.join(ROOT, 'config.json')) as f:
+    CONFIG = json.load(f)
+REQUIRED_COLS = {'spending': CONFIG['spending_required_cols'], 'places': CONFIG['places_required_cols']}
+
+class Datasets:
+    """Generate the data of each size once, and derive the checked / cleaned versions on demand."""
+    def __init__(self, seed=42):
+        self.seed = seed
+        self.cache = {}
+
+    def raw(self, n_rows):
+        if ('raw', n_rows) not in self.cache:
+            self.cache[('raw', n_rows)] = {'spending': make_spending(n_rows, self.seed), 'places': make_places(n_rows, self.seed)}
+        return self.cache[('raw', n_rows)]
+
+    def checked(self, n_rows):
+        if ('checked', n_rows) not in self.cache:
+            self.cache[('checked', n_rows)] = DataTransformer(self.raw(n_rows)).check_data(REQUIRED_COLS)[1]
+        return self.cache[('checked', n_rows)]
+
+    def cleaned(self, n_rows):
+        if ('cleaned', n_rows) not in self.cache:
+            self.cache[('cleaned', n_rows)] = DataTransformer({}).clean_data(dict(self.checked(n_rows)))
+        return self.cache[('cleaned', n_rows)]
+
+    def shards(self, n_rows, count=8):
+        """The raw data split into count CSV objects per table, as (name, key, bytes)."""
+        if ('shards', n_rows) not in self.cache:
+            shards = []
+            for name, df in self.raw(n_rows).items():
+                bounds = np.linspace(0, len(df), count + 1).astype(int)
+                shards += [(name, f"{name}/{i:03d}.csv", df.iloc[bounds[i]:bounds[i + 1]].to_csv(index=False).encode()) for i in range(count)]
+            self.cache[('shards', n_rows)] = shards
+        return self.cache[('shards', n_rows)]
+
+# Each suite takes the datasets and a size, and returns the function to time plus an optional cleanup
+def check_data(datasets, n_rows):
+    transformer = DataTransformer(datasets.raw(n_rows))
+    return lambda: transformer.check_data(REQUIRED_COLS), None
+
+def clean_data(datasets, n_rows):
+    checked = datasets.checked(n_rows)
+    # A new DateParser per run, so its cache does not carry over between repeats
+    return lambda: DataTransformer({}).clean_data(dict(checked)), None
+
+def validate_data(datasets, n_rows):
+    cleaned = datasets.cleaned(n_rows)
+    return lambda: DataTransformer({}).validate_data(dict(cleaned)), None
+
+def transform_shards(datasets, n_rows):
+    # Parse, check, clean and validate 8 objects per table on every CPU, compare with the check / clean / validate suites
+    shards = datasets.shards(n_rows)
+    return lambda: DataTransformer({}).transform_shards(shards, parse_object, REQUIRED_COLS, threshold=1.0), None
+
+def convert_currencies(datasets, n_rows):
+    spending = datasets.cleaned(n_rows)['spending']
+    fx_rates = FxRates(make_fx_rates(spending['Date'].max(), datasets.seed))
+    return lambda: fx_rates.convert(spending), None
+
+def perform_analysis(datasets, n_rows):
+    cleaned = datasets.cleaned(n_rows)
+    return lambda: DataAnalyzer(cleaned['spending'], cleaned['places']).perform_analysis(), None
+
+def time_series(datasets, n_rows):
+    cleaned = datasets.cleaned(n_rows)
+    def run():
+        # Sorted once, then every period and the costs per stay
+        series = SpendingTimeSeries(cleaned['spending'])
+        for period in ('day', 'week', 'month'):
+            series.by_period(period)
+        series.cost_per_stay(cleaned['places'])
+    return run, None
+
+def load_data_to_db(datasets, n_rows):
+    # A new database per run, the load goes through the INSERT path used for non-PostgreSQL databases
+    folder = tempfile.TemporaryDirectory()
+    loader = DataLoader(validated_data=datasets.cleaned(n_rows), output_paths={}, missing_data={}, missing_data_output_paths={},
+                        db_link=f"sqlite:///{os.path.join(folder.name, 'benchmark.db')}")
+    def cleanup():
+        loader.get_engine().dispose()
+        folder.cleanup()
+    return lambda: loader.load_data_to_db(schema=None), cleanup
+
+SUITES = {
+    'check_data': check_data,
+    'clean_data': clean_data,
+    'validate_data': validate_data,
+    'transform_shards': transform_shards,
+    'convert_currencies': convert_currencies,
+    'perform_analysis': perform_analysis,
+    'time_series': time_series,
+    'load_data_to_db': load_data_to_db,
+}
+
+def run_suite(suite, datasets, n_rows, repeat):
+    """Time a suite repeat times on fresh setups, return the timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        func, cleanup = SUITES[suite](datasets, n_rows)
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        if cleanup is not None:
+            cleanup()
+    return timings
+
+def git_commit():
+    """Get the current commit and whether the working tree has changes, None outside a git checkout."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+def run_benchmarks(suites, sizes, repeat=3, seed=42):
+    """
+    Run the suites at every size.
+
+    :return: The results, with the commit and environment they were measured on.
+    """
+    datasets = Datasets(seed)
+    commit, dirty = git_commit()
+    results = []
+    for n_rows in sizes:
+        for suite in suites:
+            timings = run_suite(suite, datasets, n_rows, repeat)
+            best = min(timings)
+            results.append({
+                'suite': suite,
+                'rows': n_rows,
+                'repeat': repeat,
+                'min_seconds': best,
+                'median_seconds': statistics.median(timings),
+                'rows_per_second': n_rows / best if best else None
+            })
+            print(f"{suite:>18} {n_rows:>10} rows: {best:.4f}s (median {statistics.median(timings):.4f}s)")
+    return {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'seed': seed,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'machine': platform.platform(),
+        'results': results
+    }
+
+def save_results(report, folder):
+    """Store the results as <commit>_<timestamp>.json, so runs of different commits can be compared."""
+    os.makedirs(folder, exist_ok=True)
+    name = f"{report['commit'] or 'nocommit'}{'-dirty' if report['dirty'] else ''}_{report['timestamp'].replace(':', '')}.json"
+    path = os.path.join(folder, name)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+    return path
+
+def compare(report, baseline):
+    """
+    Compare the results with an earlier run.
+
+    :return: One dict per (suite, rows) measured in both runs, with the 'ratio' of the new to the old best time.
+    """
+    previous = {(result['suite'], result['rows']): result for result in baseline['results']}
+    comparison = []
+    for result in report['results']:
+        old = previous.get((result['suite'], result['rows']))
+        if old is not None and old['min_seconds']:
+            comparison.append({'suite': result['suite'], 'rows': result['rows'],
+                               'ratio': result['min_seconds'] / old['min_seconds']})
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help="Row counts, from 10k up to 10M.")
+    parser.add_argument('--suites', nargs='+', default=list(SUITES), choices=list(SUITES))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output-folder', default=os.path.join(ROOT, 'benchmarks', 'results'))
+    parser.add_argument('--compare', help="A results file of an earlier run to compare with.")
+    args = parser.parse_args()
+
+    # The stages log warnings about the missing values injected in the data
+    logging.disable(logging.WARNING)
+
+    report = run_benchmarks(args.suites, args.sizes, repeat=args.repeat, seed=args.seed)
+    print(f"Results written to {save_results(report, args.output_folder)}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {baseline['commit']} ({baseline['timestamp']}):")
+        for row in compare(report, baseline):
+            print(f"{row['suite']:>18} {row['rows']:>10} rows: {row['ratio']:.2f}x the earlier time")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# synthetic_data.py
+#
+# Seeded generators of raw spending / places data, shaped like data/raw_data/spending.xlsx and travels.xlsx.
+# Run from the project root to write raw files: python benchmarks/synthetic_data.py 100000 data/benchmark_data/
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# (City, country code used by the spending file, country name used by the places file)
+PLACES = [
+    ('Vienna', 'AT', 'Austria'), ('Athens', 'GR', 'Greece'), ('Heraklion', 'GR', 'Greece'), ('Chania', 'GR', 'Greece'),
+    ('Valencia', 'ES', 'Spain'), ('Bolbaite', 'ES', 'Spain'), ('Madrid', 'ES', 'Spain'), ('Lisbon', 'PT', 'Portugal'),
+    ('Porto', 'PT', 'Portugal'), ('Budapest', 'HU', 'Hungary'), ('Zagreb', 'HR', 'Croatia'), ('Split', 'HR', 'Croatia'),
+    ('Sofia', 'BG', 'Bulgaria'), ('Istanbul', 'TR', 'Turkey'), ('Tbilisi', 'GE', 'Georgia'), ('Yerevan', 'AM', 'Armenia'),
+]
+CATEGORIES = ['Grocery', 'Restaurant', 'Transport', 'Accommodation', 'Sightseeing', 'Health', 'Clothes', 'Gift',
+              'Communication', 'Entertainment', 'Fee', 'Coffee', 'Other']
+CURRENCIES = {'EUR': 1.0, 'HUF': 0.0026, 'GEL': 0.35, 'TRY': 0.05, 'BGN': 0.51}
+TITLES = ['Aldi', 'Billa', 'Spar', 'Lidl', 'Bus', 'Metro', 'Train', 'Coffee', 'Lunch', 'Dinner', 'Museum', 'Hostel', 'Pharmacy']
+HOSTS = ['Astrid', 'Vasilis', 'Maria', 'Jose', 'Ana', 'Nikos', 'Eva', 'Giorgi', 'Lena', 'Marco']
+
+def format_days(timestamps, date_format):
+    """Format the days of timestamps, formatting each distinct day only once (strftime is slow on millions of rows)."""
+    codes, days = pd.factorize(timestamps.normalize())
+    return days.strftime(date_format).to_numpy(dtype=object)[codes]
+
+def make_dates(n_rows, seed=42, start='2022-04-25'):
+    """Create a raw date column shaped like the spending file: unique timestamps, dotted dates and a few bad values."""
+    rng = np.random.default_rng(seed)
+    # Increasing seconds, so no two rows share a timestamp
+    seconds = np.cumsum(rng.integers(1, 600, n_rows))
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(seconds, unit='s')
+    dates = pd.Series(np.datetime_as_string(timestamps.to_numpy(), unit='s')).str.replace('T', ' ', regex=False).to_numpy(dtype=object)
+
+    dotted = rng.random(n_rows) < 0.1
+    dates[dotted] = format_days(timestamps[dotted], '%Y.%m.%d.')
+    dates[rng.random(n_rows) < 0.01] = 'unknown'
+    dates[rng.random(n_rows) < 0.01] = None
+    return pd.Series(dates, name='Date')
+
+def _with_missing(df, columns, rate, rng):
+    """Blank a share of the values of the given columns, leaving at most rate of the rows incomplete."""
+    for column in columns:
+        df.loc[rng.random(len(df)) < rate / len(columns), column] = None
+    return df
+
+def make_spending(n_rows, seed=42, missing_rate=0.01):
+    """
+    Create raw spending data with the columns of spending.xlsx.
+
+    :param n_rows: The number of rows.
+    :param seed: The seed of the generator, the same seed gives the same data.
+    :param missing_rate: The share of rows missing a required value.
+    """
+    rng = np.random.default_rng(seed)
+    place = rng.integers(0, len(PLACES), n_rows)
+    currency = rng.choice(list(CURRENCIES), n_rows, p=[0.8, 0.05, 0.05, 0.05, 0.05])
+    in_eur = np.round(rng.lognormal(2, 1, n_rows), 2)
+
+    df = pd.DataFrame({
+        # Free-text titles, the receipt number keeps the rows with unparseable dates distinct
+        'Title': pd.Series(np.array(TITLES, dtype=object)[rng.integers(0, len(TITLES), n_rows)]) + ' ' + pd.Series(rng.integers(0, 100000, n_rows)).astype(str),
+        'Date': make_dates(n_rows, seed),
+        'Amount': np.round(in_eur / pd.Series(currency).map(CURRENCIES).to_numpy(), 2),
+        'Currency': currency.astype(object),
+        'In EUR': in_eur,
+        'Category': np.array(CATEGORIES, dtype=object)[rng.integers(0, len(CATEGORIES), n_rows)],
+        'Payment Method': np.where(rng.random(n_rows) < 0.7, 'Card', 'Cash').astype(object),
+        'City': np.array([city for city, _, _ in PLACES], dtype=object)[place],
+        'Country': np.array([code for _, code, _ in PLACES], dtype=object)[place],
+        'Comment': np.nan
+    })
+    return _with_missing(df, ['Title', 'In EUR', 'Category', 'City', 'Country'], missing_rate, rng)
+
+def make_fx_rates(end, seed=42, start='2022-04-25'):
+    """
+    Create daily FX rates shaped like the ECB reference rates: units per EUR of each currency of the spending data,
+    on business days only, drifting around the rates the spending amounts were made with.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(start, pd.Timestamp(end).normalize())
+    rates = {'Date': days.strftime('%Y-%m-%d')}
+    for currency, in_eur in CURRENCIES.items():
+        if currency != 'EUR':
+            rates[currency] = np.round(1 / in_eur * (1 + rng.normal(0, 0.002, len(days))), 4)
+    return pd.DataFrame(rates)
+
+def make_places(n_rows, seed=42, missing_rate=0.01):
+    """
+    Create raw places data with the columns of travels.xlsx.
+
+    :param n_rows: The number of rows.
+    :param seed: The seed of the generator, the same seed gives the same data.
+    :param missing_rate: The share of rows missing a required value.
+    """
+    rng = np.random.default_rng(seed)
+    place = rng.integers(0, len(PLACES), n_rows)
+    nights = rng.integers(1, 10, n_rows)
+    # Many trips over ten years, Order keeps the rows distinct
+    arrival = pd.Timestamp('2022-04-25') + pd.to_timedelta(rng.integers(0, 3650, n_rows), unit='D')
+
+    def points(share_missing):
+        values = rng.integers(1, 11, n_rows).astype(float)
+        values[rng.random(n_rows) < share_missing] = np.nan
+        return values
+
+    df = pd.DataFrame({
+        'Order': np.arange(1, n_rows + 1),
+        'Arrival_Date': format_days(arrival, '%Y.%m.%d.'),
+        'Nights': nights,
+        'Country': np.array([name for _, _, name in PLACES], dtype=object)[place],
+        'City': np.array([city for city, _, _ in PLACES], dtype=object)[place],
+        'Host_Name': np.array(HOSTS, dtype=object)[rng.integers(0, len(HOSTS), n_rows)],
+        'Couchsurfing_FLG': rng.integers(0, 2, n_rows),
+        'G_FLG': np.where(rng.random(n_rows) < 0.1, 1.0, np.nan),
+        'Bike_FLG': np.where(rng.random(n_rows) < 0.15, 1.0, np.nan),
+        'Gender': rng.choice(np.array(['F', 'M', None], dtype=object), n_rows, p=[0.4, 0.4, 0.2]),
+        'Hosts_Personality_Point': points(0.3),
+        'Location_Point': points(0.25),
+        'Comfort': points(0.25),
+        'Comment': np.array(['Nice', 'Super kind', 'Noisy', 'Central'], dtype=object)[rng.integers(0, 4, n_rows)]
+    })
+    return _with_missing(df, ['Arrival_Date', 'Country', 'City', 'Host_Name'], missing_rate, rng)
+
+# Rows of an Excel sheet, without the header
+EXCEL_MAX_ROWS = 1048575
+
+def write_raw(df, path):
+    """
+    Write raw data as an Excel file, or as CSV when it has more rows than a sheet can hold.
+
+    :return: The path written, with a .csv extension instead of .xlsx for large data.
+    """
+    if path.endswith('.xlsx') and len(df) > EXCEL_MAX_ROWS:
+        path = path[:-len('.xlsx')] + '.csv'
+    if path.endswith('.xlsx'):
+        df.to_excel(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    folder = sys.argv[2] if len(sys.argv) > 2 else os.path.join('data', 'benchmark_data')
+    os.makedirs(folder, exist_ok=True)
+    for name, make in (('spending', make_spending), ('travels', make_places)):
+        path = write_raw(make(n_rows), os.path.join(folder, f"{name}.xlsx"))
+        print(f"{n_rows} rows written to {path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+# pipeline_common package
+#
+# The modules used by both the v1 and the v2 pipelines. The pipeline scripts put src on the path and import
+# them as pipeline_common.<module>.
@@ -0,0 +1,119 @@
+# dtype_optimizer.py file
+
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+# Nullable integer types, smallest first
+SMALL_INTS = ['Int8', 'Int16', 'Int32', 'Int64']
+
+# The key of the schema of optimize_dtypes in the metadata of an Arrow schema, see with_dtype_schema
+DTYPE_SCHEMA_KEY = b'dtype_schema'
+
+def _is_float32_safe(values):
+    """Whether float64 values survive a round trip through float32, e.g. ratings, not amounts of money."""
+    values = values.to_numpy(dtype='float64', na_value=np.nan)
+    return np.array_equal(values.astype('float32').astype('float64'), values, equal_nan=True)
+
+def _to_small_int(series):
+    """The smallest nullable integer type holding all the values, None if they are not whole numbers."""
+    values = series.dropna()
+    if len(values) and not (values == np.floor(values)).all():
+        return None
+    low, high = (values.min(), values.max()) if len(values) else (0, 0)
+    for dtype in SMALL_INTS:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    return None
+
+def convert_column(series, kind):
+    """
+    Convert a column to the compact representation of kind, or leave it unchanged where that would lose information.
+
+    :param series: The column.
+    :param kind: 'category', 'small_int' (the smallest nullable integer type, or float32 if the values are not
+                 whole numbers but fit float32 exactly) or 'float32' (only if the values fit float32 exactly).
+                 Only numeric columns are converted to small_int or float32.
+    """
+    if kind not in ('category', 'small_int', 'float32'):
+        raise ValueError(f"Unknown dtype kind {kind}")
+    if kind == 'category':
+        return series if isinstance(series.dtype, pd.CategoricalDtype) else series.astype('category')
+    if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return series
+    if kind == 'small_int':
+        dtype = _to_small_int(series)
+        if dtype is not None:
+            return series.astype(dtype)
+    if pd.api.types.is_float_dtype(series) and _is_float32_safe(series):
+        return series.astype('float32')
+    return series
+
+def optimize_dtypes(df, schema=None):
+    """
+    Convert the columns of a DataFrame to the compact types of the schema.
+
+    Columns of the schema that are not in the DataFrame are ignored.
+
+    :param df: The DataFrame, which is not modified.
+    :param schema: The kind of each column, see convert_column.
+    :return: The converted DataFrame, and one dict per converted column with its 'column', 'dtype_before',
+             'dtype_after', 'bytes_before', 'bytes_after' and 'bytes_saved'.
+    """
+    report = []
+    if not schema:
+        return df, report
+    df = df.copy(deep=False)
+    for column, kind in schema.items():
+        if column not in df.columns:
+            continue
+        before = df[column]
+        after = convert_column(before, kind)
+        if after is before:
+            continue
+        df[column] = after
+        bytes_before, bytes_after = before.memory_usage(index=False, deep=True), after.memory_usage(index=False, deep=True)
+        report.append({
+            'column': column,
+            'dtype_before': str(before.dtype),
+            'dtype_after': str(after.dtype),
+            'bytes_before': int(bytes_before),
+            'bytes_after': int(bytes_after),
+            'bytes_saved': int(bytes_before - bytes_after)
+        })
+    return df, report
+
+def log_report(name, report):
+    for column in report:
+        logging.info(f"{name} {column['column']}: {column['dtype_before']} -> {column['dtype_after']}, "
+                     f"{column['bytes_saved'] / 1e6:.2f} MB saved")
+    if report:
+        logging.info(f"{name} dtypes optimized, {sum(column['bytes_saved'] for column in report) / 1e6:.2f} MB saved")
+
+def with_dtype_schema(arrow_schema, schema=None):
+    """
+    Store the schema of optimize_dtypes in the metadata of an Arrow schema, so it is applied when a table of that schema
+    is converted to pandas (see table_to_frame). Used for tables written batch by batch, whose batches cannot have
+    categories or integer types of their own.
+
+    :param arrow_schema: The Arrow schema, which is not modified.
+    :param schema: The kind of each column, see convert_column.
+    """
+    if not schema:
+        return arrow_schema
+    return arrow_schema.with_metadata({**(arrow_schema.metadata or {}), DTYPE_SCHEMA_KEY: json.dumps(schema).encode()})
+
+def table_to_frame(table, self_destruct=False):
+    """
+    Convert an Arrow table to a DataFrame, with the dtypes of the schema stored by with_dtype_schema, if any.
+
+    :param table: The Arrow table, e.g. memory-mapped.
+    :param self_destruct: Whether to release the Arrow columns as they are converted, the table is unusable afterwards.
+    """
+    schema = (table.schema.metadata or {}).get(DTYPE_SCHEMA_KEY)
+    df = table.to_pandas(split_blocks=True, self_destruct=self_destruct)
+    if schema:
+        df, _ = optimize_dtypes(df, json.loads(schema))
+    return df
@@ -0,0 +1,146 @@
+# excel_reader.py file
+
+import importlib.util
+import pandas as pd
+from pandas.io.parsers import TextParser
+from openpyxl import load_workbook
+
+# The engines reading the first sheet of a workbook, fastest first. calamine needs the optional python-calamine package.
+ENGINES = ('calamine', 'openpyxl_read_only', 'openpyxl')
+
+def available_engines():
+    """The ENGINES that can be used here, fastest first."""
+    return [engine for engine in ENGINES if engine != 'calamine' or importlib.util.find_spec('python_calamine') is not None]
+
+def select_engine(engine='auto'):
+    """
+    Get the engine to read the workbooks with.
+
+    :param engine: One of ENGINES, or 'auto' for the fastest available one.
+    :raises ValueError: If the engine is unknown or its package is not installed.
+    """
+    engines = available_engines()
+    if engine == 'auto':
+        return engines[0]
+    if engine not in engines:
+        raise ValueError(f"Excel engine {engine} is not available, expected one of {['auto'] + engines}")
+    return engine
+
+def parse_rows(rows, columns):
+    """Build a DataFrame from raw cell values with the same type inference as pd.read_excel."""
+    # Empty cells are passed as '' so they become NaN, like pd.read_excel does
+    rows = [['' if value is None else value for value in row] for row in rows]
+    return TextParser(rows, names=columns, header=None).read()
+
+def column_names(header):
+    """Name empty header cells the same way pd.read_excel does."""
+    return [col if col is not None else f"Unnamed: {i}" for i, col in enumerate(header)]
+
+def read_header(source):
+    """
+    Read only the header row of the first sheet, streaming the workbook with openpyxl in read-only mode,
+    so the schema can be checked before the whole sheet is parsed.
+
+    :param source: The path of the Excel file, or a file object.
+    :return: The column names, [] for an empty sheet.
+    """
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), None)
+    finally:
+        workbook.close()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return column_names(header) if header is not None else []
+
+def check_header(header, required, name):
+    """
+    Check that the header has the required columns.
+
+    :raises ValueError: Listing the missing columns.
+    """
+    missing = [col for col in required if col not in header]
+    if missing:
+        raise ValueError(f"The {name} data has no {', '.join(missing)} column, found {header}")
+
+def _read_read_only(source, usecols):
+    """Stream the rows of the first sheet as plain values, keeping only the cells of the usecols."""
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        columns = column_names(header)
+        keep = [i for i, col in enumerate(columns) if usecols is None or col in usecols]
+
+        data = []
+        last = 0
+        for row in rows:
+            data.append([row[i] if i < len(row) else None for i in keep])
+            # pd.read_excel only drops the empty rows at the end of the sheet
+            if any(value is not None for value in row):
+                last = len(data)
+        del data[last:]
+    finally:
+        workbook.close()
+    return parse_rows(data, [columns[i] for i in keep])
+
+def read_excel_in_chunks(source, chunk_size):
+    """
+    Read the first sheet of an Excel file as DataFrames of at most chunk_size rows.
+
+    The rows are streamed with openpyxl in read-only mode, so only the current batch
+    is held in memory instead of the whole workbook.
+
+    :param source: The path of the Excel file, or a file object.
+    :param chunk_size: The maximum number of rows per yielded DataFrame.
+    """
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = column_names(header)
+
+        batch = []
+        empty_rows = []
+        for row in rows:
+            # Hold back empty rows, pd.read_excel only drops them at the end of the sheet
+            if all(value is None for value in row):
+                empty_rows.append(row[:len(columns)])
+                continue
+            batch.extend(empty_rows)
+            empty_rows = []
+            batch.append(row[:len(columns)])
+            while len(batch) >= chunk_size:
+                yield parse_rows(batch[:chunk_size], columns)
+                batch = batch[chunk_size:]
+        if batch:
+            yield parse_rows(batch, columns)
+    finally:
+        workbook.close()
+
+def read_excel(source, usecols=None, engine='auto'):
+    """
+    Read the first sheet of an Excel file with the selected engine.
+
+    :param source: The path of the Excel file, or a file object.
+    :param usecols: The columns to read, the others are not converted. Columns not in the file are ignored.
+    :param engine: One of ENGINES or 'auto', see select_engine. 'openpyxl' is the plain pd.read_excel.
+    """
+    engine = select_engine(engine)
+    if engine == 'openpyxl_read_only':
+        return _read_read_only(source, usecols)
+    return pd.read_excel(source, engine=engine, usecols=None if usecols is None else lambda col: col in usecols)
+
+def used_columns(required_cols, read_cols):
+    """
+    Get the columns to read of each table: the required columns, then the other columns the pipeline uses.
+
+    :param required_cols: The required columns by table name.
+    :param read_cols: The other columns read by table name, all the columns of a table without an entry are read.
+    :return: The columns by table name, None for the tables read whole.
+    """
+    return {name: list(dict.fromkeys(cols + read_cols[name])) if name in read_cols else None for name, cols in required_cols.items()}
@@ -0,0 +1,130 @@
+# fx_rates.py file
+
+import functools
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+def _long_format(rates):
+    """
+    Get the rates as (Date, Currency, Rate) rows. A wide table with one column per currency, as in the ECB
+    reference rate files (Date, USD, JPY, ...), is melted into that shape.
+    """
+    rates = rates.rename(columns=lambda column: str(column).strip())
+    if 'Currency' not in rates.columns:
+        rates = rates.loc[:, [column for column in rates.columns if column and not column.startswith('Unnamed')]]
+        rates = rates.melt(id_vars='Date', var_name='Currency', value_name='Rate')
+    rates = pd.DataFrame({
+        'Date': pd.to_datetime(rates['Date']),
+        'Currency': rates['Currency'].astype(str).str.strip(),
+        # The ECB files mark days without a rate with N/A
+        'Rate': pd.to_numeric(rates['Rate'], errors='coerce')
+    })
+    return rates.dropna().sort_values('Date', kind='stable').reset_index(drop=True)
+
+@functools.lru_cache(maxsize=8)
+def _read_rates(path, mtime_ns):
+    """Read and prepare a rate file once per version of the file, later reads are served from memory."""
+    if path.endswith('.csv'):
+        return _long_format(pd.read_csv(path))
+    return _long_format(feather.read_table(path, memory_map=True).to_pandas())
+
+class FxRates:
+    def __init__(self, rates, base='EUR', max_age_days=7):
+        """
+        Initialize the FxRates, a date-indexed table of exchange rates.
+
+        :param rates: A DataFrame of (Date, Currency, Rate) rows, or one column per currency (see _long_format).
+                      Rate is the number of units of the currency per unit of the base currency, as the ECB publishes them.
+        :param base: The currency the amounts are converted to.
+        :param max_age_days: How old the last rate before a date may be, e.g. over weekends and holidays.
+                             Older rates are not used and the amount is not converted.
+        """
+        self.rates = rates if list(rates.columns) == ['Date', 'Currency', 'Rate'] else _long_format(rates)
+        self.base = base
+        self.max_age = pd.Timedelta(days=max_age_days)
+
+    @classmethod
+    def from_file(cls, path, base='EUR', max_age_days=7):
+        """
+        Load the rates from a CSV file or an Arrow file (memory-mapped), see save.
+        The parsed file is kept in an LRU cache until it changes, so e.g. every batch does not read it again.
+        """
+        return cls(_read_rates(os.path.abspath(path), os.stat(path).st_mtime_ns), base, max_age_days)
+
+    def save(self, path):
+        """Save the rates as an uncompressed Arrow file, which from_file memory-maps."""
+        feather.write_feather(pa.Table.from_pandas(self.rates, preserve_index=False), path, compression='uncompressed')
+
+    def convert(self, df, amount_col='Amount', currency_col='Currency', date_col='Date'):
+        """
+        Convert the amounts of a DataFrame to the base currency, with the last rate of each currency on or before each date.
+
+        All the rows are joined to the rates at once, with an as-of join by currency on the sorted dates.
+
+        :return: The converted amounts as a float Series with the index of df, NaN where there is no rate.
+        """
+        amounts = pd.to_numeric(df[amount_col], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        currencies = df[currency_col].astype(object).where(df[currency_col].notna())
+        dates = pd.to_datetime(df[date_col], errors='coerce')
+        derived = np.full(len(df), np.nan)
+
+        is_base = (currencies == self.base).to_numpy()
+        derived[is_base] = amounts[is_base]
+
+        # The join needs dates, and only the amounts in other currencies need a rate
+        valid = (dates.notna() & currencies.notna()).to_numpy() & ~is_base
+        left = pd.DataFrame({
+            'Date': dates.to_numpy()[valid].astype('datetime64[ns]'),
+            'Currency': currencies.to_numpy()[valid].astype(str),
+            'position': np.flatnonzero(valid)
+        }).sort_values('Date', kind='stable')
+        rates = self.rates.assign(Date=self.rates['Date'].astype('datetime64[ns]'))
+        joined = pd.merge_asof(left, rates, on='Date', by='Currency', direction='backward', tolerance=self.max_age)
+
+        positions = joined['position'].to_numpy()
+        derived[positions] = amounts[positions] / joined['Rate'].to_numpy()
+        return pd.Series(derived, index=df.index, name=amount_col)
+
+def find_mismatches(values, derived, tolerance=0.02):
+    """
+    Flag the values that differ from the derived ones by more than tolerance (relative to the derived value).
+    Values without a derived value are not flagged.
+
+    :return: A boolean numpy array.
+    """
+    values = pd.to_numeric(values, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+    derived = derived.to_numpy(dtype='float64')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return ~np.isnan(derived) & ~(np.abs(values - derived) <= tolerance * np.abs(derived))
+
+def apply_fx_rates(df, fx_rates, mode='check', tolerance=0.02):
+    """
+    Check, or derive, the In EUR column of the spending data from Amount, Currency and Date.
+
+    :param df: The spending data, with a parsed Date column. Its In EUR column is replaced in derive mode.
+    :param fx_rates: The FxRates.
+    :param mode: 'check' only flags the rows whose In EUR differs from the derived value, 'derive' also
+                 replaces In EUR by the derived value (rounded to cents) where there is a rate.
+    :param tolerance: The relative difference allowed, see find_mismatches.
+    :return: The rows whose spreadsheet In EUR differs from the derived value, with the derived value as Derived In EUR.
+    """
+    derived = fx_rates.convert(df)
+    rows = np.flatnonzero(find_mismatches(df['In EUR'], derived, tolerance))
+    mismatches = df.take(rows).assign(**{'Derived In EUR': derived.take(rows).round(2)})
+    if len(rows):
+        logging.warning(f"In EUR differs from the value derived from Amount, Currency and Date on {len(rows)} rows, "
+                        f"e.g. {rows[:5].tolist()}")
+    if mode == 'derive':
+        df['In EUR'] = derived.round(2).fillna(df['In EUR'])
+    return mismatches
+
+def from_config(config):
+    """The FxRates of the configured fx_rates_path, None if no rate file is configured."""
+    if not config.get('fx_rates_path'):
+        return None
+    return FxRates.from_file(config['fx_rates_path'], base=config.get('fx_base_currency', 'EUR'),
+                             max_age_days=config.get('fx_rates_max_age_days', 7))
@@ -0,0 +1,140 @@
+# instrumentation.py file
+
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss():
+    """Get the peak resident set size of the process in bytes, None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def count_rows(data):
+    """Count the rows of a DataFrame or Arrow table, or of the tables of a dict, None for anything else."""
+    if isinstance(data, (pd.DataFrame, pa.Table)):
+        return len(data)
+    if isinstance(data, dict) and data and all(isinstance(df, (pd.DataFrame, pa.Table)) for df in data.values()):
+        return sum(len(df) for df in data.values())
+    return None
+
+class RunReport:
+    def __init__(self, pipeline):
+        """
+        Initialize the RunReport, which records the wall time, CPU time, peak RSS growth and rows of every stage of a run.
+
+        CPU time is the time of the thread running the stage, so stages running concurrently are measured separately,
+        but work done in worker pools is not included. The peak RSS is the high-water mark of the whole process:
+        the delta is how much a stage raised it.
+
+        :param pipeline: The name of the pipeline, e.g. 'v1' or 'v2'.
+        """
+        self.pipeline = pipeline
+        self.started_at = datetime.datetime.now()
+        self.started = time.perf_counter()
+        self.stages = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        Measure the code of a with block as a stage. The yielded dict takes the 'rows_out' of the stage.
+
+        :param name: The name of the stage.
+        :param rows_in: The number of input rows, if known.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, 'success': False}
+        wall, cpu, peak = time.perf_counter(), time.thread_time(), peak_rss()
+        try:
+            yield record
+            record['success'] = True
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.thread_time() - cpu
+            record['peak_rss_delta_bytes'] = peak_rss() - peak if peak is not None else None
+            with self.lock:
+                self.stages.append(record)
+            logging.info(f"Stage {name}: {record['wall_seconds']:.2f}s wall, {record['cpu_seconds']:.2f}s CPU, "
+                         f"rows {record['rows_in']} -> {record['rows_out']}")
+
+    def instrument(self, name):
+        """
+        Decorate a function to measure it as a stage, counting the rows of its first argument and of its result.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                inputs = list(args) + list(kwargs.values())
+                with self.stage(name, rows_in=count_rows(inputs[0]) if inputs else None) as record:
+                    result = func(*args, **kwargs)
+                    record['rows_out'] = count_rows(result)
+                return result
+            return wrapper
+        return decorator
+
+    def to_dict(self):
+        with self.lock:
+            stages = list(self.stages)
+        return {
+            'pipeline': self.pipeline,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'wall_seconds': time.perf_counter() - self.started,
+            'peak_rss_bytes': peak_rss(),
+            'stages': stages
+        }
+
+    def to_prometheus(self):
+        """Format the report in the Prometheus text format, one gauge per measure, labelled by pipeline and stage."""
+        report = self.to_dict()
+        metrics = {
+            'wall_seconds': 'Wall time of the stage in seconds.',
+            'cpu_seconds': 'CPU time of the thread running the stage in seconds.',
+            'peak_rss_delta_bytes': 'Growth of the peak resident set size during the stage in bytes.',
+            'rows_in': 'Rows going into the stage.',
+            'rows_out': 'Rows coming out of the stage.',
+            'success': 'Whether the stage succeeded.'
+        }
+        lines = []
+        for measure, description in metrics.items():
+            lines.append(f"# HELP pipeline_stage_{measure} {description}")
+            lines.append(f"# TYPE pipeline_stage_{measure} gauge")
+            for record in report['stages']:
+                if record[measure] is not None:
+                    lines.append(f'pipeline_stage_{measure}{{pipeline="{self.pipeline}",stage="{record["stage"]}"}} {float(record[measure])}')
+        lines.append("# HELP pipeline_run_wall_seconds Wall time of the run in seconds.")
+        lines.append("# TYPE pipeline_run_wall_seconds gauge")
+        lines.append(f'pipeline_run_wall_seconds{{pipeline="{self.pipeline}"}} {report["wall_seconds"]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, folder, prometheus=False):
+        """
+        Write the report as {pipeline}_run_{start time}.json in folder, so runs can be compared,
+        and optionally as {pipeline}_run.prom for a Prometheus textfile collector.
+
+        :return: The path of the JSON report.
+        """
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{self.pipeline}_run_{self.started_at.strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, default=str)
+        if prometheus:
+            with open(os.path.join(folder, f"{self.pipeline}_run.prom"), 'w') as f:
+                f.write(self.to_prometheus())
+        logging.info(f"Run report written to {path}")
+        return path
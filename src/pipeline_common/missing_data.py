@@ -0,0 +1,85 @@
+# missing_data.py file
+
+import logging
+import numpy as np
+
+def missing_mask(df, columns):
+    """
+    Flag the rows missing a value in any of the columns, as a boolean numpy array.
+
+    The columns are checked one by one, so the required columns are not copied into a new DataFrame.
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    for column in columns:
+        mask |= df[column].isna().to_numpy()
+    return mask
+
+class MissingDataChecker:
+    """
+    The missing data checks of the DataFrames in self.data, shared by the v1 DataProcessor and the v2 DataTransformer.
+    A proportion of missing data above the threshold raises missing_data_error.
+    """
+    missing_data_error = ValueError
+
+    def find_missing_rows(self, required_cols, threshold=None):
+        """
+        Find the rows missing a value in the required columns, without copying any data.
+
+        The null mask of each DataFrame is computed once, column by column, and the missing data
+        threshold is checked on its counts before any rows are copied, so the check fails fast.
+
+        :param required_cols: A dictionary specifying the required columns for each DataFrame.
+        :param threshold: The threshold for missing data, not checked if None.
+        :return: The positions of the rows with missing values, as numpy arrays by name.
+        """
+        missing_rows = {}
+        for name, df in self.data.items():
+            missing_rows[name] = np.flatnonzero(missing_mask(df, required_cols[name]))
+            if threshold is not None:
+                self.check_missing_count(name, len(missing_rows[name]), len(df), threshold)
+        return missing_rows
+
+    def check_data(self, required_cols, threshold=None):
+        """
+        Check for missing data in the required columns, and separate the rows with missing values.
+
+        :param required_cols: A dictionary specifying the required columns for each DataFrame.
+        :param threshold: The threshold for missing data, checked before the data is split if given.
+        :return: The missing and the checked data. A DataFrame without missing rows is returned as is, not copied.
+        """
+        missing_data = {}
+        checked_data = {}
+
+        for name, rows in self.find_missing_rows(required_cols, threshold).items():
+            df = self.data[name]
+            if not len(rows):
+                missing_data[name] = df.iloc[:0]
+                checked_data[name] = df
+                continue
+
+            # Log a warning if any missing values are found
+            logging.warning(f"Null values found in {name} data")
+
+            # Split by position, the index labels may repeat
+            keep = np.ones(len(df), dtype=bool)
+            keep[rows] = False
+            missing_data[name] = df.take(rows)
+            checked_data[name] = df[keep]
+
+        return missing_data, checked_data
+
+    def check_missing_data_threshold(self, missing_data, threshold):
+        """Check if the proportion of missing data exceeds the given threshold."""
+        for name, df in missing_data.items():
+            self.check_missing_count(name, len(df), len(self.data[name]), threshold)
+
+    def check_missing_count(self, name, missing_count, total_count, threshold):
+        """Check if missing_count out of total_count rows exceeds the given threshold."""
+        # IF there are missing data
+        if missing_count:
+            missing_proportion = missing_count / total_count
+            logging.warning(f"Missing data proportion on {name}: {missing_proportion}")
+
+            # Check if missing data exceeds the threshold
+            if missing_proportion > threshold:
+                raise self.missing_data_error(f"Proportion of missing data in {name} exceeds threshold({threshold}): {missing_proportion}")
@@ -0,0 +1,170 @@
+# run_cache.py file
+
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from pipeline_common.dtype_optimizer import table_to_frame
+
+MANIFEST = 'manifest.json'
+
+def file_hash(path, block_size=1024 * 1024):
+    """Get the sha256 of the content of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# The modules shared by both pipelines, this one included, part of the code version of each
+SHARED_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+def code_version(folder):
+    """
+    Get a hash of the Python sources of a folder and of the shared pipeline_common modules,
+    so a change to the code gives new cache keys.
+    """
+    digest = hashlib.sha256(pd.__version__.encode())
+    for path in sorted(glob.glob(os.path.join(folder, '*.py'))) + sorted(glob.glob(os.path.join(SHARED_FOLDER, '*.py'))):
+        digest.update(os.path.basename(path).encode())
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+class RunCache:
+    def __init__(self, folder, max_bytes=None, max_age_days=None, force=False):
+        """
+        Initialize the RunCache, which keeps the results of pipeline stages under a key of their inputs.
+
+        An entry is a folder of folder/<stage>/<key> with the DataFrames (as Arrow files), a pickled value
+        and copies of the output files of the stage, written atomically. Entries not used for max_age_days,
+        then the least recently used ones above max_bytes in total, are evicted after every store.
+
+        :param folder: The folder of the cache.
+        :param max_bytes: The maximum total size of the entries, unlimited if None.
+        :param max_age_days: The number of days an entry is kept after its last use, unlimited if None.
+        :param force: Whether to ignore the stored entries, the new results are stored all the same.
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.force = force
+
+    @staticmethod
+    def key(stage, *parts):
+        """Hash the stage name and its inputs (content hashes, ETags, config values, code version) into a key."""
+        return hashlib.sha256(json.dumps([stage, parts], sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self.folder, stage, key)
+
+    def lookup(self, stage, key):
+        """
+        Get the folder of the entry of a stage and key, None if there is none or force is set.
+        A hit marks the entry as recently used.
+        """
+        path = self._path(stage, key)
+        manifest = os.path.join(path, MANIFEST)
+        if self.force or not os.path.exists(manifest):
+            return None
+        os.utime(manifest)
+        logging.info(f"Run cache hit for stage {stage} ({key[:12]}).")
+        return path
+
+    def store(self, stage, key, frames=None, value=None, files=None):
+        """
+        Store the results of a stage.
+
+        :param frames: DataFrames or Arrow tables by name.
+        :param value: Any picklable result, e.g. None for a stage without one.
+        :param files: Paths of output files of the stage, restored by restore_files.
+        :return: The folder of the entry.
+        """
+        os.makedirs(os.path.join(self.folder, stage), exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=f".{key[:12]}_", dir=os.path.join(self.folder, stage))
+        manifest = {'stage': stage, 'key': key, 'created': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'frames': [], 'files': []}
+        try:
+            for name, df in (frames or {}).items():
+                table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+                feather.write_feather(table, os.path.join(temporary, f"{name}.arrow"), compression='uncompressed')
+                manifest['frames'].append(name)
+            with open(os.path.join(temporary, 'value.pkl'), 'wb') as f:
+                pickle.dump(value, f)
+            for i, path in enumerate(files or []):
+                cached = f"{i}_{os.path.basename(path)}"
+                shutil.copyfile(path, os.path.join(temporary, cached))
+                stat = os.stat(path)
+                manifest['files'].append({'path': os.path.abspath(path), 'cached': cached, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+            # The manifest is written last, an entry without one is incomplete
+            with open(os.path.join(temporary, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=4)
+
+            path = self._path(stage, key)
+            if os.path.exists(path):
+                shutil.rmtree(path, ignore_errors=True)
+            os.replace(temporary, path)
+        except Exception:
+            shutil.rmtree(temporary, ignore_errors=True)
+            raise
+        self.evict()
+        return path
+
+    @staticmethod
+    def _manifest(path):
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+
+    def load_frames(self, path):
+        """Read the DataFrames of an entry, memory-mapped, with the dtypes stored in their schema (see dtype_optimizer.table_to_frame)."""
+        return {name: table_to_frame(feather.read_table(os.path.join(path, f"{name}.arrow"), memory_map=True))
+                for name in self._manifest(path)['frames']}
+
+    def load_value(self, path):
+        with open(os.path.join(path, 'value.pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def restore_files(self, path):
+        """Copy the output files of an entry back to their paths, unless they are still the files that were stored."""
+        for file in self._manifest(path)['files']:
+            if os.path.exists(file['path']):
+                stat = os.stat(file['path'])
+                if (stat.st_size, stat.st_mtime_ns) == (file['size'], file['mtime_ns']):
+                    continue
+            os.makedirs(os.path.dirname(file['path']), exist_ok=True)
+            shutil.copyfile(os.path.join(path, file['cached']), file['path'])
+            # Keep the stored time, so the next restore knows the file is unchanged
+            os.utime(file['path'], ns=(file['mtime_ns'], file['mtime_ns']))
+
+    def _entries(self):
+        """The complete entries as (last used, size, path), oldest first."""
+        entries = []
+        for manifest in glob.glob(os.path.join(self.folder, '*', '*', MANIFEST)):
+            path = os.path.dirname(manifest)
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            entries.append((os.path.getmtime(manifest), size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the entries unused for max_age_days, then the least recently used ones until max_bytes is met."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        oldest = time.time() - self.max_age_days * 86400 if self.max_age_days is not None else None
+        for last_used, size, path in entries:
+            too_old = oldest is not None and last_used < oldest
+            too_large = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_large):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logging.info(f"Run cache entry {os.path.relpath(path, self.folder)} evicted.")
@@ -0,0 +1,78 @@
+# stay_index.py file
+
+import logging
+import numpy as np
+import pandas as pd
+
+# The spending column holding the Order of the stay of the row, the foreign key to places
+STAY_KEY = 'Stay_Order'
+
+class StayIndex:
+    def __init__(self, arrival_dates, nights, orders=None):
+        """
+        Build an interval index of the stays, a stay covering [Arrival_Date, Arrival_Date + Nights).
+
+        The stays are sorted by arrival once, then every date is found with a binary search, so assigning
+        n dates to m stays takes O((n + m) log m) instead of comparing every date with every stay.
+        Where stays overlap, a date goes to the stay that started last.
+
+        :param arrival_dates: The arrival date of each stay.
+        :param nights: The number of nights of each stay, a stay without nights covers no date.
+        :param orders: The Order of each stay, needed for orders_of().
+        """
+        starts = pd.to_datetime(pd.Series(arrival_dates)).to_numpy(dtype='datetime64[ns]')
+        days = pd.to_numeric(pd.Series(nights), errors='coerce').fillna(0).to_numpy(dtype='int64')
+        self.sort_order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.sort_order]
+        self.ends = self.starts + days[self.sort_order].astype('timedelta64[D]')
+        self.orders = None
+        if orders is not None:
+            orders = pd.Series(orders).reset_index(drop=True)
+            dtype = orders.dtype if pd.api.types.is_extension_array_dtype(orders.dtype) and pd.api.types.is_integer_dtype(orders.dtype) else 'Int64'
+            self.orders = pd.array(orders, dtype=dtype)
+            if orders.duplicated().any():
+                logging.warning(f"The Order of the stays is not unique ({sorted(orders[orders.duplicated()].unique().tolist())}), "
+                                f"the stays sharing an Order are joined as one.")
+
+    @classmethod
+    def from_places(cls, places_data: pd.DataFrame) -> 'StayIndex':
+        """Build the index of the cleaned places data."""
+        return cls(places_data['Arrival_Date'], places_data['Nights'], places_data['Order'] if 'Order' in places_data.columns else None)
+
+    def positions(self, dates) -> np.ndarray:
+        """Get the position of the stay of each date in the places data, -1 if the date is in no stay."""
+        dates = pd.to_datetime(pd.Series(dates)).to_numpy(dtype='datetime64[ns]')
+        if not len(self.starts):
+            return np.full(len(dates), -1)
+        positions = np.searchsorted(self.starts, dates, side='right') - 1
+        candidates = np.maximum(positions, 0)
+        found = (positions >= 0) & ~np.isnat(dates) & (dates < self.ends[candidates])
+        return np.where(found, self.sort_order[candidates], -1)
+
+    def orders_of(self, dates) -> pd.api.extensions.ExtensionArray:
+        """Get the Order of the stay of each date as a nullable integer array, missing if the date is in no stay."""
+        if self.orders is None:
+            raise ValueError("The stay index was built without the Order of the stays")
+        return self.orders.take(self.positions(dates), allow_fill=True)
+
+def assign_stays(dates, arrival_dates, nights) -> np.ndarray:
+    """
+    Find the stay each date falls in, see StayIndex.
+
+    :return: The position of the stay of each date in arrival_dates, -1 if the date is in no stay.
+    """
+    return StayIndex(arrival_dates, nights).positions(dates)
+
+def link_stays(spending_data: pd.DataFrame, places_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Store the Order of the stay of every spending row as the integer foreign key column Stay_Order.
+
+    :param spending_data: The cleaned spending data, with 'Date'. Not modified.
+    :param places_data: The cleaned places data, with 'Order', 'Arrival_Date' and 'Nights'.
+    :return: A shallow copy of the spending data with the Stay_Order column, missing for the rows in no stay.
+    """
+    spending_data = spending_data.copy(deep=False)
+    spending_data[STAY_KEY] = StayIndex.from_places(places_data).orders_of(spending_data['Date'])
+    linked = spending_data[STAY_KEY].notna().sum()
+    logging.info(f"{linked} of {len(spending_data)} spending rows linked to a stay.")
+    return spending_data
@@ -0,0 +1,90 @@
+# aggregations.py file
+
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+from pipeline_common.stay_index import STAY_KEY
+
+def spending_vs_nights(spending_data: pd.DataFrame, places_data: pd.DataFrame, keys: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Join the total spending and the total nights per place.
+
+    Both sides are reduced to one row per key before the join, so the result has at most one row
+    per place instead of one per (spending row, stay) pair of the same city.
+
+    :param spending_data: The cleaned spending data, with 'In EUR' and the key columns.
+    :param places_data: The cleaned places data, with 'Nights' and the key columns.
+    :param keys: The columns identifying a place. Defaults to the stay: the spending rows linked to a stay
+                 (Stay_Order, see stay_index.link_stays) are joined to it by its integer Order, so two visits
+                 of a city are kept apart. Without the link the default is ['City'], as the spending data
+                 stores country codes and the places data country names.
+    :return: A DataFrame with the key columns ('Order' and 'City' for the stays), 'In EUR' and 'Nights'.
+    """
+    if keys is None and STAY_KEY in spending_data.columns and 'Order' in places_data.columns:
+        spending_totals = spending_data.groupby(STAY_KEY, sort=False)['In EUR'].sum()
+        stays = places_data[['Order', 'City', 'Nights']]
+        if not stays['Order'].is_unique:
+            stays = stays.groupby('Order', sort=False, observed=True).agg({'City': 'first', 'Nights': 'sum'}).reset_index()
+        # An integer hash lookup of every stay in the spending totals, in the order of the stays
+        positions = pd.Index(spending_totals.index.astype('int64')).get_indexer(stays['Order'].astype('int64'))
+        found = positions >= 0
+        joined = stays.iloc[np.flatnonzero(found)].reset_index(drop=True)
+        joined.insert(2, 'In EUR', spending_totals.to_numpy()[positions[found]])
+        return joined
+    keys = list(keys or ['City'])
+    spending_totals = spending_data.groupby(keys, sort=False, observed=True)['In EUR'].sum()
+    nights_totals = places_data.groupby(keys, sort=False, observed=True)['Nights'].sum()
+    return pd.concat([spending_totals, nights_totals], axis=1, join='inner').reset_index()
+
+# Dimensions of the summary cube, the ones missing from a table are left out
+CUBE_DIMENSIONS = ['City', 'Country', 'Category']
+
+class SummaryCube:
+    def __init__(self, spending_data: pd.DataFrame, places_data: pd.DataFrame):
+        """
+        Build a summary cube of the spending and places data.
+
+        Each table is aggregated in a single groupby to one row per (City, Country, Category, day)
+        holding the sum and the count of its measure ('In EUR' for spending, 'Nights' for places).
+        Totals, means, top-N and rollups by any of these dimensions are then computed from the cube
+        without touching the raw rows.
+
+        :param spending_data: The cleaned spending data.
+        :param places_data: The cleaned places data.
+        """
+        self.cubes = {
+            'In EUR': self._aggregate(spending_data, 'In EUR', 'Date'),
+            'Nights': self._aggregate(places_data, 'Nights', 'Arrival_Date')
+        }
+
+    @staticmethod
+    def _aggregate(data: pd.DataFrame, measure: str, date_col: str) -> pd.DataFrame:
+        keys = [data[col] for col in CUBE_DIMENSIONS if col in data.columns]
+        if date_col in data.columns:
+            dates = data[date_col]
+            keys.append((dates.dt.normalize() if pd.api.types.is_datetime64_any_dtype(dates) else dates).rename('Date'))
+        values = data[measure]
+        if not keys:
+            return pd.DataFrame({'sum': [values.sum()], 'count': [values.count()]})
+        return values.groupby(keys, sort=False, dropna=False, observed=True).agg(['sum', 'count']).reset_index()
+
+    def total(self, measure: str) -> float:
+        """Get the sum of a measure."""
+        return self.cubes[measure]['sum'].sum()
+
+    def mean(self, measure: str) -> float:
+        """Get the mean of a measure over the rows where it is set."""
+        cube = self.cubes[measure]
+        return cube['sum'].sum() / cube['count'].sum()
+
+    def rollup(self, measure: str, dimensions: List[str]) -> pd.DataFrame:
+        """
+        Aggregate a measure by some of the cube dimensions.
+
+        :return: A DataFrame indexed by the dimensions, with the 'sum' and 'count' of the measure.
+        """
+        return self.cubes[measure].groupby(dimensions, sort=False, observed=True)[['sum', 'count']].sum()
+
+    def top(self, measure: str, dimension: str, n: int = 5) -> pd.Series:
+        """Get the n values of a dimension with the highest sum of a measure."""
+        return self.rollup(measure, [dimension])['sum'].nlargest(n).rename(measure)
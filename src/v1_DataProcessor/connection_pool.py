@@ -0,0 +1,211 @@
+# connection_pool.py file
+
+from dotenv import load_dotenv
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import threading
+import time
+import logging
+
+#logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+def snowflake_connect():
+    """
+    Open a Snowflake session with the credentials of the environment (or the .env file).
+    The session is kept alive while it waits in the pool.
+    """
+    import snowflake.connector
+    load_dotenv()
+    return snowflake.connector.connect(
+        user=os.getenv('SNOWFLAKE_USER'),
+        password=os.getenv('SNOWFLAKE_PASSWORD'),
+        account=os.getenv('SNOWFLAKE_ACCOUNT'),
+        region=os.getenv('SNOWFLAKE_REGION'),
+        role=os.getenv('SNOWFLAKE_ROLE'),
+        warehouse=os.getenv('SNOWFLAKE_WAREHOUSE'),
+        client_session_keep_alive=True
+    )
+
+def snowflake_use_schema(con, database: Optional[str], schema: Optional[str]) -> None:
+    """Switch a pooled Snowflake session to another database / schema."""
+    cur = con.cursor()
+    try:
+        if database and schema:
+            cur.execute(f"USE SCHEMA {database}.{schema}")
+        elif database:
+            cur.execute(f"USE DATABASE {database}")
+    finally:
+        cur.close()
+
+def snowflake_current_schema(con) -> Tuple[Optional[str], Optional[str]]:
+    """The database / schema a Snowflake session is using, as tracked by the connector after every statement, USE included."""
+    return con.database, con.schema
+
+def _normalize(context: Tuple[Optional[str], Optional[str]]) -> Tuple[Optional[str], Optional[str]]:
+    # Unquoted identifiers are case insensitive
+    return tuple(name.upper() if name else None for name in context)
+
+class ConnectionPool:
+    def __init__(self, connect: Callable[[], Any],
+                 max_size: int = 4,
+                 use_schema: Optional[Callable[[Any, Optional[str], Optional[str]], None]] = None,
+                 current_schema: Optional[Callable[[Any], Tuple[Optional[str], Optional[str]]]] = None,
+                 health_check_query: str = "SELECT 1",
+                 health_check_interval: float = 60):
+        """
+        Initialize a thread-safe pool of DB-API connections.
+
+        Connections are opened on demand, up to max_size, and returned to the pool instead of being closed,
+        so every stage of a run reuses the same warm sessions.
+
+        :param connect: A function opening a new connection, e.g. snowflake_connect or a sqlite3 one in tests.
+        :param max_size: The maximum number of connections, acquire() waits when they are all checked out.
+        :param use_schema: A function switching a connection to a database / schema, None if the backend has none.
+        :param current_schema: A function reading the database / schema a connection is using, so the switches made by
+                               the callers themselves (USE statements) are known when it is released. Without it,
+                               only the switches of acquire() are tracked.
+        :param health_check_query: The query checking that an idle connection still works.
+        :param health_check_interval: Idle connections are checked when they were not used for this many seconds.
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.use_schema = use_schema
+        self.current_schema = current_schema
+        self.health_check_query = health_check_query
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.idle: List[Tuple[Any, float]] = []
+        # The (database, schema) each connection is currently using, and the one it was opened with, by id
+        self.contexts: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.defaults: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        self.closed = False
+
+    def _is_healthy(self, con) -> bool:
+        try:
+            cur = con.cursor()
+            cur.execute(self.health_check_query)
+            cur.fetchall()
+            cur.close()
+            return True
+        except Exception as e:
+            logging.warning(f"Pooled connection failed its health check, replacing it: {e}")
+            return False
+
+    def _open(self):
+        con = self.connect()
+        logging.info("New pooled connection opened.")
+        context = _normalize(self.current_schema(con)) if self.current_schema is not None else (None, None)
+        self.contexts[id(con)] = context
+        self.defaults[id(con)] = context
+        return con
+
+    def _wanted(self, con, context: Tuple[Optional[str], Optional[str]]) -> Tuple[Optional[str], Optional[str]]:
+        # A request without a database gets the database / schema the connection was opened with
+        return context if context[0] else self.defaults.get(id(con), (None, None))
+
+    def _discard(self, con) -> None:
+        self.contexts.pop(id(con), None)
+        self.defaults.pop(id(con), None)
+        try:
+            con.close()
+        except Exception:
+            pass
+
+    def acquire(self, database: Optional[str] = None, schema: Optional[str] = None):
+        """
+        Check out a connection, preferring an idle one already using the database / schema.
+
+        A connection is always handed out using the requested database / schema, or the one it was opened with
+        if no database is given, so unqualified names never resolve in the schema of an earlier caller.
+        A connection switched away from having no database cannot be switched back, and is replaced.
+
+        :return: A connection, to be given back with release().
+        """
+        if self.closed:
+            raise RuntimeError("The connection pool is closed")
+        self.slots.acquire()
+        try:
+            context = _normalize((database, schema))
+            with self.lock:
+                matching = [i for i, (con, _) in enumerate(self.idle) if self.contexts.get(id(con)) == self._wanted(con, context)]
+                con, last_used = self.idle.pop(matching[-1] if matching else -1) if self.idle else (None, None)
+
+            if con is not None and time.monotonic() - last_used > self.health_check_interval and not self._is_healthy(con):
+                self._discard(con)
+                con = None
+            if con is None:
+                con = self._open()
+
+            wanted = self._wanted(con, context)
+            if self.use_schema is not None and self.contexts.get(id(con)) != wanted:
+                if wanted[0]:
+                    self.use_schema(con, *wanted)
+                    self.contexts[id(con)] = wanted
+                else:
+                    self._discard(con)
+                    con = self._open()
+            return con
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, con) -> None:
+        """Give a connection back to the pool, recording the database / schema the caller left it using."""
+        if self.current_schema is not None and not self.closed:
+            try:
+                self.contexts[id(con)] = _normalize(self.current_schema(con))
+            except Exception as e:
+                logging.warning(f"Could not read the schema of a pooled connection, closing it: {e}")
+                self._discard(con)
+                self.slots.release()
+                return
+        with self.lock:
+            if self.closed:
+                self._discard(con)
+            else:
+                self.idle.append((con, time.monotonic()))
+        self.slots.release()
+
+    @contextmanager
+    def connection(self, database: Optional[str] = None, schema: Optional[str] = None):
+        """Check out a connection for the duration of a with block."""
+        con = self.acquire(database, schema)
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    def close(self) -> None:
+        """Close the idle connections, the checked out ones are closed when they are released."""
+        with self.lock:
+            self.closed = True
+            for con, _ in self.idle:
+                self._discard(con)
+            self.idle = []
+        logging.info("Connection pool closed.")
+
+# The pool shared by every SnowflakeConnector of the process
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Get the shared pool, a Snowflake one unless set_pool() installed another backend."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ConnectionPool(snowflake_connect, use_schema=snowflake_use_schema, current_schema=snowflake_current_schema)
+        return _pool
+
+def set_pool(pool: Optional[ConnectionPool]) -> None:
+    """Replace the shared pool, e.g. with a local DB-API backend in tests."""
+    global _pool
+    with _pool_lock:
+        _pool = pool
+
+def close_pool() -> None:
+    """Close the shared pool if it was used."""
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
@@ -1,49 +1,110 @@
 # Data_analyzer.py file
 
 import pandas as pd
+import pyarrow as pa
 import logging
 import json
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple, Union
+import os
+import sys
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
+from intermediate_store import to_frame
+from aggregations import spending_vs_nights, SummaryCube
+from time_series import SpendingTimeSeries
 
 #logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
 class DataAnalyzer:
-    def __init__(self, cleaned_spending_data_path: str, cleaned_places_data_path: str):
+    def __init__(self, cleaned_spending_data_path: Union[str, pd.DataFrame, pa.Table], cleaned_places_data_path: Union[str, pd.DataFrame, pa.Table]):
         """
         Initialize the DataAnalyzer with spending and places data.
 
-        :param spending_data: The string path to the cleaned spending data.
-        :param places_data: The string path to the cleaned places data.
+        :param spending_data: The string path to the cleaned spending data, the cleaned DataFrame itself, or its memory-mapped Arrow table.
+        :param places_data: The string path to the cleaned places data, the cleaned DataFrame itself, or its memory-mapped Arrow table.
         """
         self.cleaned_spending_data_path = cleaned_spending_data_path
         self.cleaned_places_data_path = cleaned_places_data_path
         self.places_data = pd.DataFrame()
         self.spending_data = pd.DataFrame()
+        self.cube = None
+        self.time_series = None
+
+        # Data handed over in memory, DataFrames or the mapped tables of streaming mode, needs no reading
+        if not isinstance(cleaned_spending_data_path, str) and not isinstance(cleaned_places_data_path, str):
+            self.load_data()
 
     def load_data(self):
         """
-        Perform analysis on the spending and places data.
+        Load the spending and places data from their paths, or from the Arrow tables passed in memory.
+        """
+        self.places_data = self._read(self.cleaned_places_data_path)
+        self.spending_data = self._read(self.cleaned_spending_data_path)
+        self.cube = None
+        self.time_series = None
+
+    @staticmethod
+    def _read(data: Union[str, pd.DataFrame, pa.Table]) -> pd.DataFrame:
+        return to_frame(data)
+
+    def spending_vs_nights(self) -> pd.DataFrame:
+        """
+        Get the total spending and the total nights of every stay, with its Order and City,
+        or of every city if the spending is not linked to the stays (see aggregations.spending_vs_nights).
+        """
+        return spending_vs_nights(self.spending_data, self.places_data)
+
+    def build_cube(self) -> SummaryCube:
+        """
+        Get the summary cube of the data, built on first use with one pass over each table.
         """
-        self.places_data = pd.read_csv(self.cleaned_places_data_path)
-        self.spending_data = pd.read_csv(self.cleaned_spending_data_path)
+        if self.cube is None:
+            self.cube = SummaryCube(self.spending_data, self.places_data)
+        return self.cube
+
+    def build_time_series(self) -> SpendingTimeSeries:
+        """
+        Get the spending sorted by date, sorted on first use.
+        """
+        if self.time_series is None:
+            self.time_series = SpendingTimeSeries(self.spending_data)
+        return self.time_series
+
+    def spending_over_time(self, period: str = 'day', window: Optional[int] = None) -> pd.DataFrame:
+        """
+        Get the spending per day, week or month with its rolling mean and running total, see SpendingTimeSeries.by_period.
+        """
+        return self.build_time_series().by_period(period, window)
+
+    def cost_per_stay(self) -> pd.DataFrame:
+        """
+        Get the spending and the cost per night of every stay, see SpendingTimeSeries.cost_per_stay.
+        """
+        return self.build_time_series().cost_per_stay(self.places_data)
 
     def perform_analysis(self) -> Dict[str, float]:
         """
-        Perform analysis on the spending and places data.
+        Perform analysis on the spending and places data, computed from the summary cube.
         """
+        cube = self.build_cube()
+
         # Spending analysis
-        total_spending = self.spending_data['In EUR'].sum()
-        avg_spending = self.spending_data['In EUR'].mean()
+        total_spending = cube.total('In EUR')
+        avg_spending = cube.mean('In EUR')
 
         # Top 5 cities with most spending
-        top_cities = self.spending_data.groupby('City')['In EUR'].sum().nlargest(5)
+        top_cities = cube.top('In EUR', 'City', 5)
 
         # Places Analysis
-        total_nights = self.places_data['Nights'].sum()
-        avg_nights = self.places_data['Nights'].mean()
+        total_nights = cube.total('Nights')
+        avg_nights = cube.mean('Nights')
 
         # Top 5 cities with most nights spent
-        top_stay_cities = self.places_data.groupby('City')['Nights'].sum().nlargest(5)
+        top_stay_cities = cube.top('Nights', 'City', 5)
 
         logging.info(f"Total spending: {total_spending}")
         logging.info(f"Average spending: {avg_spending}")
@@ -66,8 +127,8 @@ def main():
         config=json.load(f)
 
     # Initialize the analyser
-    analyser = DataAnalyzer(cleaned_spending_data_path=config['cleaned_spending_output_path'],
-                            cleaned_places_data_path=config['cleaned_places_output_path'])
+    analyser = DataAnalyzer(cleaned_spending_data_path=config['cleaned_spending_intermediate_path'],
+                            cleaned_places_data_path=config['cleaned_places_intermediate_path'])
     
     analyser.load_data()
 
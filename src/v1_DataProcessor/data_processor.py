@@ -1,71 +1,161 @@
 #Data_processing.py file
 
 # Import necessary libraries
+import glob
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import pandas as pd
 import logging
 import json
+import os
+import shutil
+import sys
+import tempfile
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
+from intermediate_store import write_intermediate, map_intermediate, IntermediateWriter
+from pipeline_common.instrumentation import RunReport, count_rows
+from pipeline_common.dtype_optimizer import optimize_dtypes, log_report
+from pipeline_common.fx_rates import apply_fx_rates, from_config as fx_rates_from_config
+from pipeline_common.stay_index import link_stays
+from pipeline_common.excel_reader import read_excel, read_excel_in_chunks, read_header, check_header, used_columns
+from pipeline_common.missing_data import MissingDataChecker
 
 #logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
-class DataProcessor:
-    def __init__(self, file_paths, export_missing_data=True):
+def read_in_chunks(path, chunk_size):
+    """
+    Read an Excel or CSV file as DataFrames of at most chunk_size rows, see excel_reader.read_excel_in_chunks.
+
+    :param path: The path (or file object) of the file to read.
+    :param chunk_size: The maximum number of rows per yielded DataFrame.
+    """
+    if isinstance(path, str) and path.endswith('.csv'):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+    yield from read_excel_in_chunks(path, chunk_size)
+
+def expand_paths(path):
+    """
+    Expand a file path with glob characters, e.g. data/raw_data/spending_*.xlsx, to the sorted files it matches.
+    A plain path is returned as the only file.
+    """
+    if not glob.has_magic(path):
+        return [path]
+    paths = sorted(glob.glob(path))
+    if not paths:
+        raise FileNotFoundError(f"No file matches {path}")
+    return paths
+
+def process_shard(processor, name, path, required_cols):
+    """
+    Load, check and clean one file of a table. Module level, so it can run in a process pool.
+
+    The missing data threshold is not checked here, it applies to all the files of the table.
+
+    :return: The missing data, the cleaned data and the fx mismatches (None without rates) of the file.
+    """
+    processor.data = {name: processor.read_file(name, path, required_cols)}
+    processor.fx_mismatches = {}
+    missing_data, checked_data = processor.check_data(required_cols={name: required_cols[name]})
+    cleaned_data = processor.clean_data(data=checked_data)
+    return missing_data[name], cleaned_data[name], processor.fx_mismatches.get(name)
+
+class DataProcessor(MissingDataChecker):
+    def __init__(self, file_paths, export_missing_data=True, dtype_schema=None, fx_rates=None, fx_mode='check', fx_tolerance=0.02,
+                 usecols=None, excel_engine='auto'):
+        """
+        Initialize the DataProcessor.
+
+        :param file_paths: The path of the Excel (or CSV) file of each DataFrame.
+        :param export_missing_data: Whether export_data writes the rows with missing data.
+        :param dtype_schema: The compact dtype of the columns of each file, applied when the files are loaded whole
+                             (see dtype_optimizer.convert_column). Batches keep the parsed dtypes, as their categories differ.
+        :param fx_rates: The FxRates clean_data checks (or derives) the In EUR of the spending data with, if any.
+        :param fx_mode: 'check' or 'derive', see fx_rates.apply_fx_rates.
+        :param fx_tolerance: The relative difference allowed between In EUR and the derived value.
+        :param usecols: The columns to read of each file (see excel_reader.used_columns), a file without an entry is read whole.
+        :param excel_engine: The engine reading the Excel files, see excel_reader.select_engine.
+        """
         self.file_paths = file_paths
+        self.usecols = usecols or {}
+        self.excel_engine = excel_engine
         self.export_missing_data = export_missing_data
+        self.dtype_schema = dtype_schema or {}
+        self.dtype_reports = {}
+        self.fx_rates = fx_rates
+        self.fx_mode = fx_mode
+        self.fx_tolerance = fx_tolerance
+        self.fx_mismatches = {}
         self.data = {}
+        self.row_counts = {}
+        self.missing_counts = {}
         
-    def load_data(self):
-        # Load data from Excel files
+    def read_file(self, name, path, required_cols=None):
+        """
+        Read the usecols of an Excel or CSV file.
+
+        :param required_cols: The required columns of each file. If given, they are checked on the header
+                              before the whole file is parsed.
+        :raises ValueError: If a required column is not in the file.
+        """
+        usecols = self.usecols.get(name)
+        is_csv = path.endswith('.csv')
+        if required_cols is not None:
+            check_header(list(pd.read_csv(path, nrows=0).columns) if is_csv else read_header(path), required_cols[name], name)
+        if is_csv:
+            return pd.read_csv(path, usecols=None if usecols is None else lambda col: col in usecols)
+        return read_excel(path, usecols, self.excel_engine)
+
+    def load_data(self, required_cols=None):
+        """
+        Load data from the Excel (or CSV) files, see read_file.
+
+        :param required_cols: The required columns of each file, checked on the header first if given.
+        """
         for name, path in self.file_paths.items():
             try:
-                self.data[name] =  pd.read_excel(path)
+                self.data[name], self.dtype_reports[name] = optimize_dtypes(self.read_file(name, path, required_cols), self.dtype_schema.get(name))
                 logging.info(f"{name} data loaded successfully.")
+                log_report(name, self.dtype_reports[name])
             except Exception as e:
                 logging.error(f"An error occurred while loading the {name} data: {e}")
                 raise e
-        
-    
-    def check_data(self, required_cols):
-        missing_data = {}
-        checked_data = {}
 
-        for name, df in self.data.items():
-            # Check for nulls in required columns and separate rows with missing coluns
-            missing_data[name] = df[df[required_cols[name]].isnull().any(axis=1)]
-        
-            # Log a warning if any missing values are found
-            if not missing_data[name].empty:
-                logging.warning(f"Null values found in {name} data")
-
-            # Remove rows with missing values from the original data
-            checked_data[name] = df.drop(missing_data[name].index)
+    def load_data_in_chunks(self, chunk_size):
+        """
+        Load data from the files in batches of at most chunk_size rows.
 
-        return missing_data, checked_data
+        :param chunk_size: The maximum number of rows per batch.
+        :return: A generator of (name, DataFrame) tuples.
+        """
+        for name, path in self.file_paths.items():
+            try:
+                for chunk in read_in_chunks(path, chunk_size):
+                    yield name, chunk
+                logging.info(f"{name} data loaded successfully.")
+            except Exception as e:
+                logging.error(f"An error occurred while loading the {name} data: {e}")
+                raise e
     
-
-    # Check missing data percentage
-    def check_missing_data_threshold(self, missing_data, threshold):
-        for name, df in missing_data.items():
-            
-            # IF there are missing data
-            if not df.empty:
-                missing_proportion = len(df) / len(self.data[name])
-                logging.warning(f"Missing data proportion on {name}: {missing_proportion}")
-
-                # Check if missing data exceeds the threshold
-                if missing_proportion > threshold:
-                    raise ValueError(f"Proportion of missing data in {name} exceeds threshold({threshold}): {missing_proportion}")
-
-
     def clean_data(self, data):
         try:
             # Perform necessary data cleaning tasks
             for name, df in data.items():
-                df = df.copy() # Create a copy of the DataFrame
+                # A shallow copy, the cleaned columns are replaced rather than modified in place
+                df = df.copy(deep=False)
                 if name == 'spending':
                 # Spending data cleaning
                     df['Date'] = pd.to_datetime(df['Date'])
                     df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
                     df['Title'] = df['Title'].str.strip()
+                    if self.fx_rates is not None:
+                        # Keep the rows whose In EUR differs from the rates, to review manually
+                        self.fx_mismatches[name] = apply_fx_rates(df, self.fx_rates, self.fx_mode, self.fx_tolerance)
                 if name == 'places':
                 # Places data cleaning
                     df['Arrival_Date'] = pd.to_datetime(df['Arrival_Date'])
@@ -77,12 +167,38 @@ class DataProcessor:
             raise e
         return data
 
+    def link_stays(self, data):
+        """
+        Store the Order of the stay of every spending row as the integer foreign key column Stay_Order (see stay_index),
+        so the later joins of spending and places use it instead of the City strings.
+        Both tables are needed, so batches, which hold a single table, are not linked.
+        """
+        if 'spending' in data and 'places' in data:
+            try:
+                data['spending'] = link_stays(data['spending'], data['places'])
+            except Exception as e:
+                logging.error(f"An error occurred while linking the spending data to the stays: {e}")
+                raise e
+        return data
+
     # Export the cleaned and missing data
-    def export_data(self, cleaned_data, output_paths, missing_data, missing_data_output_paths):
+    def export_data(self, cleaned_data, output_paths, missing_data, missing_data_output_paths, append=False, intermediate_paths=None):
+        # Export cleaned data to the typed Arrow files read by the later stages
+        for name, path in (intermediate_paths or {}).items():
+            try:
+                write_intermediate(cleaned_data[name], path)
+                logging.info(f"{name} intermediate data exported successfully.")
+            except Exception as e:
+                logging.error(f"An error occurred while exporting the {name} intermediate data: {e}")
+                raise e
+
+        # Append mode adds the rows to an existing file without repeating the header
+        mode = 'a' if append else 'w'
+
         # Export cleaned data to a CSV file
         for name, path in output_paths.items():
             try:
-                cleaned_data[name].to_csv(path, index=False)
+                cleaned_data[name].to_csv(path, index=False, mode=mode, header=not append)
                 logging.info(f"{name} data exported successfully.")
             except Exception as e:
                 logging.error(f"An error occurred while exporting the {name} data: {e}")
@@ -91,7 +207,7 @@ class DataProcessor:
         if self.export_missing_data:
             for name, path in missing_data_output_paths.items():
                 try:
-                    missing_data[name].to_csv(path, index=False)
+                    missing_data[name].to_csv(path, index=False, mode=mode, header=not append)
                     logging.info(f"{name} missing data exported successfully.")
                 except Exception as e:
                     logging.error(f"An error occurred while exporting the {name} missing data: {e}")
@@ -104,57 +220,170 @@ class DataProcessor:
         :param required_cols: A dictionary specifying the required columns for each DataFrame.
         :param threshold: The threshold for missing data.
         """
-        self.load_data()
-        missing_data, checked_data = self.check_data(required_cols=required_cols)
-        self.check_missing_data_threshold(missing_data=missing_data, threshold=threshold)
-        cleaned_data = self.clean_data(data=checked_data)
+        self.load_data(required_cols=required_cols)
+        missing_data, checked_data = self.check_data(required_cols=required_cols, threshold=threshold)
+        cleaned_data = self.link_stays(self.clean_data(data=checked_data))
        
         return cleaned_data
 
-def main():
-    # Load the config file
-    with open('config.json') as f:
-        config=json.load(f)
+    def process_data_in_chunks(self, required_cols, threshold, chunk_size):
+        """
+        Load, check and clean data in batches of at most chunk_size rows.
+
+        The missing data threshold is checked on the totals of each file once
+        its last batch has been processed.
+
+        :param required_cols: A dictionary specifying the required columns for each DataFrame.
+        :param threshold: The threshold for missing data.
+        :param chunk_size: The maximum number of rows per batch.
+        :return: A generator of (name, missing data, cleaned data) tuples.
+        """
+        current_name = None
+        for name, chunk in self.load_data_in_chunks(chunk_size):
+            if name != current_name:
+                if current_name is not None:
+                    self.check_missing_count(current_name, self.missing_counts[current_name], self.row_counts[current_name], threshold)
+                current_name = name
+                self.row_counts[name] = 0
+                self.missing_counts[name] = 0
+
+            self.data = {name: chunk}
+            missing_data, checked_data = self.check_data(required_cols=required_cols)
+            self.row_counts[name] += len(chunk)
+            self.missing_counts[name] += len(missing_data[name])
 
+            cleaned_data = self.clean_data(data=checked_data)
+            yield name, missing_data[name], cleaned_data[name]
+
+        if current_name is not None:
+            self.check_missing_count(current_name, self.missing_counts[current_name], self.row_counts[current_name], threshold)
+
+    def process_data_sharded(self, required_cols, threshold, max_workers=None):
+        """
+        Load, check and clean tables split over many files, e.g. one workbook per trip or year, in a pool of processes.
+
+        The file paths may be globs (see expand_paths), every file is loaded, checked and cleaned in a worker.
+        The missing data threshold is checked on the totals of each table once all its files are done, then the
+        files are concatenated in the order of their paths, with the dtypes of dtype_schema.
+
+        :param required_cols: A dictionary specifying the required columns for each DataFrame.
+        :param threshold: The threshold for missing data.
+        :param max_workers: The number of processes, defaults to the number of CPUs.
+        :return: The missing and the cleaned data, by name.
+        """
+        shards = [(name, path) for name, pattern in self.file_paths.items() for path in expand_paths(pattern)]
+        self.data = {}
+        # Spawned workers, as forking the threads of the PipelineRunner can deadlock on the locks they hold
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = [pool.submit(process_shard, self, name, path, required_cols) for name, path in shards]
+            results = []
+            for (name, path), future in zip(shards, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logging.error(f"An error occurred while processing the {name} file {path}: {e}")
+                    raise e
+
+        missing_data = {}
+        cleaned_data = {}
+        for name in self.file_paths:
+            parts = [result for (shard_name, _), result in zip(shards, results) if shard_name == name]
+            logging.info(f"{name} data processed from {len(parts)} files.")
+            self.missing_counts[name] = sum(len(part[0]) for part in parts)
+            self.row_counts[name] = self.missing_counts[name] + sum(len(part[1]) for part in parts)
+            self.check_missing_count(name, self.missing_counts[name], self.row_counts[name], threshold)
+
+            missing_data[name] = pd.concat([part[0] for part in parts], ignore_index=True)
+            cleaned_data[name], self.dtype_reports[name] = optimize_dtypes(pd.concat([part[1] for part in parts], ignore_index=True),
+                                                                           self.dtype_schema.get(name))
+            log_report(name, self.dtype_reports[name])
+            mismatches = [part[2] for part in parts if part[2] is not None]
+            if mismatches:
+                self.fx_mismatches[name] = pd.concat(mismatches, ignore_index=True)
+        return missing_data, cleaned_data
+
+def process_in_chunks(processor, config, required_cols, output_paths, missing_data_output_paths, intermediate_paths):
+    """
+    Run the check, clean and export steps batch by batch, so memory use stays
+    bounded by the configured chunk size instead of the file size.
+
+    The places are processed first and kept in memory, as they are small, so every spending batch is linked
+    to the stays like the in-memory data (see link_stays). The cleaned batches are written to the Arrow files
+    of intermediate_paths, with the dtype_schema of the processor applied when they are read. The spending rows
+    whose In EUR differs from the rates are appended to the fx_mismatch_output_path of the config batch by batch.
+    """
+    # The places come first, the spending batches are linked to them
+    processor.file_paths = dict(sorted(processor.file_paths.items(), key=lambda item: item[0] != 'places'))
+    places_chunks = []
+    places_data = None
+    exported = set()
+    writers = {name: IntermediateWriter(path, processor.dtype_schema.get(name)) for name, path in intermediate_paths.items()}
+    try:
+        for name, missing_chunk, cleaned_chunk in processor.process_data_in_chunks(required_cols=required_cols,
+                                                                                    threshold=config['missing_data_threshold'],
+                                                                                    chunk_size=config['chunk_size']):
+            if name == 'places':
+                places_chunks.append(cleaned_chunk)
+            elif name == 'spending' and places_chunks:
+                if places_data is None:
+                    places_data = pd.concat(places_chunks, ignore_index=True)
+                cleaned_chunk = processor.link_stays({'spending': cleaned_chunk, 'places': places_data})['spending']
+            writers[name].write(cleaned_chunk)
+            processor.export_data(cleaned_data={name: cleaned_chunk},
+                                  output_paths={name: output_paths[name]} if name in output_paths else {},
+                                  missing_data={name: missing_chunk},
+                                  missing_data_output_paths={name: missing_data_output_paths[name]},
+                                  append=name in exported)
+            # The mismatches of the batch, the next batch replaces them
+            mismatches = processor.fx_mismatches.pop(name, None)
+            if name == 'spending' and mismatches is not None and config.get('fx_mismatch_output_path'):
+                mismatches.to_csv(config['fx_mismatch_output_path'], index=False, mode='a' if name in exported else 'w', header=name not in exported)
+            exported.add(name)
+    except Exception as e:
+        logging.error(f"An error occurred while processing the data in chunks: {e}")
+        return False
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return True
+
+def run(config, checkpoint=True, report=None):
+    """
+    Load, check, clean and export the data as configured.
+
+    :param config: The loaded config.json.
+    :param checkpoint: Whether to write the cleaned data to the intermediate files.
+    :param report: The RunReport measuring every step, if any.
+    :return: The cleaned DataFrames by name, memory-mapped Arrow tables in streaming mode, or None if a step failed.
+    """
+    report = report or RunReport('v1')
     file_paths = {
         'spending' : config['spending_file_path_local'],
         'places' : config['places_file_path_local']
     }
 
     # Use file paths from config file
-    processor = DataProcessor(file_paths=file_paths)
-
-    # Load Data
-    try:
-        processor.load_data()
-    except Exception as e:
-        logging.error(f"An error occurred while loading the data: {e}")
-        return
-    
-    # Check Data
     required_cols = {
         'spending' : config['spending_required_cols'],
         'places' : config['places_required_cols']
     }
-    try:
-        missing_data, checked_data = processor.check_data(required_cols=required_cols)
-        processor.check_missing_data_threshold(missing_data=missing_data,threshold=config['missing_data_threshold'])
-    except ValueError as e:
-        logging.error(f"An error occurred while checking the data: {e}")
-        return
-    
-    # Clean data
-    try:
-        cleaned_data = processor.clean_data(data=checked_data)
-    except Exception as e:
-        logging.error(f"An error occurred while cleaning the data: {e}")
-        return
-    
-    # Cleaned data output
+
+    # Only the required columns and the other columns used later are read
+    processor = DataProcessor(file_paths=file_paths, dtype_schema=config.get('dtype_schema'), fx_rates=fx_rates_from_config(config),
+                              fx_mode=config.get('fx_mode', 'check'), fx_tolerance=config.get('fx_tolerance', 0.02),
+                              usecols=used_columns(required_cols, config.get('read_cols', {})), excel_engine=config.get('excel_engine', 'auto'))
+
+    # Cleaned data read by the later stages
+    intermediate_paths = {
+        'spending' : config['cleaned_spending_intermediate_path'],
+        'places' : config['cleaned_places_intermediate_path']
+    }
+
+    # Cleaned data CSV output, optional
     output_paths = {
         'spending' : config['cleaned_spending_output_path'],
         'places' : config['cleaned_places_output_path']
-    }
+    } if config.get('export_cleaned_csv', True) else {}
 
     # Export data to review manually
     missing_data_output_paths = {
@@ -162,12 +391,84 @@ def main():
         'places' : config['missing_places_output_path']
     }
 
+    # Streaming mode processes the files in bounded-size batches, the cleaned data is handed over memory-mapped
+    if config.get('streaming_mode', False):
+        # Without a checkpoint the batches are spooled next to the intermediate files, not to a /tmp that may be in memory,
+        # and removed once mapped, the mappings stay valid
+        spool_folder = None if checkpoint else tempfile.mkdtemp(prefix='.streaming_', dir=os.path.dirname(os.path.abspath(intermediate_paths['spending'])))
+        spool_paths = intermediate_paths if checkpoint else {name: os.path.join(spool_folder, f"{name}.arrow") for name in intermediate_paths}
+        try:
+            with report.stage('process_in_chunks') as stage:
+                if not process_in_chunks(processor, config, required_cols, output_paths, missing_data_output_paths, spool_paths):
+                    return None
+                cleaned_data = {name: map_intermediate(path) for name, path in spool_paths.items()}
+                stage['rows_in'] = sum(processor.row_counts.values())
+                stage['rows_out'] = count_rows(cleaned_data)
+        finally:
+            if spool_folder is not None:
+                shutil.rmtree(spool_folder, ignore_errors=True)
+        return cleaned_data
+
+    # Sharded mode loads, checks and cleans every file of the file path globs in a pool of processes
+    if config.get('sharded_mode', False) or any(glob.has_magic(path) for path in file_paths.values()):
+        try:
+            with report.stage('process_sharded') as stage:
+                missing_data, cleaned_data = processor.process_data_sharded(required_cols=required_cols, threshold=config['missing_data_threshold'],
+                                                                            max_workers=config.get('shard_max_workers'))
+                cleaned_data = processor.link_stays(cleaned_data)
+                stage['rows_in'] = sum(processor.row_counts.values())
+                stage['rows_out'] = count_rows(cleaned_data)
+        except Exception as e:
+            logging.error(f"An error occurred while processing the data shards: {e}")
+            return None
+    else:
+        # Load Data
+        try:
+            with report.stage('extract') as stage:
+                processor.load_data(required_cols=required_cols)
+                stage['rows_out'] = count_rows(processor.data)
+        except Exception as e:
+            logging.error(f"An error occurred while loading the data: {e}")
+            return None
+    
+        # Check Data
+        try:
+            with report.stage('check_data', rows_in=count_rows(processor.data)) as stage:
+                missing_data, checked_data = processor.check_data(required_cols=required_cols, threshold=config['missing_data_threshold'])
+                stage['rows_out'] = count_rows(checked_data)
+        except ValueError as e:
+            logging.error(f"An error occurred while checking the data: {e}")
+            return None
+    
+        # Clean data
+        try:
+            with report.stage('clean_data', rows_in=count_rows(checked_data)) as stage:
+                cleaned_data = processor.link_stays(processor.clean_data(data=checked_data))
+                stage['rows_out'] = count_rows(cleaned_data)
+        except Exception as e:
+            logging.error(f"An error occurred while cleaning the data: {e}")
+            return None
+
     # Export data
     try:
-        processor.export_data(cleaned_data=cleaned_data,missing_data=missing_data,output_paths=output_paths, missing_data_output_paths=missing_data_output_paths )
+        with report.stage('export', rows_in=count_rows(cleaned_data)):
+            processor.export_data(cleaned_data=cleaned_data,missing_data=missing_data,output_paths=output_paths, missing_data_output_paths=missing_data_output_paths,
+                                  intermediate_paths=intermediate_paths if checkpoint else None)
+            # Export the spending rows whose In EUR differs from the rates to review manually
+            if 'spending' in processor.fx_mismatches and config.get('fx_mismatch_output_path'):
+                processor.fx_mismatches['spending'].to_csv(config['fx_mismatch_output_path'], index=False)
     except Exception as e:
         logging.error(f"An error occurred while exporting the data: {e}")
-        return
+        return None
+
+    return cleaned_data
+
+def main():
+    # Load the config file
+    with open('config.json') as f:
+        config=json.load(f)
+
+    run(config)
 
 if __name__ == "__main__":
     main()
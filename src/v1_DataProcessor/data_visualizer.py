@@ -1,92 +1,252 @@
 # data_visualizer.py
 
-from typing import Dict, Tuple
+from typing import Callable, Dict, List, Tuple, Union, Optional
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import inspect
+import multiprocessing
+import os
+import shutil
 import pandas as pd
+import pyarrow as pa
 import logging
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg') # Non-interactive backend, plots are only saved to files
+from matplotlib.figure import Figure
 import seaborn as sns
 import json 
+import sys
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
+from intermediate_store import to_frame
+from aggregations import spending_vs_nights
+from time_series import SpendingTimeSeries
 
 #logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
+# Plot renderers, module level so they can run in a process pool.
+# They use the object-oriented API only, no pyplot state is shared between plots.
+def render_spending_distribution(data: pd.DataFrame, figsize: Tuple[int,int], path: str) -> None:
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    sns.histplot(data['In EUR'], kde=True, ax=ax)
+    ax.set_title('Distribution of Spending')
+    fig.savefig(path)
+
+def render_spending_by_category(data: pd.DataFrame, figsize: Tuple[int,int], path: str) -> None:
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    data.set_index('Category')['In EUR'].plot(kind='bar', ax=ax)
+    ax.set_title('Spending by Category')
+    fig.savefig(path)
+
+def render_spending_vs_nights(data: pd.DataFrame, figsize: Tuple[int,int], path: str) -> None:
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    sns.scatterplot(x='Nights', y='In EUR', data=data, ax=ax)
+    ax.set_title('Spending vs Nights')
+    fig.savefig(path)
+
+def render_burn_rate(data: pd.DataFrame, figsize: Tuple[int,int], path: str) -> None:
+    fig = Figure(figsize=figsize)
+    ax = fig.subplots()
+    ax.bar(data['Period'], data['In EUR'], color='lightgrey', label='Daily spending')
+    ax.plot(data['Period'], data['Rolling In EUR'], label='7-day average')
+    ax.legend()
+    ax.set_title('Daily Burn Rate')
+    fig.savefig(path)
+
+def plot_cache_key(renderer: Callable, data: pd.DataFrame, figsize: Tuple[int,int]) -> str:
+    """
+    Hash the plot input: the renderer and its source code, the column names and values, and the plot parameters.
+    A renderer whose code changed (titles, colours, plot kind) gets new keys, so its stale plots are not restored.
+    """
+    digest = hashlib.sha256(f"{renderer.__name__}|{inspect.getsource(renderer)}|{list(data.columns)}|{figsize}".encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
 class DataVisualizer:
     def __init__(self, 
-                 cleaned_spending_data_path: str, 
-                 cleaned_places_data_path: str,
+                 cleaned_spending_data_path: Union[str, pd.DataFrame, pa.Table], 
+                 cleaned_places_data_path: Union[str, pd.DataFrame, pa.Table],
                  vizualization_folder: str = ".",
-                 figsize: Tuple[int,int] = (10,6)):
+                 figsize: Tuple[int,int] = (10,6),
+                 cache_folder: Optional[str] = None,
+                 max_workers: int = 3):
         """
         Initialize the DataVisualizer with spending and places data.
 
-        :param spending_data: The string path to the cleaned spending data.
-        :param places_data: The string path to the cleaned places data.
+        :param spending_data: The string path to the cleaned spending data, the cleaned DataFrame itself, or its memory-mapped Arrow table.
+        :param places_data: The string path to the cleaned places data, the cleaned DataFrame itself, or its memory-mapped Arrow table.
         :param vizualization_folder: A string representing the directory where the plots will be saved. Defaults to the current directory.
         :param figsize: A tuple representing the size of the figures to be created. Defaults to (10,6).
+        :param cache_folder: A directory keeping every rendered plot under the hash of its input, so plots whose input did not change are copied instead of redrawn. Defaults to no cache.
+        :param max_workers: The number of processes rendering plots in create_all_plots(parallel=True).
         """
         self.cleaned_spending_data_path = cleaned_spending_data_path
         self.cleaned_places_data_path = cleaned_places_data_path
         self.vizualization_folder = vizualization_folder
         self.figsize = figsize
+        self.cache_folder = cache_folder
+        self.max_workers = max_workers
         self.spending_data = pd.DataFrame
         self.places_data = pd.DataFrame
 
+        # Data handed over in memory, DataFrames or the mapped tables of streaming mode, needs no reading
+        if not isinstance(cleaned_spending_data_path, str) and not isinstance(cleaned_places_data_path, str):
+            self.load_data()
+
     def load_data(self):
         """
-        Perform analysis on the spending and places data.
+        Load the spending and places data from their paths, or from the Arrow tables passed in memory.
         """
         try:
-            self.places_data = pd.read_csv(self.cleaned_places_data_path)
-            self.spending_data = pd.read_csv(self.cleaned_spending_data_path)
+            self.places_data = self._read(self.cleaned_places_data_path)
+            self.spending_data = self._read(self.cleaned_spending_data_path)
             logging.info(f"Data loaded successfully")
         except Exception as e:
             logging.error(f"An error occured while loading the data: {e}")
             raise e
 
-    def create_spending_distribution_plot(self):
+    @staticmethod
+    def _read(data: Union[str, pd.DataFrame, pa.Table]) -> pd.DataFrame:
+        return to_frame(data)
+
+    def _spending_distribution_input(self) -> pd.DataFrame:
+        return self.spending_data[['In EUR']]
+
+    def _spending_by_category_input(self) -> pd.DataFrame:
+        return self.spending_data.groupby('Category', observed=True)['In EUR'].sum().reset_index()
+
+    def _spending_vs_nights_input(self) -> pd.DataFrame:
+        # Totals per stay (or city), joined after the aggregation so the spending rows are not multiplied
+        return spending_vs_nights(self.spending_data, self.places_data)[['Nights', 'In EUR']]
+
+    def _burn_rate_input(self) -> pd.DataFrame:
+        return SpendingTimeSeries(self.spending_data).by_period('day')[['Period', 'In EUR', 'Rolling In EUR']]
+
+    def _plots(self):
         """
-        Create a plot showing the distribution of spending.
+        The plots as (title, prepare input, renderer, file name), in creation order.
+        """
+        return [
+            ('Distribution of Spending', self._spending_distribution_input, render_spending_distribution, 'spending_distribution.png'),
+            ('Spending by Category', self._spending_by_category_input, render_spending_by_category, 'spending_by_category.png'),
+            ('Spending vs Nights', self._spending_vs_nights_input, render_spending_vs_nights, 'spending_vs_nights.png'),
+            ('Daily Burn Rate', self._burn_rate_input, render_burn_rate, 'daily_burn_rate.png'),
+        ]
+
+    def plot_paths(self) -> List[str]:
+        """
+        The paths the plots are written to.
+        """
+        return [f"{self.vizualization_folder}/{file_name}" for *_, file_name in self._plots()]
+
+    def _cached_path(self, renderer, data: pd.DataFrame) -> Optional[str]:
+        if self.cache_folder is None:
+            return None
+        return os.path.join(self.cache_folder, f"{plot_cache_key(renderer, data, self.figsize)}.png")
+
+    def _restore_from_cache(self, cached_path: Optional[str], path: str) -> bool:
+        """
+        Copy the cached render to path if there is one.
+        """
+        if cached_path is None or not os.path.isfile(cached_path):
+            return False
+        shutil.copyfile(cached_path, path)
+        return True
+
+    def _store_in_cache(self, cached_path: Optional[str], path: str) -> None:
+        if cached_path is not None:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            shutil.copyfile(path, cached_path)
+
+    def _create_plot(self, title, prepare, renderer, file_name) -> Optional[str]:
+        """
+        Create a plot, or restore it from the cache.
+
+        :return: The path of the plot, None if it could not be created.
         """
         try:
-            plt.figure(figsize=self.figsize)
-            sns.histplot(self.spending_data['In EUR'], kde=True)
-            plt.title('Distribution of Spending')
-            plt.savefig(f"{self.vizualization_folder}/spending_distribution.png")
-            plt.close()
-            logging.info(f"Distribution of Spending plot created successfully")
+            data = prepare()
+            path = f"{self.vizualization_folder}/{file_name}"
+            cached_path = self._cached_path(renderer, data)
+            if self._restore_from_cache(cached_path, path):
+                logging.info(f"{title} plot unchanged, restored from the cache")
+                return path
+            renderer(data, self.figsize, path)
+            self._store_in_cache(cached_path, path)
+            logging.info(f"{title} plot created successfully")
+            return path
         except Exception as e:
-            logging.error(f"An error occurred while creating the spending distribution plot: {e}")
+            logging.error(f"An error occurred while creating the {title.lower()} plot: {e}")
+            return None
+
+    def create_spending_distribution_plot(self):
+        """
+        Create a plot showing the distribution of spending.
+        """
+        self._create_plot(*self._plots()[0])
 
     def create_spending_by_category_plot(self):
         """
         Create a plot showing spending by category.
         """
-        try:
-            plt.figure(figsize=self.figsize)
-            self.spending_data.groupby('Category')['In EUR'].sum().plot(kind='bar')
-            plt.title('Spending by Category')
-            plt.savefig(f"{self.vizualization_folder}/spending_by_category.png")
-            plt.close()
-            logging.info(f"Spending by Category plot created successfully")
-        except Exception as e:
-            logging.error(f"An error occurred while creating the spending by category plot: {e}")
+        self._create_plot(*self._plots()[1])
 
     def create_spending_vs_nights_plot(self):
         """
-        Create a scatter plot showing spending vs nights.
+        Create a scatter plot showing the total spending vs the total nights of every stay.
         """
-        try:
-            # Merge spending and places data on 'City'
-            merged_data = pd.merge(self.spending_data, self.places_data, left_on='City', right_on='City')
+        self._create_plot(*self._plots()[2])
 
-            plt.figure(figsize=self.figsize)
-            sns.scatterplot(x='Nights', y='In EUR', data=merged_data)
-            plt.title('Spending vs Nights')
-            plt.savefig(f'{self.vizualization_folder}/spending_vs_nights.png')
-            plt.close()
-            logging.info(f"Spending vs Nights plot created successfully")
+    def create_burn_rate_plot(self):
+        """
+        Create a plot showing the spending of every day and its rolling weekly average.
+        """
+        self._create_plot(*self._plots()[3])
 
-        except Exception as e:
-            logging.error(f"An error occurred while creating the spending vs nights plot: {e}")
+    def create_all_plots(self, parallel: bool = False) -> List[str]:
+        """
+        Create every plot. With parallel, the plots missing from the cache are rendered in a process pool.
+
+        :return: The paths of the plots created, or restored from the cache, successfully.
+        """
+        if not parallel:
+            paths = [self._create_plot(*plot) for plot in self._plots()]
+            return [path for path in paths if path is not None]
+
+        paths = []
+
+        # Spawned workers, as forking the threads of the PipelineRunner can deadlock on the locks they hold (logging, Snowflake)
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {}
+            for title, prepare, renderer, file_name in self._plots():
+                try:
+                    data = prepare()
+                    path = f"{self.vizualization_folder}/{file_name}"
+                    cached_path = self._cached_path(renderer, data)
+                    if self._restore_from_cache(cached_path, path):
+                        logging.info(f"{title} plot unchanged, restored from the cache")
+                        paths.append(path)
+                        continue
+                    futures[title] = (pool.submit(renderer, data, self.figsize, path), cached_path, path)
+                except Exception as e:
+                    logging.error(f"An error occurred while creating the {title.lower()} plot: {e}")
+
+            for title, (future, cached_path, path) in futures.items():
+                try:
+                    future.result()
+                    self._store_in_cache(cached_path, path)
+                    logging.info(f"{title} plot created successfully")
+                    paths.append(path)
+                except Exception as e:
+                    logging.error(f"An error occurred while creating the {title.lower()} plot: {e}")
+        return paths
 
 def main() -> None:
     
@@ -95,17 +255,16 @@ def main() -> None:
         config=json.load(f)
 
     # Initialize
-    visualizer = DataVisualizer(cleaned_spending_data_path= config['cleaned_spending_output_path'],
-                                cleaned_places_data_path=config['cleaned_places_output_path'],
-                                vizualization_folder=config["data_visualization_folder_path"])
+    visualizer = DataVisualizer(cleaned_spending_data_path= config['cleaned_spending_intermediate_path'],
+                                cleaned_places_data_path=config['cleaned_places_intermediate_path'],
+                                vizualization_folder=config["data_visualization_folder_path"],
+                                cache_folder=config.get("plot_cache_folder_path"))
     
     # Load the data
     visualizer.load_data()
 
     # Create visualizations
-    visualizer.create_spending_distribution_plot()
-    visualizer.create_spending_by_category_plot()
-    visualizer.create_spending_vs_nights_plot()
+    visualizer.create_all_plots(parallel=config.get("parallel_plots", False))
 
 
 if __name__ == "__main__":
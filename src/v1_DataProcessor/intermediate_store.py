@@ -0,0 +1,111 @@
+# intermediate_store.py file
+
+import logging
+import os
+import sys
+from typing import Union
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
+from pipeline_common.dtype_optimizer import with_dtype_schema, table_to_frame
+
+#logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+def _to_table(df: pd.DataFrame) -> pa.Table:
+    """
+    Convert a DataFrame to an Arrow table with a stable schema.
+    Columns without any value are stored as strings instead of Arrow's null type.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema]
+    schema = pa.schema(fields, metadata=table.schema.metadata)
+    return table.cast(schema)
+
+def write_intermediate(df: pd.DataFrame, path: str) -> None:
+    """
+    Write a DataFrame to an uncompressed Arrow IPC (Feather v2) file, so it can be memory-mapped on read.
+
+    :param df: The DataFrame to write.
+    :param path: The path of the Arrow file.
+    """
+    feather.write_feather(_to_table(df), path, compression='uncompressed')
+
+def read_intermediate(path: str) -> pd.DataFrame:
+    """
+    Read a DataFrame written by write_intermediate (or a CSV file, for older outputs).
+
+    Arrow files are memory-mapped and keep the dtypes of the cleaned data, e.g. dates stay datetime64.
+
+    :param path: The path of the Arrow or CSV file.
+    """
+    if path.endswith('.csv'):
+        return pd.read_csv(path)
+    return table_to_frame(map_intermediate(path), self_destruct=True)
+
+def map_intermediate(path: str) -> pa.Table:
+    """
+    Memory-map an Arrow file written by write_intermediate or IntermediateWriter, without reading it.
+
+    :param path: The path of the Arrow file.
+    """
+    return feather.read_table(path, memory_map=True)
+
+def to_frame(data: Union[str, pd.DataFrame, pa.Table]) -> pd.DataFrame:
+    """
+    Get the cleaned data as a DataFrame.
+
+    :param data: The path to the intermediate file, the cleaned DataFrame, or an Arrow table such as
+                 the memory-mapped tables of streaming mode, converted with the dtypes stored in its schema.
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, pa.Table):
+        return table_to_frame(data)
+    return read_intermediate(data)
+
+class IntermediateWriter:
+    def __init__(self, path: str, dtype_schema=None):
+        """
+        Write DataFrame batches to a single Arrow IPC file, used in streaming mode.
+
+        Every batch is cast to the schema of the first one. As a later batch may contain nulls
+        where the first one did not, integer columns are stored as nullable Int64 and columns
+        without any value in the first batch are stored as strings.
+
+        :param path: The path of the Arrow file.
+        :param dtype_schema: The compact dtypes of the columns, stored in the schema and applied when the file is
+                             read (see dtype_optimizer.table_to_frame), as the batches cannot have categories of their own.
+        """
+        self.path = path
+        self.dtype_schema = dtype_schema
+        self.writer = None
+        self.schema = None
+        self.int_columns = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.int_columns is None:
+            self.int_columns = [column for column in df.columns if pd.api.types.is_integer_dtype(df[column])]
+        try:
+            table = _to_table(df.astype({column: 'Int64' for column in self.int_columns}))
+        except (TypeError, ValueError) as e:
+            logging.error(f"Batch does not match the integer columns of {self.path}: {e}")
+            raise
+        if self.writer is None:
+            fields = [field.with_type(pa.string()) if table.column(field.name).null_count == len(table) else field for field in table.schema]
+            self.schema = with_dtype_schema(pa.schema(fields, metadata=table.schema.metadata), self.dtype_schema)
+            self.writer = pa.ipc.new_file(self.path, self.schema)
+        try:
+            self.writer.write_table(table.select(self.schema.names).cast(self.schema))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            logging.error(f"Batch does not match the schema of {self.path}: {e}")
+            raise
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
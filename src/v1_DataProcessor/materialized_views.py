@@ -0,0 +1,241 @@
+# materialized_views.py file
+
+import logging
+import sqlite3
+import pandas as pd
+from typing import List, Optional
+
+#logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+# Aggregate tables: name -> (source table, key columns, {measure: (function, source column)})
+# Only SUM and COUNT are used, so the rows of a new load can be added to the stored values.
+AGGREGATES = {
+    'spending_by_country_category': ('SPENDING', ['Country', 'Category'], {'total_spending': ('SUM', 'In_EUR'), 'spending_count': ('COUNT', 'In_EUR')}),
+    'spending_by_date': ('SPENDING', ['Date'], {'total_spending': ('SUM', 'In_EUR')}),
+    'spending_by_stay': ('SPENDING', ['Stay_Order'], {'total_spending': ('SUM', 'In_EUR')}),
+    'spending_by_city': ('SPENDING', ['City', 'Country'], {'total_spending': ('SUM', 'In_EUR')}),
+    'nights_by_city': ('PLACES', ['City', 'Country'], {'total_nights': ('SUM', 'Nights')}),
+    'nights_by_stay': ('PLACES', ['"ORDER"', 'City', 'Country'], {'total_nights': ('SUM', 'Nights')}),
+}
+
+# The views used by the dashboards, reading only the aggregate tables
+VIEWS = {
+    'spending_per_country': """
+        SELECT Country, SUM(total_spending) AS total_spending
+        FROM spending_by_country_category
+        GROUP BY Country
+    """,
+    'avg_spending_per_category': """
+        SELECT Category, SUM(total_spending) / SUM(spending_count) AS avg_spending
+        FROM spending_by_country_category
+        GROUP BY Category
+    """,
+    'spending_category_per_country': """
+        SELECT Country, Category, total_spending
+        FROM spending_by_country_category
+    """,
+    'spending_over_time': """
+        SELECT Date, total_spending
+        FROM spending_by_date
+    """,
+    'nights_per_country': """
+        SELECT Country, SUM(total_nights) AS total_nights
+        FROM nights_by_city
+        GROUP BY Country
+    """,
+    'spending_vs_nights': """
+        SELECT p."ORDER" AS Stay_Order, p.City, p.Country, s.total_spending, p.total_nights
+        FROM spending_by_stay s
+        JOIN nights_by_stay p ON s.Stay_Order = p."ORDER"
+    """,
+}
+
+# The views joining on a column their source table may lack (e.g. a SPENDING table loaded before Stay_Order):
+# name -> (source table, column, the query used without it)
+FALLBACK_VIEWS = {
+    'spending_vs_nights': ('SPENDING', 'Stay_Order', """
+        SELECT s.City, s.Country, s.total_spending, p.total_nights
+        FROM spending_by_city s
+        JOIN nights_by_city p ON s.City = p.City AND s.Country = p.Country
+    """),
+}
+
+class MaterializedViews:
+    def __init__(self, con):
+        """
+        Initialize the MaterializedViews with a DB-API connection.
+
+        The aggregates are kept as tables, built once from the source table and then refreshed with
+        the rows of every load, so the dashboard views never rescan SPENDING or PLACES.
+        The loads are expected to be append-only. Snowflake connections refresh with MERGE,
+        SQLite connections (used to run the pipeline offline) with UPDATE ... FROM and INSERT.
+
+        :param con: A snowflake.connector or sqlite3 connection.
+        """
+        self.con = con
+        self.dialect = 'sqlite' if isinstance(con, sqlite3.Connection) else 'snowflake'
+
+    def _execute(self, query: str, params: Optional[tuple] = None) -> list:
+        return self._execute_all([query], params)
+
+    def _execute_all(self, queries: List[str], params: Optional[tuple] = None) -> list:
+        """Execute the queries on one cursor, committed together on SQLite. Returns the rows of the last one."""
+        cur = self.con.cursor()
+        try:
+            for query in queries:
+                cur.execute(query, params) if params else cur.execute(query)
+            rows = cur.fetchall() if cur.description else []
+        finally:
+            cur.close()
+        if self.dialect == 'sqlite':
+            self.con.commit()
+        return rows
+
+    def _table_exists(self, table: str) -> bool:
+        if self.dialect == 'sqlite':
+            query = "SELECT name FROM sqlite_master WHERE type = 'table' AND name = ? COLLATE NOCASE"
+        else:
+            query = "SELECT table_name FROM information_schema.tables WHERE table_schema = CURRENT_SCHEMA() AND table_name = UPPER(%s)"
+        return bool(self._execute(query, (table,)))
+
+    def _columns(self, table: str) -> List[str]:
+        """The upper case column names of a table."""
+        if self.dialect == 'sqlite':
+            return [row[1].upper() for row in self._execute(f"PRAGMA table_info({table})")]
+        query = "SELECT column_name FROM information_schema.columns WHERE table_schema = CURRENT_SCHEMA() AND table_name = UPPER(%s)"
+        return [row[0].upper() for row in self._execute(query, (table,))]
+
+    @staticmethod
+    def _aggregate_query(source: str, keys: List[str], measures: dict) -> str:
+        columns = keys + [f"{function}({column}) AS {measure}" for measure, (function, column) in measures.items()]
+        return f"SELECT {', '.join(columns)} FROM {source} GROUP BY {', '.join(keys)}"
+
+    def _aggregates(self, source: Optional[str] = None) -> List[str]:
+        return [name for name, (table, _, _) in AGGREGATES.items() if source is None or table == source.upper()]
+
+    def ensure(self, source: Optional[str] = None) -> bool:
+        """
+        Create the missing aggregate tables, built from the current rows of their source table.
+        Aggregates of a source table that does not exist yet, or lacks one of their key columns
+        (e.g. a SPENDING table loaded before Stay_Order), are skipped. An aggregate that fails is
+        logged and does not stop the others.
+
+        :param source: Only create the aggregates of this source table. Defaults to all of them.
+        :return: Whether every aggregate table exists.
+        """
+        ready = True
+        for name in self._aggregates(source):
+            table, keys, measures = AGGREGATES[name]
+            try:
+                if self._table_exists(name):
+                    continue
+                if not self._table_exists(table):
+                    logging.warning(f"Aggregate table '{name}' not created, its source table {table} does not exist yet.")
+                    ready = False
+                    continue
+                missing = [key for key in keys if key.strip('"').upper() not in self._columns(table)]
+                if missing:
+                    logging.warning(f"Aggregate table '{name}' not created, its source table {table} has no {', '.join(missing)} column.")
+                    ready = False
+                    continue
+                self._execute(f"CREATE TABLE {name} AS {self._aggregate_query(table, keys, measures)}")
+                if self.dialect == 'sqlite':
+                    # Index the keys for the lookups of the refresh
+                    self._execute(f"CREATE UNIQUE INDEX {name}_keys ON {name} ({', '.join(keys)})")
+                logging.info(f"Aggregate table '{name}' built from {table}.")
+            except Exception as e:
+                logging.error(f"Error creating the aggregate table '{name}': {e}")
+                ready = False
+        return ready
+
+    def _merge_statements(self, name: str, delta_table: str) -> List[str]:
+        """
+        The statements adding the aggregated delta rows to the aggregate table.
+        The keys are matched NULL-safe, so rows with a NULL key (e.g. spending without a stay) are added up, not inserted again.
+        """
+        table, keys, measures = AGGREGATES[name]
+        delta = self._aggregate_query(delta_table, keys, measures)
+        columns = keys + list(measures)
+        if self.dialect == 'sqlite':
+            # ON CONFLICT never matches NULL keys, the rows are updated and inserted separately with IS
+            matches = ' AND '.join(f"t.{key} IS d.{key}" for key in keys)
+            updates = ', '.join(f"{measure} = COALESCE(t.{measure}, 0) + COALESCE(d.{measure}, 0)" for measure in measures)
+            return [
+                f"UPDATE {name} AS t SET {updates} FROM ({delta}) AS d WHERE {matches}",
+                f"""
+                INSERT INTO {name} ({', '.join(columns)})
+                SELECT * FROM ({delta}) AS d WHERE NOT EXISTS (SELECT 1 FROM {name} AS t WHERE {matches})
+                """
+            ]
+        updates = ', '.join(f"{measure} = COALESCE(t.{measure}, 0) + COALESCE(d.{measure}, 0)" for measure in measures)
+        return [f"""
+            MERGE INTO {name} t
+            USING ({delta}) d
+            ON {' AND '.join(f"EQUAL_NULL(t.{key}, d.{key})" for key in keys)}
+            WHEN MATCHED THEN UPDATE SET {updates}
+            WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) VALUES ({', '.join(f"d.{column}" for column in columns)})
+        """]
+
+    def _write_delta(self, df: pd.DataFrame, delta_table: str) -> None:
+        if self.dialect == 'sqlite':
+            df.to_sql(delta_table, self.con, if_exists='replace', index=False)
+        else:
+            from snowflake.connector.pandas_tools import write_pandas
+            write_pandas(self.con, df, delta_table, auto_create_table=True, overwrite=True,
+                         table_type='temporary', use_logical_type=True)
+
+    def refresh(self, source: str, new_rows: pd.DataFrame) -> None:
+        """
+        Add newly loaded rows of a source table to its aggregate tables.
+
+        :param source: The source table the rows were loaded into.
+        :param new_rows: The loaded rows, with the column names of the source table.
+        """
+        names = self._aggregates(source)
+        if not names or new_rows.empty:
+            return
+        delta_table = f"{source.upper()}_DELTA"
+        self._write_delta(new_rows, delta_table)
+        try:
+            for name in names:
+                # An aggregate skipped by ensure() has no table yet, it is built from all the rows later
+                if not self._table_exists(name):
+                    continue
+                try:
+                    self._execute_all(self._merge_statements(name, delta_table))
+                    logging.info(f"Aggregate table '{name}' refreshed with {len(new_rows)} new rows.")
+                except Exception as e:
+                    logging.error(f"Error refreshing the aggregate table '{name}', rebuild() it: {e}")
+        finally:
+            self._execute(f"DROP TABLE IF EXISTS {delta_table}")
+
+    def rebuild(self, source: Optional[str] = None) -> None:
+        """
+        Recompute the aggregate tables from their source tables, e.g. after rows were deleted.
+
+        :param source: Only rebuild the aggregates of this source table. Defaults to all of them.
+        """
+        for name in self._aggregates(source):
+            self._execute(f"DROP TABLE IF EXISTS {name}")
+        self.ensure(source)
+
+    def view_query(self, name: str) -> str:
+        """The query of one of the dashboard views, its FALLBACK_VIEWS query if the source table lacks the column it joins on."""
+        if name in FALLBACK_VIEWS:
+            table, column, fallback = FALLBACK_VIEWS[name]
+            if self._table_exists(table) and column.upper() not in self._columns(table):
+                logging.warning(f"View '{name}' joins on City, its source table {table} has no {column} column.")
+                return fallback
+        return VIEWS[name]
+
+    def view_statements(self, name: str) -> List[str]:
+        """The statements creating or replacing one of the dashboard views."""
+        query = self.view_query(name)
+        if self.dialect == 'sqlite':
+            return [f"DROP VIEW IF EXISTS {name}", f"CREATE VIEW {name} AS {query}"]
+        return [f"CREATE OR REPLACE VIEW {name} AS {query}"]
+
+    def create_view(self, name: str) -> None:
+        """Create or replace one of the dashboard views."""
+        for statement in self.view_statements(name):
+            self._execute(statement)
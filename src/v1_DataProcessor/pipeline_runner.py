@@ -0,0 +1,85 @@
+# pipeline_runner.py file
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional
+from pipeline_common.instrumentation import RunReport, count_rows
+
+#logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+class PipelineRunner:
+    def __init__(self, max_workers: int = 4, report: Optional[RunReport] = None):
+        """
+        Initialize the PipelineRunner, which runs a DAG of stages in a single process.
+
+        Each stage is called with the results of the stages it depends on as keyword arguments,
+        so DataFrames are passed in memory. Stages whose dependencies are done run concurrently.
+
+        :param max_workers: The maximum number of stages running at the same time.
+        :param report: The RunReport measuring every stage, if any.
+        """
+        self.max_workers = max_workers
+        self.report = report
+        self.stages = {}
+
+    def add_stage(self, name: str, func: Callable[..., Any], depends_on: Optional[List[str]] = None) -> None:
+        """
+        Add a stage to the pipeline.
+
+        :param name: The name of the stage, used as keyword argument for its dependents.
+        :param func: The function running the stage.
+        :param depends_on: The names of the stages whose results the stage needs.
+        """
+        depends_on = list(depends_on or [])
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = (func, depends_on)
+
+    def _run_stage(self, name: str, func: Callable[..., Any], dependencies: Dict[str, Any]) -> Any:
+        if self.report is None:
+            return func(**dependencies)
+        # Rows in are the rows of the dependency results that are DataFrames
+        counts = [rows for rows in map(count_rows, dependencies.values()) if rows is not None]
+        with self.report.stage(name, rows_in=sum(counts) if counts else None) as record:
+            result = func(**dependencies)
+            record['rows_out'] = count_rows(result)
+        return result
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Run every stage once its dependencies are done. A failing stage is logged and its dependents are skipped.
+
+        :return: The results of the successful stages by name.
+        """
+        results = {}
+        failed = set()
+        pending = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                # Skip the stages depending on a failed one, start the ones that are ready
+                for name, (func, depends_on) in list(pending.items()):
+                    if any(dependency in failed for dependency in depends_on):
+                        logging.error(f"Stage {name} skipped because one of its dependencies failed.")
+                        failed.add(name)
+                        del pending[name]
+                    elif all(dependency in results for dependency in depends_on):
+                        running[pool.submit(self._run_stage, name, func, {dependency: results[dependency] for dependency in depends_on})] = name
+                        del pending[name]
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        logging.info(f"Stage {name} finished successfully.")
+                    except Exception as e:
+                        logging.error(f"An error occurred in stage {name}: {e}")
+                        failed.add(name)
+
+        return results
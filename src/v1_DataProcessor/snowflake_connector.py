@@ -1,56 +1,174 @@
-from dotenv import load_dotenv
-import os
-import snowflake.connector
 #snowflake_connector.py file
 
 import logging
+import time
+from typing import Dict, List
+from connection_pool import ConnectionPool, get_pool
 
 #logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
 class SnowflakeConnector:
-    def __init__(self):
-        load_dotenv()
-        self.user = os.getenv('SNOWFLAKE_USER')
-        self.password = os.getenv('SNOWFLAKE_PASSWORD')
-        self.account = os.getenv('SNOWFLAKE_ACCOUNT')
-        self.region = os.getenv('SNOWFLAKE_REGION')
-        self.role = os.getenv('SNOWFLAKE_ROLE')
-        self.warehouse = os.getenv('SNOWFLAKE_WAREHOUSE')
+    def __init__(self, pool: ConnectionPool = None):
+        """
+        Initialize the SnowflakeConnector.
+
+        :param pool: The pool the session is checked out from. Defaults to the pool shared by the process,
+                     so the users of the connector reuse the same sessions instead of logging in again.
+        """
+        self.pool = pool
         self.con = None
         self.cur = None
 
     def connect(self, database=None, schema=None):
         try:
-            self.con = snowflake.connector.connect(
-                user=self.user,
-                password=self.password,
-                account=self.account,
-                region=self.region,
-                role=self.role,
-                warehouse=self.warehouse,
-                database=database,
-                schema=schema
-            )
+            if self.pool is None:
+                self.pool = get_pool()
+            self.con = self.pool.acquire(database, schema)
             self.cur = self.con.cursor()
             logging.info("Connection to Snowflake established successfully.")
         except Exception as e:
             logging.error(f"Error connecting to Snowflake: {e}")
 
+    @staticmethod
+    def _summary(query: str) -> str:
+        """The first line of a statement, to log it without the full SQL text."""
+        line = next((line.strip() for line in query.strip().splitlines()), '')
+        return line if len(line) <= 80 else line[:77] + '...'
+
+    @staticmethod
+    def _result(query: str) -> Dict:
+        return {'query': query, 'success': False, 'seconds': None, 'error': None}
+
+    def _log(self, result: Dict) -> None:
+        if result['success']:
+            logging.info(f"Query executed successfully in {result['seconds']:.2f}s: {self._summary(result['query'])}")
+        else:
+            logging.error(f"Error executing query {self._summary(result['query'])}: {result['error']}")
+
     def execute_query(self, query):
+        """
+        Execute a single statement. Errors are logged and returned, not raised.
+
+        :return: A dict with the 'query', whether it was a 'success', its duration in 'seconds' and the 'error' message.
+        """
+        result = self._result(query)
+        started = time.perf_counter()
         try:
             self.cur.execute(query)
-            logging.info(f"Query executed successfully: {query}")
+            result['success'] = True
+        except Exception as e:
+            result['error'] = str(e)
+        result['seconds'] = time.perf_counter() - started
+        self._log(result)
+        return result
+
+    def _execute_in_order(self, queries: List[str], stop_on_error: bool) -> List[Dict]:
+        results = [self._result(query) for query in queries]
+        started = time.perf_counter()
+        for result in results:
+            try:
+                self.cur.execute(result['query'])
+                result['success'] = True
+            except Exception as e:
+                result['error'] = str(e)
+            result['seconds'] = time.perf_counter() - started
+            self._log(result)
+            if stop_on_error and not result['success']:
+                break
+        return results
+
+    def execute_batch(self, queries: List[str], poll_interval: float = 0.1) -> List[Dict]:
+        """
+        Execute independent statements together and wait for all of them.
+
+        On Snowflake every statement is submitted asynchronously, so the batch takes about as long as its slowest
+        statement instead of the sum of them. Other DB-API backends run the statements one by one, in order.
+
+        :param queries: The statements, which must not depend on each other.
+        :param poll_interval: The seconds between two checks of the running statements.
+        :return: One dict per statement as in execute_query, 'seconds' counting from the start of the batch.
+        """
+        if not hasattr(self.cur, 'execute_async'):
+            return self._execute_in_order(queries, stop_on_error=False)
+
+        results = [self._result(query) for query in queries]
+        started = time.perf_counter()
+        running = {}
+        for result in results:
+            try:
+                self.cur.execute_async(result['query'])
+                running[self.cur.sfqid] = result
+            except Exception as e:
+                result['error'] = str(e)
+                result['seconds'] = time.perf_counter() - started
+
+        while running:
+            for query_id, result in list(running.items()):
+                try:
+                    if self.con.is_still_running(self.con.get_query_status_throw_if_error(query_id)):
+                        continue
+                    result['success'] = True
+                except Exception as e:
+                    result['error'] = str(e)
+                result['seconds'] = time.perf_counter() - started
+                del running[query_id]
+            if running:
+                time.sleep(poll_interval)
+
+        for result in results:
+            self._log(result)
+        return results
+
+    def execute_script(self, queries: List[str]) -> List[Dict]:
+        """
+        Execute dependent statements in order, in a single multi-statement request on Snowflake.
+
+        Snowflake stops at the first failing statement and reports the error for the whole request, so every
+        statement is then returned with that error. Other DB-API backends run the statements one by one and
+        stop at the first error.
+
+        :param queries: The statements, without a trailing semicolon.
+        :return: One dict per statement as in execute_query, 'seconds' counting from the start of the script.
+        """
+        if not hasattr(self.cur, 'execute_async'):
+            return self._execute_in_order(queries, stop_on_error=True)
+
+        results = [self._result(query) for query in queries]
+        started = time.perf_counter()
+        try:
+            self.cur.execute(";\n".join(queries), num_statements=len(queries))
+            for result in results:
+                result['success'] = True
         except Exception as e:
-            logging.error(f"Error executing query: {e}")
+            for result in results:
+                result['error'] = str(e)
+        for result in results:
+            result['seconds'] = time.perf_counter() - started
+            self._log(result)
+        return results
 
     def close(self):
+        """
+        Give the session back to the pool. Closing an already closed connector does nothing.
+        """
+        if self.con is None:
+            return
         try:
             self.cur.close()
-            self.con.close()
             logging.info("Connection to Snowflake closed successfully.")
         except Exception as e:
             logging.error(f"Error closing Snowflake connection: {e}")
+        finally:
+            self.pool.release(self.con)
+            self.con = None
+            self.cur = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
     @property
     def connection(self):
-        return self.con
\ No newline at end of file
+        return self.con
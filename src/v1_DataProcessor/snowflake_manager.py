@@ -1,16 +1,33 @@
 #snowflake_manager.py file
 
 import logging
-import pandas as pd
-from snowflake.connector.pandas_tools import write_pandas
+import json
+import os
+import sys
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
 from snowflake_connector import SnowflakeConnector
+from materialized_views import MaterializedViews
+from stage_loader import StagedLoader, SnowflakeStage, read_table
 
 #logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
 class SnowflakeManager:
-    def __init__(self):
+    def __init__(self, target_file_mb: int = 64, max_workers: int = 4):
+        """
+        Initialize the SnowflakeManager.
+
+        :param target_file_mb: The size of the Parquet files uploaded to the stage by load_data, in MB.
+        :param max_workers: The number of Parquet files written and uploaded at the same time.
+        """
         self.snowflake = SnowflakeConnector()
         self.snowflake.connect()
+        self.materialized = MaterializedViews(self.snowflake.con)
+        self.loader = StagedLoader(SnowflakeStage(self.snowflake), target_file_size=target_file_mb * 1024 * 1024, max_workers=max_workers)
 
     def create_database(self, database_name):
         self.snowflake.execute_query(f"CREATE DATABASE IF NOT EXISTS {database_name};")
@@ -23,20 +40,48 @@ class SnowflakeManager:
         self.snowflake.execute_query(f"USE SCHEMA {schema_name};")
         self.snowflake.execute_query(f"CREATE TABLE IF NOT EXISTS {table_name} {table_structure};")
 
+    def setup_table(self, database_name, schema_name, table_name, table_structure):
+        """
+        Create the database, schema and table if needed, in a single round trip.
+
+        :return: True if every statement succeeded.
+        """
+        results = self.snowflake.execute_script([
+            f"CREATE DATABASE IF NOT EXISTS {database_name}",
+            f"USE DATABASE {database_name}",
+            f"CREATE SCHEMA IF NOT EXISTS {schema_name}",
+            f"USE SCHEMA {database_name}.{schema_name}",
+            f"CREATE TABLE IF NOT EXISTS {table_name} {table_structure.strip().rstrip(';')}"
+        ])
+        return all(result['success'] for result in results)
+
     def load_data(self, table_name, file_path, column_name_mapping):
-        df = pd.read_csv(file_path)
-        df = df.rename(columns=column_name_mapping)
-        success, nchunks, nrows, _ = write_pandas(self.snowflake.con, df, table_name)
-        return success, nrows
+        # file_path can also be the cleaned DataFrame itself, Arrow files are read without pandas
+        table = read_table(file_path, column_name_mapping)
+        # The aggregate tables are built from the rows already loaded, then get the new ones added
+        self.materialized.ensure(table_name)
+        # Compressed Parquet files are uploaded to a stage in parallel and loaded with one COPY INTO
+        stats = self.loader.load(table, table_name)
+        success = stats['rows'] == table.num_rows
+        if success:
+            self.materialized.refresh(table_name, table.to_pandas())
+        return success, stats['rows']
 
     def close(self):
         self.snowflake.close()
 
-def main():
-    manager = SnowflakeManager()
-    manager.create_database("TRAVEL_DATA")
-    manager.create_schema("TRAVEL_DATA", "TRAVEL")
-    manager.create_table("TRAVEL_DATA.TRAVEL", "PLACES", """
+def load_places(places_data, target_file_mb=64, max_workers=4):
+    """
+    Create the Snowflake database, schema and PLACES table, and load the places data into it.
+
+    :param places_data: The path to the cleaned places data, or the cleaned DataFrame itself.
+    :param target_file_mb: The size of the Parquet files uploaded to the stage, in MB.
+    :param max_workers: The number of Parquet files written and uploaded at the same time.
+    :return: The number of rows loaded.
+    :raises RuntimeError: If the table could not be created or not every row was loaded.
+    """
+    manager = SnowflakeManager(target_file_mb, max_workers)
+    if not manager.setup_table("TRAVEL_DATA", "TRAVEL", "PLACES", """
         (
             "ORDER" INTEGER,
             Arrival_Date DATE,
@@ -53,8 +98,10 @@ def main():
             Comfort VARCHAR,
             Comment VARCHAR
         );
-    """)
-    success, nrows = manager.load_data("PLACES", "data/output_data/places.csv", {
+    """):
+        manager.close()
+        raise RuntimeError("Failed to create the PLACES table, see the log above")
+    success, nrows = manager.load_data("PLACES", places_data, {
         'Order': 'ORDER',
         'Arrival_Date': 'ARRIVAL_DATE',
         'Nights': 'NIGHTS',
@@ -70,11 +117,20 @@ def main():
         'Comfort': 'COMFORT',
         'Comment': 'COMMENT'
     })
-    if success:
-        logging.info(f"Successfully loaded {nrows} rows into the PLACES table")
-    else:
-        logging.error("Failed to load data into the PLACES table")
     manager.close()
+    if not success:
+        logging.error("Failed to load data into the PLACES table")
+        raise RuntimeError(f"Failed to load data into the PLACES table, {nrows} rows loaded")
+    logging.info(f"Successfully loaded {nrows} rows into the PLACES table")
+    return nrows
+
+def main():
+    # Load the config file
+    with open('config.json') as f:
+        config=json.load(f)
+
+    load_places(config['cleaned_places_intermediate_path'],
+                config.get('stage_target_file_mb', 64), config.get('stage_max_workers', 4))
 
 if __name__ == "__main__":
     main()
@@ -1,108 +1,72 @@
 # snowflake_view_creator.py file
 
+import os
+import sys
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
 from snowflake_connector import SnowflakeConnector
+from materialized_views import MaterializedViews, VIEWS
 import logging
 
 # Configure logging
 #logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
 class ViewCreator:
-    def __init__(self):
+    def __init__(self, pool=None):
+        """
+        Initialize the ViewCreator.
+
+        :param pool: The pool the session is checked out from, see SnowflakeConnector.
+        """
         # Connecting to Snowflake
-        self.snowflake = SnowflakeConnector()
+        self.snowflake = SnowflakeConnector(pool)
         self.snowflake.connect(database="TRAVEL_DATA", schema="TRAVEL")
+        self.materialized = MaterializedViews(self.snowflake.con)
 
-    def create_view_spending_per_country(self):
-        try:
-            self.snowflake.execute_query("""
-            CREATE OR REPLACE VIEW spending_per_country AS
-            SELECT Country, SUM(In_EUR) AS total_spending
-            FROM SPENDING
-            GROUP BY Country
-            """)
-            logging.info("View 'spending_per_country' created successfully.")
-        except Exception as e:
-            logging.error("Error creating view 'spending_per_country': %s", str(e))
-
-    def create_view_avg_spending_per_category(self):
-        try:
-            self.snowflake.execute_query("""
-            CREATE OR REPLACE VIEW avg_spending_per_category AS
-            SELECT Category, AVG(In_EUR) AS avg_spending
-            FROM SPENDING
-            GROUP BY Category
-            """)
-            logging.info("View 'avg_spending_per_category' created successfully.")
-        except Exception as e:
-            logging.error("Error creating view 'avg_spending_per_category': %s", str(e))
-
-
-    def create_view_nights_per_country(self):
-        try:
-            self.snowflake.execute_query("""
-            CREATE OR REPLACE VIEW nights_per_country AS
-            SELECT Country, SUM(Nights) AS total_nights
-            FROM PLACES
-            GROUP BY Country
-            """)
-            logging.info("View 'nights_per_country' created successfully.")
-        except Exception as e:
-            logging.error("Error creating view 'nights_per_country': %s", str(e))
-
-    def create_view_spending_category_per_country(self):
-        try:
-            self.snowflake.execute_query("""
-            CREATE OR REPLACE VIEW spending_category_per_country AS
-            SELECT Country, Category, SUM(In_EUR) as total_spending
-            FROM SPENDING
-            GROUP BY Country, Category
-            """)
-            logging.info("View 'spending_category_per_country' created successfully.")
-        except Exception as e:
-            logging.error("Error creating view 'spending_category_per_country': %s", str(e))
-
-    def create_view_spending_over_time(self):
+    def create_view(self, name):
         try:
-            self.snowflake.execute_query("""
-            CREATE OR REPLACE VIEW spending_over_time AS
-            SELECT Date, SUM(In_EUR) AS total_spending
-            FROM SPENDING
-            GROUP BY Date
-            """)
-            logging.info("View 'spending_over_time' created successfully.")
+            self.materialized.create_view(name)
+            logging.info(f"View '{name}' created successfully.")
         except Exception as e:
-            logging.error("Error creating view 'spending_over_time': %s", str(e))
-
-    def create_view_spending_vs_nights(self):
-        try:
-            self.snowflake.execute_query("""
-            CREATE OR REPLACE VIEW spending_vs_nights AS
-            SELECT s.City, s.Country, SUM(s.In_EUR) AS total_spending, SUM(p.Nights) AS total_nights
-            FROM SPENDING s
-            JOIN PLACES p ON s.City = p.City AND s.Country = p.Country
-            GROUP BY s.City, s.Country
-            """)
-            logging.info("View 'spending_vs_nights' created successfully.")
-        except Exception as e:
-            logging.error("Error creating view 'spending_vs_nights': %s", str(e))
-
+            logging.error("Error creating view '%s': %s", name, str(e))
 
     def create_all_views(self):
-        self.create_view_spending_per_country()
-        self.create_view_avg_spending_per_category()
-        self.create_view_spending_category_per_country()
-        self.create_view_spending_over_time()
-        self.create_view_nights_per_country()
-        self.create_view_spending_vs_nights()
+        """
+        Create the aggregate tables and the views.
+
+        :return: Whether every view was created.
+        """
+        # The views read aggregate tables. Those of PLACES are built once and then refreshed by every load,
+        # SPENDING is not loaded by the pipeline, so its aggregates are recomputed from its current rows.
+        # Each aggregate is created on its own, a failed one only fails the views reading it
+        self.materialized.rebuild('SPENDING')
+        self.materialized.ensure()
+        # The views are independent, they are created together in one batch
+        statements = {name: self.materialized.view_statements(name) for name in VIEWS}
+        results = self.snowflake.execute_batch([statement for name in VIEWS for statement in statements[name]])
+        created = True
+        for name in VIEWS:
+            view_results, results = results[:len(statements[name])], results[len(statements[name]):]
+            failed = [result for result in view_results if not result['success']]
+            if failed:
+                logging.error("Error creating view '%s': %s", name, failed[0]['error'])
+                created = False
+            else:
+                logging.info(f"View '{name}' created successfully.")
+        return created
 
     def close(self):
         self.snowflake.close()
-        self.snowflake.close()
 
 def main():
     creator = ViewCreator()
-    creator.create_all_views()
+    created = creator.create_all_views()
     creator.close()
+    return created
 
 # Running the main function
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+# stage_loader.py file
+
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Union
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from intermediate_store import _to_table
+
+#logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+def read_table(data: Union[str, pd.DataFrame, pa.Table], column_name_mapping: Optional[Dict[str, str]] = None) -> pa.Table:
+    """
+    Get the cleaned data as an Arrow table, without going through pandas for Arrow files.
+
+    :param data: The path to the intermediate (Arrow or CSV) file, the cleaned DataFrame or an Arrow table.
+    :param column_name_mapping: The columns to rename, e.g. to the upper case names of the target table.
+    """
+    if isinstance(data, pa.Table):
+        table = data
+    elif isinstance(data, pd.DataFrame):
+        table = _to_table(data)
+    elif data.endswith('.csv'):
+        table = _to_table(pd.read_csv(data))
+    else:
+        table = feather.read_table(data, memory_map=True)
+    if column_name_mapping:
+        table = table.rename_columns([column_name_mapping.get(name, name) for name in table.column_names])
+    return table
+
+class LocalStage:
+    def __init__(self, folder: str, con):
+        """
+        A stage on the local filesystem, with COPY into a table of a DB-API connection (e.g. sqlite3).
+        Used to test the staged load without Snowflake.
+
+        :param folder: The folder the files are uploaded to.
+        :param con: The connection of the target tables.
+        """
+        self.folder = folder
+        self.con = con
+
+    def prepare(self) -> None:
+        """Create the stage folder, before the files are uploaded in parallel."""
+        os.makedirs(self.folder, exist_ok=True)
+
+    def put(self, path: str) -> str:
+        """Upload a file to the stage and return its name on the stage."""
+        shutil.copyfile(path, os.path.join(self.folder, os.path.basename(path)))
+        return os.path.basename(path)
+
+    def copy_into(self, table_name: str, file_names: List[str]) -> int:
+        """Append the staged files to a table, remove them from the stage and return the number of rows loaded."""
+        rows = 0
+        for file_name in file_names:
+            path = os.path.join(self.folder, file_name)
+            df = pq.read_table(path).to_pandas()
+            df.to_sql(table_name, self.con, if_exists='append', index=False)
+            rows += len(df)
+            os.remove(path)
+        self.con.commit()
+        return rows
+
+class SnowflakeStage:
+    def __init__(self, connector, stage_name: str = "PIPELINE_STAGE"):
+        """
+        A temporary Snowflake stage of the current database / schema, loaded with COPY INTO.
+
+        :param connector: A connected SnowflakeConnector.
+        :param stage_name: The name of the temporary stage, created by the first prepare().
+        """
+        self.connector = connector
+        self.stage_name = stage_name
+        self.created = False
+
+    def prepare(self) -> None:
+        """Create the stage once, before the files are uploaded in parallel."""
+        if self.created:
+            return
+        cur = self.connector.con.cursor()
+        try:
+            cur.execute(f"CREATE TEMPORARY STAGE IF NOT EXISTS {self.stage_name}")
+            self.created = True
+        finally:
+            cur.close()
+
+    def put(self, path: str) -> str:
+        """Upload a file to the prepared stage and return its name on the stage. Runs on its own cursor, so uploads can run in parallel."""
+        cur = self.connector.con.cursor()
+        try:
+            # The Parquet files are already compressed
+            cur.execute(f"PUT 'file://{os.path.abspath(path)}' @{self.stage_name} AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+        finally:
+            cur.close()
+        return os.path.basename(path)
+
+    def copy_into(self, table_name: str, file_names: List[str]) -> int:
+        """Load the staged files into a table with one COPY INTO, purge them and return the number of rows loaded."""
+        files = ', '.join(f"'{file_name}'" for file_name in file_names)
+        cur = self.connector.con.cursor()
+        try:
+            cur.execute(f"""
+                COPY INTO {table_name}
+                FROM @{self.stage_name}
+                FILES = ({files})
+                FILE_FORMAT = (TYPE = PARQUET)
+                MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE
+                PURGE = TRUE
+            """)
+            columns = [column[0].lower() for column in cur.description]
+            return sum(row[columns.index('rows_loaded')] for row in cur.fetchall())
+        finally:
+            cur.close()
+
+class StagedLoader:
+    def __init__(self, stage, target_file_size: int = 64 * 1024 * 1024, max_workers: int = 4, compression: str = 'snappy'):
+        """
+        Initialize the StagedLoader, which bulk loads a table through a stage.
+
+        The data is split in Parquet files of about target_file_size bytes, which are written and uploaded
+        in parallel, then loaded with a single COPY INTO.
+
+        :param stage: The stage, a SnowflakeStage or a LocalStage.
+        :param target_file_size: The size of the compressed Parquet files, in bytes.
+        :param max_workers: The number of files written and uploaded at the same time.
+        :param compression: The Parquet compression codec.
+        """
+        self.stage = stage
+        self.target_file_size = target_file_size
+        self.max_workers = max_workers
+        self.compression = compression
+
+    def _write(self, table: pa.Table, path: str) -> int:
+        # Snowflake reads microsecond timestamps
+        pq.write_table(table, path, compression=self.compression, coerce_timestamps='us', allow_truncated_timestamps=True)
+        return os.path.getsize(path)
+
+    def _rows_per_file(self, table: pa.Table) -> int:
+        """Estimate how many rows make a file of the target size, from the compressed size of a sample."""
+        sample = table.slice(0, 10000)
+        buffer = io.BytesIO()
+        pq.write_table(sample, buffer, compression=self.compression)
+        bytes_per_row = max(buffer.tell() / max(len(sample), 1), 1)
+        return max(int(self.target_file_size / bytes_per_row), 1)
+
+    def _write_and_put(self, table: pa.Table, path: str) -> tuple:
+        size = self._write(table, path)
+        return self.stage.put(path), size
+
+    def load(self, table: pa.Table, table_name: str) -> Dict[str, float]:
+        """
+        Load an Arrow table (see read_table) into a table whose columns have the same names.
+
+        :return: The 'rows' loaded, the 'bytes' uploaded, the number of 'files', the 'seconds' taken,
+                 and the 'rows_per_second' and 'bytes_per_second'.
+        """
+        started = time.perf_counter()
+        rows_per_file = self._rows_per_file(table)
+        prefix = f"{table_name.lower()}_{uuid.uuid4().hex[:8]}"
+
+        self.stage.prepare()
+        with tempfile.TemporaryDirectory() as folder:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = [pool.submit(self._write_and_put, table.slice(offset, rows_per_file), os.path.join(folder, f"{prefix}_{i}.parquet"))
+                           for i, offset in enumerate(range(0, max(len(table), 1), rows_per_file))]
+                uploaded = [future.result() for future in futures]
+
+        file_names = [file_name for file_name, _ in uploaded]
+        rows = self.stage.copy_into(table_name, file_names)
+        seconds = time.perf_counter() - started
+        total_bytes = sum(size for _, size in uploaded)
+
+        stats = {
+            'rows': rows,
+            'bytes': total_bytes,
+            'files': len(file_names),
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else 0.0,
+            'bytes_per_second': total_bytes / seconds if seconds else 0.0
+        }
+        logging.info(f"Loaded {rows} rows ({total_bytes / 1e6:.1f} MB in {len(file_names)} files) into {table_name} in {seconds:.2f}s: "
+                     f"{stats['rows_per_second']:.0f} rows/s, {stats['bytes_per_second'] / 1e6:.1f} MB/s")
+        return stats
@@ -0,0 +1,92 @@
+# time_series.py file
+
+import logging
+import numpy as np
+import pandas as pd
+from typing import Optional
+from pipeline_common.stay_index import assign_stays
+
+#logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+# The resampling rule and the default rolling window (in periods) of each period
+PERIODS = {
+    'day': ('D', 7),
+    'week': ('W-MON', 4),
+    'month': ('MS', 3)
+}
+
+class SpendingTimeSeries:
+    def __init__(self, spending_data: pd.DataFrame):
+        """
+        Sort the spending data by date once, for the rolling and cumulative spending and the costs per stay.
+
+        :param spending_data: The cleaned spending data, with 'Date' and 'In EUR'. Rows without a date are left out.
+        """
+        dates = pd.to_datetime(spending_data['Date']).to_numpy(dtype='datetime64[ns]')
+        values = pd.to_numeric(spending_data['In EUR'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        valid = ~np.isnat(dates)
+        order = np.argsort(dates[valid], kind='stable')
+        self.dates = dates[valid][order]
+        self.values = np.nan_to_num(values[valid][order])
+        self._daily = None
+
+    def daily(self) -> pd.Series:
+        """
+        Get the spending of every calendar day from the first to the last, 0 on days without spending.
+        """
+        if self._daily is None:
+            days = self.dates.astype('datetime64[D]')
+            if not len(days):
+                self._daily = pd.Series(dtype='float64', index=pd.DatetimeIndex([], name='Date'), name='In EUR')
+                return self._daily
+            # The dates are sorted, so every day is one run of rows
+            starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+            totals = pd.Series(np.add.reduceat(self.values, starts), index=pd.DatetimeIndex(days[starts], name='Date'), name='In EUR')
+            self._daily = totals.reindex(pd.date_range(days[0], days[-1], freq='D', name='Date'), fill_value=0.0)
+        return self._daily
+
+    def by_period(self, period: str = 'day', window: Optional[int] = None) -> pd.DataFrame:
+        """
+        Get the spending per day, week or month, with its rolling mean (the burn rate) and its running total.
+
+        :param period: 'day', 'week' (starting on Monday) or 'month'.
+        :param window: The number of periods of the rolling mean, defaults to a week of days, 4 weeks or 3 months.
+        :return: A DataFrame with the 'Period' start, 'In EUR', 'Rolling In EUR' and 'Cumulative In EUR'.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Unknown period {period}, expected one of {list(PERIODS)}")
+        rule, default_window = PERIODS[period]
+        daily = self.daily()
+        totals = daily if period == 'day' else daily.resample(rule, label='left', closed='left').sum()
+        return pd.DataFrame({
+            'Period': totals.index,
+            'In EUR': totals.to_numpy(),
+            'Rolling In EUR': totals.rolling(window or default_window, min_periods=1).mean().to_numpy(),
+            'Cumulative In EUR': totals.cumsum().to_numpy()
+        })
+
+    def cost_per_stay(self, places_data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Get the spending and the cost per night of every stay, the spending assigned to the stays with assign_stays.
+
+        :param places_data: The cleaned places data, with 'Arrival_Date' and 'Nights'.
+        :return: One row per stay with its 'Order', 'City', 'Country' (those present), 'Arrival_Date' and 'Nights',
+                 the 'In EUR' spent during the stay, the number of 'Spending Rows' and the 'Cost per Night'
+                 (NaN for stays without nights).
+        """
+        stays = assign_stays(self.dates, places_data['Arrival_Date'], places_data['Nights'])
+        assigned = stays >= 0
+        totals = np.bincount(stays[assigned], weights=self.values[assigned], minlength=len(places_data))
+        counts = np.bincount(stays[assigned], minlength=len(places_data))
+        if len(stays) and not assigned.all():
+            logging.info(f"{(~assigned).sum()} spending rows ({self.values[~assigned].sum():.2f} EUR) are in no stay")
+
+        columns = [col for col in ['Order', 'City', 'Country', 'Arrival_Date', 'Nights'] if col in places_data.columns]
+        nights = pd.to_numeric(places_data['Nights'], errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost_per_night = np.where(nights > 0, totals / nights, np.nan)
+        return places_data[columns].reset_index(drop=True).assign(**{
+            'In EUR': totals,
+            'Spending Rows': counts,
+            'Cost per Night': cost_per_night
+        })
@@ -1,24 +1,167 @@
-# v1_main.py file 
- 
+# v1_main.py file
+
+import argparse
 import logging
 import json
 import os
+import sys
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
 import data_processor, data_analyzer, data_visualizer
 import snowflake_manager, snowflake_view_creator
+from pipeline_runner import PipelineRunner
+from connection_pool import close_pool
+from pipeline_common.instrumentation import RunReport
+from pipeline_common.run_cache import RunCache, code_version, file_hash
+
+def process(config, report=None):
+   cleaned_data = data_processor.run(config, checkpoint=config.get('checkpoint_intermediate', True), report=report)
+   if cleaned_data is None:
+      raise RuntimeError("Data processing failed, see the log above")
+   return cleaned_data
+
+def analyze(process):
+   analyzer = data_analyzer.DataAnalyzer(process['spending'], process['places'])
+   return analyzer.perform_analysis()
+
+def make_visualizer(process, config):
+   return data_visualizer.DataVisualizer(process['spending'], process['places'],
+                                         vizualization_folder=config["data_visualization_folder_path"],
+                                         cache_folder=config.get("plot_cache_folder_path"))
+
+def visualize(process, config):
+   return make_visualizer(process, config).create_all_plots(parallel=config.get("parallel_plots", False))
+
+def process_outputs(config):
+   """The files written by the processing stage."""
+   names = ['cleaned_spending_intermediate_path', 'cleaned_places_intermediate_path',
+            'missing_spending_output_path', 'missing_places_output_path']
+   if config.get('export_cleaned_csv', True):
+      names += ['cleaned_spending_output_path', 'cleaned_places_output_path']
+   if config.get('fx_rates_path') and config.get('fx_mismatch_output_path'):
+      names.append('fx_mismatch_output_path')
+   return [config[name] for name in names if os.path.exists(config[name])]
+
+def input_hash(path):
+   """The content hash of an input file, or of every file of a glob (see data_processor.expand_paths)."""
+   paths = data_processor.expand_paths(path)
+   if paths == [path]:
+      return file_hash(path)
+   return RunCache.key('files', {file: file_hash(file) for file in paths})
+
+def stage_keys(config):
+   """
+   Get the run cache key of every cached stage (the views are not cached), from the content of the input files, the config and the code.
+   Each stage is keyed on the files it depends on, so e.g. a new spending file does not reload the places.
+   """
+   code = code_version(os.path.dirname(os.path.abspath(__file__)))
+   inputs = {
+      'spending' : input_hash(config['spending_file_path_local']),
+      'places' : input_hash(config['places_file_path_local'])
+   }
+   # The rates only change the spending data
+   if config.get('fx_rates_path'):
+      inputs['fx_rates'] = file_hash(config['fx_rates_path'])
+   return {
+      'process' : RunCache.key('process', inputs, config, code),
+      'analyze' : RunCache.key('analyze', inputs, config, code),
+      'visualize' : RunCache.key('visualize', inputs, config, code),
+      'load' : RunCache.key('load', inputs['places'], config, code)
+   }
+
+def cached_stages(config, cache, report=None):
+   """
+   Get the stage functions, which reuse the results of an earlier run whose inputs, config and code were the same.
+   A stage is only stored once it has fully succeeded.
+   """
+   keys = stage_keys(config)
+
+   def cached_process():
+      entry = cache.lookup('process', keys['process'])
+      if entry:
+         cache.restore_files(entry)
+         return cache.load_frames(entry)
+      cleaned_data = process(config, report)
+      cache.store('process', keys['process'], frames=cleaned_data, files=process_outputs(config))
+      return cleaned_data
+
+   def cached_analyze(process):
+      entry = cache.lookup('analyze', keys['analyze'])
+      if entry:
+         return cache.load_value(entry)
+      results = analyze(process)
+      cache.store('analyze', keys['analyze'], value=results)
+      return results
+
+   def cached_visualize(process):
+      entry = cache.lookup('visualize', keys['visualize'])
+      if entry:
+         cache.restore_files(entry)
+         return cache.load_value(entry)
+      visualizer = make_visualizer(process, config)
+      paths = visualizer.create_all_plots(parallel=config.get("parallel_plots", False))
+      if sorted(paths) == sorted(visualizer.plot_paths()):
+         cache.store('visualize', keys['visualize'], value=paths, files=paths)
+      return paths
+
+   def cached_load(process):
+      entry = cache.lookup('load', keys['load'])
+      if entry:
+         return cache.load_value(entry)
+      result = load(process, config)
+      # A failed load raises, only a load that reported its rows is stored, so a failure is retried by the next run
+      if result is not None:
+         cache.store('load', keys['load'], value=result)
+      return result
+
+   return cached_process, cached_analyze, cached_visualize, cached_load
+
+def load(process, config):
+   return snowflake_manager.load_places(process['places'], config.get('stage_target_file_mb', 64), config.get('stage_max_workers', 4))
 
 def main () -> None:
+   parser = argparse.ArgumentParser(description="Run the v1 pipeline.")
+   parser.add_argument('--force', action='store_true', help="Recompute every stage, ignoring the run cache.")
+   args = parser.parse_args()
 
    with open("config.json") as f:
       config = json.load(f)
    logging.basicConfig(filename=config["log_file_path_v1"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
-   
-   data_processor.main()
-   data_analyzer.main()
-   data_visualizer.main()
-   
-   snowflake_manager.main()
-   snowflake_view_creator.main()
-   
+
+   # Time and memory of every stage, written at the end of the run
+   report = RunReport('v1')
+
+   # Stages whose input files, config and code did not change since an earlier run reuse its results
+   if config.get('run_cache_folder_path'):
+      cache = RunCache(config['run_cache_folder_path'], max_bytes=config.get('run_cache_max_mb', 2048) * 1024 * 1024,
+                       max_age_days=config.get('run_cache_max_age_days', 30), force=args.force)
+      process_stage, analyze_stage, visualize_stage, load_stage = cached_stages(config, cache, report)
+   else:
+      process_stage = lambda: process(config, report)
+      analyze_stage = analyze
+      visualize_stage = lambda process: visualize(process, config)
+      load_stage = lambda process: load(process, config)
+   # The views are not cached, they rebuild the aggregates of the SPENDING table, which changes outside of the pipeline
+   views_stage = lambda load: snowflake_view_creator.main()
+
+   # The cleaned DataFrames are passed in memory from the processing stage to the others,
+   # the analysis, the plots and the Snowflake load run concurrently
+   runner = PipelineRunner(max_workers=config.get('pipeline_max_workers', 4), report=report)
+   runner.add_stage('process', process_stage)
+   runner.add_stage('analyze', analyze_stage, depends_on=['process'])
+   runner.add_stage('visualize', visualize_stage, depends_on=['process'])
+   runner.add_stage('load', load_stage, depends_on=['process'])
+   runner.add_stage('views', views_stage, depends_on=['load'])
+   runner.run()
+
+   # The Snowflake stages share the pooled sessions, closed once at the end of the run
+   close_pool()
+   report.write(config['run_report_folder_path'], prometheus=config.get('run_report_prometheus', False))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,85 @@
+#date_parser.py file
+import datetime
+import numpy as np
+import pandas as pd
+
+# Formats tried over the whole column, in order, before falling back to per-value parsing
+DEFAULT_DATE_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%Y.%m.%d.']
+
+def convert_date(value):
+    """Parse a single value, falling back to the '%Y.%m.%d.' format and then to NaT."""
+    try:
+        return pd.to_datetime(value)
+    except ValueError:
+        try:
+            return pd.to_datetime(value, format='%Y.%m.%d.')
+        except ValueError:
+            return pd.NaT
+
+class DateParser:
+    def __init__(self, formats=None, cache_size=100000):
+        """
+        Initialize the DateParser.
+
+        Each distinct raw value is parsed only once: known formats are tried over all pending
+        values at once, and only the values matching none of them are parsed one by one
+        with convert_date. Results are cached across calls, up to cache_size values.
+        """
+        self.formats = list(formats) if formats is not None else DEFAULT_DATE_FORMATS
+        self.cache_size = cache_size
+        self.cache = {}
+
+    def parse(self, values):
+        """Convert a Series of raw dates to datetime64, with NaT for unparseable values."""
+        if pd.api.types.is_datetime64_any_dtype(values):
+            return values
+
+        # Parse every distinct value once, nulls get code -1
+        codes, uniques = pd.factorize(values)
+        if len(uniques) == 0:
+            return pd.Series(pd.NaT, index=values.index, name=values.name, dtype='datetime64[ns]')
+        parsed = self._parse_unique(uniques.astype(object))
+
+        result = parsed[codes]
+        result[codes == -1] = np.datetime64('NaT')
+        return pd.Series(result, index=values.index, name=values.name)
+
+    def _parse_unique(self, uniques):
+        """Parse an array of distinct raw values into a datetime64[ns] array."""
+        parsed = np.full(len(uniques), np.datetime64('NaT'), dtype='datetime64[ns]')
+        cached = np.fromiter((value in self.cache for value in uniques), dtype=bool, count=len(uniques))
+        for i in np.flatnonzero(cached):
+            parsed[i] = self.cache[uniques[i]]
+
+        pending = np.flatnonzero(~cached)
+        is_string = np.fromiter((isinstance(uniques[i], str) for i in pending), dtype=bool, count=len(pending))
+        is_datetime = np.fromiter((isinstance(uniques[i], datetime.datetime) for i in pending), dtype=bool, count=len(pending))
+
+        # datetime objects (e.g. Excel date cells) convert directly
+        if is_datetime.any():
+            done = pending[is_datetime]
+            parsed[done] = pd.to_datetime(uniques[done]).to_numpy(dtype='datetime64[ns]')
+
+        # Try each known format over the strings that are still unparsed
+        strings = pending[is_string]
+        for date_format in self.formats:
+            if len(strings) == 0:
+                break
+            converted = pd.to_datetime(pd.Series(uniques[strings]), format=date_format, errors='coerce').to_numpy(dtype='datetime64[ns]')
+            matched = ~np.isnat(converted)
+            parsed[strings[matched]] = converted[matched]
+            strings = strings[~matched]
+
+        # Leftover strings and other types (e.g. numbers) keep the per-value behaviour
+        leftovers = np.concatenate([strings, pending[~is_string & ~is_datetime]])
+        for i in leftovers:
+            value = convert_date(uniques[i])
+            parsed[i] = np.datetime64('NaT') if value is None or pd.isna(value) else pd.Timestamp(value).to_datetime64()
+
+        # Remember the results for later batches
+        if len(self.cache) + len(pending) > self.cache_size:
+            self.cache.clear()
+        for i in pending[:self.cache_size]:
+            self.cache[uniques[i]] = parsed[i]
+
+        return parsed
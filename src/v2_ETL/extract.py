@@ -1,11 +1,20 @@
 #extract.py file
+import fnmatch
+import functools
 import io
 import logging
 import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import boto3
 import pandas as pd
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError
 from dotenv import load_dotenv
+from pipeline_common.dtype_optimizer import optimize_dtypes, log_report
+from pipeline_common.excel_reader import read_excel, read_excel_in_chunks, read_header, check_header
 
 #logging.basicConfig(filename=config["log_file_path_v2"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 load_dotenv()
@@ -13,33 +22,246 @@ load_dotenv()
 aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
 aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 
+# The objects under a prefix file path that are loaded
+SHARD_SUFFIXES = ('.xlsx', '.xls', '.csv')
+
 class DataLoadingError(Exception):
     """Exception raised when an error occurs while loading data."""
 
+def is_pattern(path):
+    """Whether a file path stands for several objects: a prefix ending with / or a glob, e.g. spending/2023_*.xlsx."""
+    return path.endswith('/') or re.search(r'[*?\[]', path) is not None
+
+def parse_excel(data, usecols=None, required=None, engine='auto', name='Excel'):
+    """
+    Parse the bytes of an Excel file into a DataFrame. Module level, so it can run in a process pool.
+
+    :param usecols: The columns to read, see excel_reader.read_excel.
+    :param required: The required columns, checked on the header before the whole file is parsed.
+    :param engine: The engine reading the file, see excel_reader.select_engine.
+    :param name: The name of the data, for the error messages.
+    """
+    buffer = io.BytesIO(data)
+    if required is not None:
+        check_header(read_header(buffer), required, name)
+    return read_excel(buffer, usecols, engine)
+
+def parse_object(name, key, data, usecols=None, required_cols=None, engine='auto'):
+    """
+    Parse the bytes of an Excel or CSV object of name, by the suffix of its key. Module level, so it can run in a process pool.
+
+    :param usecols: The columns to read by name, all of them for a name without an entry.
+    :param required_cols: The required columns by name, checked on the header first.
+    :raises DataLoadingError: If the object cannot be parsed.
+    """
+    usecols, required = (usecols or {}).get(name), (required_cols or {}).get(name)
+    try:
+        if not key.endswith('.csv'):
+            return parse_excel(data, usecols, required, engine, name)
+        if required is not None:
+            check_header(list(pd.read_csv(io.BytesIO(data), nrows=0).columns), required, name)
+        return pd.read_csv(io.BytesIO(data), usecols=None if usecols is None else lambda col: col in usecols)
+    except Exception as e:
+        raise DataLoadingError(f"An error occurred while loading {key}: {e}")
+
 class DataExtractor:
-    def __init__(self, file_paths, bucket):
-        """Initialize the DataExtractor with the given file paths."""
+    def __init__(self, file_paths, bucket, chunk_size=None, max_workers=4, parse_in_processes=False,
+                 multipart_chunksize=8 * 1024 * 1024, s3=None, dtype_schema=None, usecols=None, required_cols=None,
+                 excel_engine='auto'):
+        """
+        Initialize the DataExtractor with the given file paths.
+
+        Objects are downloaded by a pool of max_workers threads. Objects larger than multipart_chunksize
+        bytes are fetched as concurrent ranged GETs of that size. With parse_in_processes, the Excel
+        files are parsed in a process pool instead of the calling thread. An S3 client (or a stand-in
+        with the same methods) can be passed in, otherwise one is created from the environment.
+        The columns of whole files are converted to the compact dtypes of dtype_schema (see
+        dtype_optimizer.convert_column), batches keep the parsed dtypes as their categories differ.
+        Whole files are read with excel_engine (see excel_reader.select_engine), only their usecols
+        (see excel_reader.used_columns), after the required_cols are checked on their header.
+        """
         self.file_paths = file_paths
         self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.parse_in_processes = parse_in_processes
+        self.dtype_schema = dtype_schema or {}
+        self.usecols = usecols or {}
+        self.required_cols = required_cols or {}
+        self.excel_engine = excel_engine
+        self.dtype_reports = {}
         self.data = {}
-        self.s3 = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+        self.metadata = {}
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_chunksize, multipart_chunksize=multipart_chunksize,
+                                              max_concurrency=max_workers)
+        if s3 is None:
+            # Keep enough pooled connections for every download thread and its ranged GETs
+            s3 = boto3.client('s3', aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key,
+                              config=Config(max_pool_connections=max_workers * max_workers))
+        self.s3 = s3
 
 
     def extract_data(self):
         """Load data from the given file paths in S3."""
+        self.data.update(self._extract_objects(self.file_paths))
+        return self.data
+
+    def get_etags(self):
+        """Get the ETag of every object, without downloading them."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            heads = dict(zip(self.file_paths, pool.map(self._head_object, self.file_paths.items())))
+        return {name: head['ETag'] for name, head in heads.items()}
+
+    def extract_changed_data(self, watermarks, linked=None):
+        """
+        Load only the objects whose ETag differs from the one recorded in the given WatermarkStore.
+
+        :param linked: The tables loaded along with a changed table, by name, e.g. the places the spending is linked to.
+        """
+        self.metadata = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            heads = dict(zip(self.file_paths, pool.map(self._head_object, self.file_paths.items())))
+
+        changed_paths = {}
+        for name, head in heads.items():
+            self.metadata[name] = {'etag': head['ETag'], 'last_modified': head['LastModified'].isoformat()}
+            if watermarks.is_unchanged(name, head['ETag']):
+                logging.info(f"{name} data unchanged since the last run, skipping.")
+            else:
+                changed_paths[name] = self.file_paths[name]
+
+        for name in list(changed_paths):
+            for other in (linked or {}).get(name, []):
+                if other in self.file_paths and other not in changed_paths:
+                    logging.info(f"{other} data loaded along with the changed {name} data.")
+                    changed_paths[other] = self.file_paths[other]
+
+        self.data.update(self._extract_objects(changed_paths))
+        return self.data
+
+    def list_shards(self):
+        """
+        Expand the file paths to the sorted keys of their objects, listed from S3.
+
+        A prefix (ending with /) stands for the Excel and CSV objects under it, a glob for the keys it matches
+        (its * also matches /), listed from the prefix before its first glob character. A plain path is its only object.
+
+        :raises DataLoadingError: If a file path matches no object.
+        """
+        shards = {}
         for name, path in self.file_paths.items():
+            if not is_pattern(path):
+                shards[name] = [path]
+                continue
             try:
-                # Get the S3 object
-                obj = self.s3.get_object(Bucket=self.bucket, Key=path)
-                
-                # Read the object's StreamingBody
-                data = obj['Body'].read()
-
-                # Load data into a pandas DataFrame
-                self.data[name] = pd.read_excel(io.BytesIO(data))
+                pages = self.s3.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=re.split(r'[*?\[]', path)[0])
+                keys = [obj['Key'] for page in pages for obj in page.get('Contents', [])]
+            except NoCredentialsError:
+                raise DataLoadingError("No AWS credentials found")
+            except Exception as e:
+                raise DataLoadingError(f"An error occurred while listing the {name} data: {e}")
+
+            keys = [key for key in keys if key.endswith(SHARD_SUFFIXES)] if path.endswith('/') else fnmatch.filter(keys, path)
+            if not keys:
+                raise DataLoadingError(f"No object matches the {name} file path {path}")
+            shards[name] = sorted(keys)
+        return shards
+
+    def extract_shards(self):
+        """
+        Download every object of the file paths (see list_shards) concurrently, without parsing them.
+
+        Yields (name, key, bytes) as the downloads complete, so each object can be parsed and transformed
+        while the others are downloading (see DataTransformer.transform_shards).
+        """
+        shards = self.list_shards()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            downloads = {pool.submit(self._download_object, name, key): (name, key) for name, keys in shards.items() for key in keys}
+            for future in as_completed(downloads):
+                name, key = downloads[future]
+                yield name, key, future.result()
+        logging.info(f"{sum(len(keys) for keys in shards.values())} objects downloaded.")
+
+    def _head_object(self, item):
+        """Get the metadata of a single S3 object."""
+        name, path = item
+        try:
+            return self.s3.head_object(Bucket=self.bucket, Key=path)
+        except NoCredentialsError:
+            raise DataLoadingError("No AWS credentials found")
+        except Exception as e:
+            raise DataLoadingError(f"An error occurred while checking the {name} data: {e}")
+
+    def _download_object(self, name, path):
+        """Download a single S3 object into memory, using ranged GETs for large objects."""
+        try:
+            buffer = io.BytesIO()
+            self.s3.download_fileobj(self.bucket, path, buffer, Config=self.transfer_config)
+            return buffer.getvalue()
+        except NoCredentialsError:
+            raise DataLoadingError("No AWS credentials found")
+        except Exception as e:
+            raise DataLoadingError(f"An error occurred while loading the {name} data: {e}")
+
+    def _extract_objects(self, file_paths):
+        """Download and parse the given objects concurrently, parsing each one as soon as it is downloaded."""
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as download_pool:
+            downloads = {download_pool.submit(self._download_object, name, path): name for name, path in file_paths.items()}
+
+            if self.parse_in_processes:
+                with ProcessPoolExecutor(max_workers=self.max_workers) as parse_pool:
+                    parses = {parse_pool.submit(parse_excel, future.result(), *self._parse_args(downloads[future])): downloads[future]
+                              for future in as_completed(downloads)}
+                    for future in as_completed(parses):
+                        results[parses[future]] = self._parse_result(parses[future], future.result)
+            else:
+                for future in as_completed(downloads):
+                    name = downloads[future]
+                    results[name] = self._parse_result(name, lambda: parse_excel(future.result(), *self._parse_args(name)))
+
+        # Keep the order of the configured file paths
+        return {name: results[name] for name in file_paths}
+
+    def _parse_args(self, name):
+        """The usecols, required columns, engine and name parse_excel reads the object of name with."""
+        return self.usecols.get(name), self.required_cols.get(name), self.excel_engine, name
+
+    def object_parser(self):
+        """The parse_object of the columns and engine of the extractor, as a picklable function of (name, key, bytes)."""
+        return functools.partial(parse_object, usecols=self.usecols, required_cols=self.required_cols, engine=self.excel_engine)
+
+    def _parse_result(self, name, parse):
+        """Call parse() and wrap parsing errors into a DataLoadingError."""
+        try:
+            df = parse()
+        except DataLoadingError:
+            raise
+        except Exception as e:
+            raise DataLoadingError(f"An error occurred while loading the {name} data: {e}")
+        logging.info(f"{name} data loaded successfully.")
+        df, self.dtype_reports[name] = optimize_dtypes(df, self.dtype_schema.get(name))
+        log_report(name, self.dtype_reports[name])
+        return df
+
+    def extract_data_in_chunks(self):
+        """Load data from the given file paths in S3 as (name, DataFrame) batches of at most chunk_size rows."""
+        for name, path in self.file_paths.items():
+            try:
+                if path.endswith('.csv'):
+                    # CSV files are parsed straight from the StreamingBody
+                    obj = self.s3.get_object(Bucket=self.bucket, Key=path)
+                    for chunk in pd.read_csv(obj['Body'], chunksize=self.chunk_size):
+                        yield name, chunk
+                else:
+                    # Excel files need a seekable file, spool the object to disk instead of memory
+                    with tempfile.TemporaryFile() as file:
+                        self.s3.download_fileobj(self.bucket, path, file, Config=self.transfer_config)
+                        file.seek(0)
+                        for chunk in read_excel_in_chunks(file, self.chunk_size):
+                            yield name, chunk
                 logging.info(f"{name} data loaded successfully.")
             except NoCredentialsError:
-                raise DataLoadingError(f"No AWS credentials found")
+                raise DataLoadingError("No AWS credentials found")
             except Exception as e:
                 raise DataLoadingError(f"An error occurred while loading the {name} data: {e}")
-        return self.data
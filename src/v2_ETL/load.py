@@ -1,4 +1,5 @@
 #load.py file
+import io
 import logging
 from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
@@ -7,25 +8,63 @@ import pandas as pd
 #logging.basicConfig(filename=config["log_file_path_v2"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 load_dotenv()
 
+# Mapping between DataFrame column names and database column names
+COLUMN_MAPPINGS = {
+    'spending': {
+        'Title': 'title',
+        'Date': 'date',
+        'Amount': 'amount',
+        'Currency': 'currency',
+        'In EUR': 'in_eur',
+        'Category': 'category',
+        'Payment Method': 'payment_method',
+        'City': 'city',
+        'Country': 'country',
+        'Comment': 'comment',
+        'Stay_Order': 'stay_order'
+    },
+    'places': {
+        'Order': 'order',
+        'Arrival_Date': 'arrival_date',
+        'Nights': 'nights',
+        'Country': 'country',
+        'City': 'city',
+        'Host_Name': 'host_name',
+        'Couchsurfing_FLG': 'couchsurfing_flg',
+        'G_FLG': 'g_flg',
+        'Bike_FLG': 'bike_flg',
+        'Gender': 'gender',
+        'Hosts_Personality_Point': 'hosts_personality_point',
+        'Location_Point': 'location_point',
+        'Comfort': 'comfort',
+        'Comment': 'comment'
+    }
+}
+
 class DataExportError(Exception):
     """Exception raised when an error occurswhile exporting data."""
 
 class DataLoader:
-    def __init__(self, validated_data, output_paths, missing_data, missing_data_output_paths, db_link):
+    def __init__(self, validated_data, output_paths, missing_data, missing_data_output_paths, db_link, chunk_size=50000):
         """Initialize the DataLoader with the given cleaned data, output paths, missing data, and missing data output paths."""
         self.validated_data = validated_data
         self.output_paths = output_paths
         self.missing_data = missing_data
         self.missing_data_output_paths = missing_data_output_paths
         self.db_link = db_link
+        self.chunk_size = chunk_size
+        self.engine = None
 
-    def export_data(self, export_validated=False, export_missing=True):
+    def export_data(self, export_validated=False, export_missing=True, append=False):
         """Export the cleaned data and missing data to the given output paths."""
+        # Append mode adds the rows to an existing file without repeating the header
+        mode = 'a' if append else 'w'
+
         if export_validated:
             # Export validated data to a CSV file
             for name, path in self.output_paths.items():
                 try:
-                    self.validated_data[name].to_csv(path, index=False)
+                    self.validated_data[name].to_csv(path, index=False, mode=mode, header=not append)
                     logging.info(f"{name} data exported successfully.")
                 except Exception as e:
                     raise DataExportError(f"An error occurred while exporting the {name} data: {e}")
@@ -34,78 +73,131 @@ class DataLoader:
             # Export missing data to a CSV file
             for name, path in self.missing_data_output_paths.items():
                 try:
-                    self.missing_data[name].to_csv(path, index=False)
+                    self.missing_data[name].to_csv(path, index=False, mode=mode, header=not append)
                     logging.info(f"{name} missing data exported successfully.")
                 except Exception as e:
                     raise DataExportError(f"An error occurred while exporting the {name} missing data: {e}")
     
-    def load_data_to_db(self, schema):
-        """Load the cleaned data into the database."""
+    def get_engine(self):
+        """Create the database engine on first use and reuse it for later loads."""
+        if self.engine is None:
+            try:
+                self.engine = create_engine(self.db_link)
+                logging.info('Successfully created engine.')
+            except Exception as e:
+                logging.error(f"Failed to create engine: {e}")
+                raise
+        return self.engine
+
+    def load_data_to_db(self, schema, conn=None):
+        """
+        Load the cleaned data into the database, all tables in a single transaction.
 
+        :param conn: An open connection to load the data in, e.g. to stage many batches in one transaction.
+                     Its transaction is left to the caller to commit or roll back.
+        """
+        if conn is None:
+            with self.get_engine().begin() as conn:
+                self.load_data_to_db(schema, conn)
+            return
+        for name, df in self.validated_data.items():
+            self._insert(conn, df, name, schema)
+
+    def upsert_data_to_db(self, schema, key_cols, stale_keys):
+        """
+        Replace the rows matching stale_keys with the validated data, all tables in a single transaction.
+
+        stale_keys holds, per table, the natural key values (DataFrame columns key_cols[name]) of
+        the rows already in the database that have to be deleted before inserting the new version.
+        """
+        with self.get_engine().begin() as conn:
+            for name, df in self.validated_data.items():
+                keys = stale_keys.get(name)
+                if keys is not None and not keys.empty:
+                    self._delete_keys(conn, keys[key_cols[name]], name, schema)
+                self._insert(conn, df, name, schema)
+
+    def _delete_keys(self, conn, keys, name, schema):
+        """Delete the rows matching the given natural key values."""
+        table = f"{schema}.{name}" if schema else name
+        column_mapping = COLUMN_MAPPINGS[name]
+        params = [f"k{i}" for i in range(len(keys.columns))]
+        # NULL-safe comparison, so the rows with a missing key value are replaced too
+        equals = 'IS' if conn.dialect.name == 'sqlite' else 'IS NOT DISTINCT FROM'
+        conditions = ' AND '.join(f'"{column_mapping[col]}" {equals} :{param}' for col, param in zip(keys.columns, params))
+
+        # Date columns are stored as DATE in the database
+        keys = keys.copy()
+        for col in keys.select_dtypes(include='datetime').columns:
+            keys[col] = keys[col].dt.date
+        # Missing values are bound as NULL, not NaN
+        keys = keys.astype(object).where(keys.notna(), None)
+        keys.columns = params
 
         try:
-            engine = create_engine(self.db_link)
-            logging.info('Successfully created engine.')
+            conn.execute(text(f"DELETE FROM {table} WHERE {conditions}"), keys.to_dict('records'))
+            logging.info(f"{len(keys)} changed keys removed from {name}.")
         except Exception as e:
-            logging.error(f"Failed to create engine: {e}")
+            logging.error(f"An error occurred while removing the changed {name} rows: {e}")
             raise
 
-        for name, df in self.validated_data.items():
-            
-            df = pd.DataFrame(df)    
-            column_mapping = {
-                'Title': 'title',
-                'Date': 'date',
-                'Amount': 'amount',
-                'Currency': 'currency',
-                'In EUR': 'in_eur',
-                'Category': 'category',
-                'Payment Method': 'payment_method',
-                'City': 'city',
-                'Country': 'country',
-                'Comment': 'comment'
-            } if name == 'spending' else {
-                'Order': 'order',
-                'Arrival_Date': 'arrival_date',
-                'Nights': 'nights',
-                'Country': 'country',
-                'City': 'city',
-                'Host_Name': 'host_name',
-                'Couchsurfing_FLG': 'couchsurfing_flg',
-                'G_FLG': 'g_flg',
-                'Bike_FLG': 'bike_flg',
-                'Gender': 'gender', 
-                'Hosts_Personality_Point': 'hosts_personality_point',
-                'Location_Point': 'location_point',
-                'Comfort': 'comfort',
-                'Comment': 'comment'
-            }
-
-            df = df.rename(columns=column_mapping)
+    def _insert(self, conn, df, name, schema):
+        """Insert the DataFrame into the table using the given connection."""
+        column_mapping = COLUMN_MAPPINGS[name]
+        # Columns missing from the data, e.g. the stay of spending batches, are left empty
+        df = pd.DataFrame(df).rename(columns=column_mapping)
+        df = df[[column for column in column_mapping.values() if column in df.columns]]
 
-            try:
-                df.to_sql(name+"_temp", engine, if_exists='replace',index=False)
-                logging.info(f"Temporary table {name}_temp created successfully.")
-            except Exception as e:
-                logging.error(f"An error occurred while creating the temporary table: {e}")
-                raise  
+        try:
+            if conn.dialect.name == 'postgresql':
+                self._copy_to_table(conn, df, name, schema)
+            else:
+                # Dialects without COPY (e.g. SQLite) fall back to batched INSERTs
+                df.to_sql(name, conn, schema=schema, if_exists='append', index=False, chunksize=self.chunk_size)
+            logging.info(f"{name} data loaded successfully.")
+        except Exception as e:
+            logging.error(f"An error occurred while loading the {name} data: {e}")
+            raise
 
-            try:
+    def _copy_to_table(self, conn, df, name, schema):
+        """Stream the DataFrame into the table with COPY FROM STDIN."""
+        table = f"{schema}.{name}" if schema else name
+        columns = '"'+'", "'.join(df.columns)+'"'
+        copy_sql = f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)"
 
-                # Define a mapping between DataFrame column names and database column names
-                
+        # Whole-number float columns (integers with nulls) must be written without '.0' for INTEGER columns
+        integer_cols = {}
+        for col in df.select_dtypes(include='float').columns:
+            values = df[col].dropna()
+            if (values == values.round()).all():
+                integer_cols[col] = 'Int64'
+        df = df.astype(integer_cols)
 
-                # Generate SQL to upsert temp table into actual table
-                columns = '"'+'", "'.join(column_mapping.values())+'"'
-                insert_sql = f"INSERT INTO {schema}.{name} ({columns}) SELECT {columns} FROM {schema}.{name}_temp AS temp;"
+        # Use the DB-API cursor of the connection, so the COPY is part of the open transaction
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(copy_sql, CsvChunkStream(df, self.chunk_size))
 
-                with engine.connect() as conn:
-                    stmt = text(insert_sql)
-                    conn.execute(stmt)
+class CsvChunkStream:
+    """File-like object that serializes a DataFrame to CSV chunk_size rows at a time, as COPY reads it."""
 
-                print(insert_sql)
-                # Execute the SQL
+    def __init__(self, df, chunk_size):
+        self.df = df
+        self.chunk_size = chunk_size
+        self.position = 0
+        self.buffer = io.StringIO()
 
-                logging.info(f"{name} data loaded successfully.")
-            except Exception as e:
-                logging.error(f"An error occurred while loading the {name} data: {e}")
\ No newline at end of file
+    def _next_chunk(self):
+        chunk = self.df.iloc[self.position:self.position + self.chunk_size]
+        self.buffer = io.StringIO(chunk.to_csv(index=False, header=False))
+        self.position += self.chunk_size
+
+    def read(self, size=-1):
+        data = self.buffer.read(size)
+        # Serialize the next chunk only once the current one has been consumed
+        while (size < 0 or len(data) < size) and self.position < len(self.df):
+            self._next_chunk()
+            data += self.buffer.read(size - len(data) if size >= 0 else -1)
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
@@ -1,23 +1,123 @@
 #main.py file
 
+import argparse
 import logging
 import json
-from extract import DataExtractor, DataLoadingError
+import os
+import sys
+
+# The modules shared by the v1 and v2 pipelines are in src/pipeline_common
+SRC_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SRC_FOLDER not in sys.path:
+    sys.path.insert(0, SRC_FOLDER)
+
+from extract import DataExtractor, DataLoadingError, is_pattern
 from transform import DataTransformer, DataValidationError, DataCleaningError
 from load import DataLoader, DataExportError
 from dotenv import load_dotenv
 from postgres_create_tables import TableCreator
+from watermark import WatermarkStore
+from pipeline_common.instrumentation import RunReport, count_rows
+from pipeline_common.run_cache import RunCache, code_version, file_hash
+from pipeline_common.fx_rates import from_config as fx_rates_from_config
+from validation import split_rules
+from pipeline_common.excel_reader import used_columns
 
-import os
-import pandas as pd
+
+# The stays of the spending rows are linked with both tables, so in incremental mode a changed table is loaded with the other
+LINKED_TABLES = {'spending': ['places'], 'places': ['spending']}
+
+def run_in_chunks(extractor, transformer, loader, required_cols, threshold, schema='public', fx_mismatch_output_path=None):
+    """
+    Extract, transform, export and load the data batch by batch to keep memory use bounded.
+
+    All the batches are loaded in a single transaction and exported to '.part' files, committed and renamed only
+    once the missing data threshold and the unique rules passed on every whole source, so a rejected file is
+    not partly loaded.
+
+    :param fx_mismatch_output_path: The CSV file the spending rows whose In EUR differs from the rates are appended to
+                                    batch by batch, if any.
+    :return: The number of validated rows loaded.
+    """
+    output_paths = loader.output_paths
+    missing_data_output_paths = loader.missing_data_output_paths
+    exported_paths = list(output_paths.values()) + list(missing_data_output_paths.values())
+    if fx_mismatch_output_path:
+        exported_paths.append(fx_mismatch_output_path)
+    staged_paths = {path: f"{path}.part" for path in exported_paths}
+    exported = set()
+    rows = 0
+
+    try:
+        with loader.get_engine().begin() as conn:
+            chunks = extractor.extract_data_in_chunks()
+            for name, missing_chunk, validated_chunk in transformer.transform_in_chunks(chunks, required_cols=required_cols, threshold=threshold):
+                # Point the loader at the current batch only
+                loader.validated_data = {name: validated_chunk}
+                loader.output_paths = {name: staged_paths[output_paths[name]]}
+                loader.missing_data = {name: missing_chunk}
+                loader.missing_data_output_paths = {name: staged_paths[missing_data_output_paths[name]]}
+
+                loader.export_data(append=name in exported)
+                loader.load_data_to_db(schema=schema, conn=conn)
+                # The mismatches of the batch, the next batch replaces them
+                mismatches = transformer.fx_mismatches.pop(name, None)
+                if name == 'spending' and mismatches is not None and fx_mismatch_output_path:
+                    mismatches.to_csv(staged_paths[fx_mismatch_output_path], index=False, mode='a' if name in exported else 'w',
+                                      header=name not in exported)
+                exported.add(name)
+                rows += len(validated_chunk)
+    except Exception:
+        for path in staged_paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        loader.output_paths = output_paths
+        loader.missing_data_output_paths = missing_data_output_paths
+
+    for path, staged_path in staged_paths.items():
+        if os.path.exists(staged_path):
+            os.replace(staged_path, path)
+    return rows
+
+def cache_keys(extractor, config):
+    """
+    Get the run cache keys of the transformed tables, from the ETags of their S3 objects, the config and the code,
+    and the key of the whole run.
+    """
+    code = code_version(os.path.dirname(os.path.abspath(__file__)))
+    # The rates only change the spending data
+    rates = file_hash(config['fx_rates_path']) if config.get('fx_rates_path') else None
+    tables = {name: RunCache.key('transform', etag, config, code, rates if name == 'spending' else None)
+              for name, etag in extractor.get_etags().items()}
+    return tables, RunCache.key('run', tables)
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the v2 ETL pipeline.")
+    parser.add_argument('--force', action='store_true', help="Rerun every step, ignoring the run cache.")
+    args = parser.parse_args()
 
     # Load the config file
     with open('config.json') as f:
         config=json.load(f)
     logging.basicConfig(filename=config["log_file_path_v2"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
+    # Runs and tables whose S3 objects, config and code did not change since an earlier run are not redone
+    cache = None
+    if config.get('run_cache_folder_path'):
+        cache = RunCache(config['run_cache_folder_path'], max_bytes=config.get('run_cache_max_mb', 2048) * 1024 * 1024,
+                         max_age_days=config.get('run_cache_max_age_days', 30), force=args.force)
+
+    # Time and memory of every stage, written at the end of the run even if a stage failed
+    report = RunReport('v2')
+    try:
+        run(config, report, cache)
+    finally:
+        report.write(config['run_report_folder_path'], prometheus=config.get('run_report_prometheus', False))
+
+def run(config, report, cache=None):
+
     # Load environment variables
     load_dotenv()
 
@@ -26,43 +126,108 @@ def main():
         'places' : config['places_file_path']
     }
 
-    # Use file paths from config file
-    extractor = DataExtractor(file_paths=file_paths, bucket= config['s3bucket'])
+    required_cols = {
+        'spending' : config['spending_required_cols'],
+        'places' : config['places_required_cols']
+    }
+
+    # Use file paths from config file, only the required columns and the other loaded columns are read
+    extractor = DataExtractor(file_paths=file_paths, bucket= config['s3bucket'], chunk_size=config.get('chunk_size'),
+                              max_workers=config.get('extract_max_workers', 4),
+                              parse_in_processes=config.get('extract_parse_in_processes', False),
+                              dtype_schema=config.get('dtype_schema'),
+                              usecols=used_columns(required_cols, config.get('read_cols', {})), required_cols=required_cols,
+                              excel_engine=config.get('excel_engine', 'auto'))
+
+    # Streaming mode runs every step on bounded-size batches
+    if config.get('streaming_mode', False):
+        main_in_chunks(config, extractor, report)
+        return
+
+    # Sharded mode transforms the many objects of prefix or glob file paths in a pool of processes
+    if config.get('sharded_mode', False) or any(is_pattern(path) for path in file_paths.values()):
+        main_sharded(config, extractor, report)
+        return
+
+    # Incremental mode skips the objects loaded by a previous run
+    incremental = config.get('incremental_mode', False)
+    watermarks = WatermarkStore(config['watermark_folder_path']) if incremental else None
+
+    # The run cache skips the whole run if nothing changed, and the extract and transform of the unchanged tables
+    table_keys, run_key, cached = {}, None, {}
+    if cache is not None and not incremental:
+        try:
+            table_keys, run_key = cache_keys(extractor, config)
+        except DataLoadingError as e:
+            logging.error(str(e))
+            return
+        if cache.lookup('run', run_key):
+            logging.info("The input objects, config and code did not change since the last run, nothing to do.")
+            return
+        for name, key in table_keys.items():
+            entry = cache.lookup('transform', key)
+            if entry:
+                cached[name] = cache.load_frames(entry)
+        extractor.file_paths = {name: path for name, path in file_paths.items() if name not in cached}
 
     # Extract Data
     try:
-        data = extractor.extract_data()
+        with report.stage('extract') as stage:
+            data = extractor.extract_changed_data(watermarks, LINKED_TABLES) if incremental else extractor.extract_data()
+            stage['rows_out'] = count_rows(data)
     except DataLoadingError as e:
         logging.error(str(e))
         return
+
+    if not data and not cached:
+        logging.info("No new data to load.")
+        return
     
     # Check Data
-    required_cols = {
-        'spending' : config['spending_required_cols'],
-        'places' : config['places_required_cols']
-    }
-    transformer = DataTransformer(data=data)
+    transformer = DataTransformer(data=data, rules=config.get('validation_rules'), fx_rates=fx_rates_from_config(config),
+                                  fx_mode=config.get('fx_mode', 'check'), fx_tolerance=config.get('fx_tolerance', 0.02))
     try:
-        missing_data, checked_data = transformer.check_data(required_cols=required_cols)
-        transformer.check_missing_data_threshold(missing_data=missing_data,threshold=config['missing_data_threshold'])
+        with report.stage('check_data', rows_in=count_rows(data)) as stage:
+            missing_data, checked_data = transformer.check_data(required_cols=required_cols, threshold=config['missing_data_threshold'])
+            stage['rows_out'] = count_rows(checked_data)
     except DataValidationError as e:
         logging.error(str(e))
         return
     
     # Clean data
     try:
-        cleaned_data = transformer.clean_data(data=checked_data)
+        with report.stage('clean_data', rows_in=count_rows(checked_data)) as stage:
+            cleaned_data = transformer.clean_data(data=checked_data)
+            stage['rows_out'] = count_rows(cleaned_data)
     except DataCleaningError as e:
         logging.error(str(e))
         return
     
+    # The cached tables are validated again with the new ones, for the rules across tables
+    order = [name for name in file_paths if name in cleaned_data or name in cached]
+    missing_data = {name: cached[name]['missing'] if name in cached else missing_data[name] for name in order}
+    cleaned_data = {name: cached[name]['validated'] if name in cached else cleaned_data[name] for name in order}
+
+    # The stay of every spending row, linked after the merge as the places may have changed
+    try:
+        cleaned_data = transformer.link_stays(cleaned_data)
+    except DataCleaningError as e:
+        logging.error(str(e))
+        return
+
     # Validate data
     try:
-        validated_data = transformer.validate_data(data=cleaned_data)
-    except AssertionError as e:
-        logging.error(f"An error occurred while validating the data: {e}")
+        with report.stage('validate_data', rows_in=count_rows(cleaned_data)) as stage:
+            validated_data = transformer.validate_data(data=cleaned_data)
+            stage['rows_out'] = count_rows(validated_data)
+    except DataValidationError as e:
+        logging.error(str(e))
         return
 
+    for name, key in table_keys.items():
+        if name not in cached:
+            cache.store('transform', key, frames={'validated': validated_data[name], 'missing': missing_data[name]})
+
     # Export cleaned data
     output_paths = {
         'spending' : config['cleaned_spending_output_path'],
@@ -90,7 +255,11 @@ def main():
         return
 
     try:
-        loader.export_data()
+        with report.stage('export', rows_in=count_rows(validated_data)):
+            loader.export_data()
+            # Export the spending rows whose In EUR differs from the rates to review manually
+            if 'spending' in transformer.fx_mismatches and config.get('fx_mismatch_output_path'):
+                transformer.fx_mismatches['spending'].to_csv(config['fx_mismatch_output_path'], index=False)
     except DataExportError as e:
         logging.error(str(e))
         return
@@ -105,10 +274,140 @@ def main():
 
       # Load data into database
     try:
-        loader.load_data_to_db(schema='public')
+        with report.stage('load', rows_in=count_rows(validated_data)):
+            if incremental:
+                load_incremental(extractor, loader, watermarks, config)
+            else:
+                loader.load_data_to_db(schema='public')
+    except Exception as e:
+        logging.error(f"An error occurred while loading the data into the database: {e}")
+        return
+
+    if run_key is not None:
+        cache.store('run', run_key)
+
+def load_incremental(extractor, loader, watermarks, config):
+    """Upsert only the new or changed rows and record the watermarks once the load is committed."""
+    key_cols = {
+        'spending' : config['spending_key_cols'],
+        'places' : config['places_key_cols']
+    }
+    date_cols = {'spending': 'Date', 'places': 'Arrival_Date'}
+
+    validated_data = loader.validated_data
+    deltas, stale_keys, hashes = {}, {}, {}
+    for name, df in validated_data.items():
+        deltas[name], stale_keys[name], hashes[name] = watermarks.compute_delta(name, df, key_cols[name])
+
+    loader.validated_data = deltas
+    loader.upsert_data_to_db(schema='public', key_cols=key_cols, stale_keys=stale_keys)
+    loader.validated_data = validated_data
+
+    for name, df in validated_data.items():
+        watermarks.update(name, extractor.metadata[name], hashes[name], df, date_cols[name])
+    watermarks.save()
+
+def main_in_chunks(config, extractor, report):
+    required_cols = {
+        'spending' : config['spending_required_cols'],
+        'places' : config['places_required_cols']
+    }
+    output_paths = {
+        'spending' : config['cleaned_spending_output_path'],
+        'places' : config['cleaned_places_output_path']
+    }
+    missing_data_output_paths = {
+        'spending' : config['missing_spending_output_path'],
+        'places' : config['missing_places_output_path']
+    }
+    db_link = os.getenv('POSTGRES_DB_LINK')
+
+    transformer = DataTransformer(data={}, rules=config.get('validation_rules'), fx_rates=fx_rates_from_config(config),
+                                  fx_mode=config.get('fx_mode', 'check'), fx_tolerance=config.get('fx_tolerance', 0.02))
+    loader = DataLoader(validated_data={}, missing_data={}, output_paths=output_paths, missing_data_output_paths=missing_data_output_paths, db_link=db_link)
+
+    try:
+        # Create table objects
+        table_creator = TableCreator()
+        table_creator.create_tables()
+    except Exception as e:
+        logging.error(f"An error occurred while creating the tables in the PostgreSQL database: {e}")
+        return
+
+    try:
+        with report.stage('run_in_chunks') as stage:
+            stage['rows_out'] = run_in_chunks(extractor, transformer, loader, required_cols=required_cols, threshold=config['missing_data_threshold'],
+                                              fx_mismatch_output_path=config.get('fx_mismatch_output_path'))
+    except (DataLoadingError, DataValidationError, DataCleaningError, DataExportError) as e:
+        logging.error(str(e))
     except Exception as e:
         logging.error(f"An error occurred while loading the data into the database: {e}")
+
+def main_sharded(config, extractor, report):
+    required_cols = {
+        'spending' : config['spending_required_cols'],
+        'places' : config['places_required_cols']
+    }
+    output_paths = {
+        'spending' : config['cleaned_spending_output_path'],
+        'places' : config['cleaned_places_output_path']
+    }
+    missing_data_output_paths = {
+        'spending' : config['missing_spending_output_path'],
+        'places' : config['missing_places_output_path']
+    }
+    db_link = os.getenv('POSTGRES_DB_LINK')
+
+    transformer = DataTransformer(data={}, rules=config.get('validation_rules'), fx_rates=fx_rates_from_config(config),
+                                  fx_mode=config.get('fx_mode', 'check'), fx_tolerance=config.get('fx_tolerance', 0.02))
+
+    # Every object is checked, cleaned and validated row by row in a worker, the threshold on the totals of each table
+    try:
+        with report.stage('transform_shards') as stage:
+            missing_data, cleaned_data = transformer.transform_shards(extractor.extract_shards(), extractor.object_parser(), required_cols=required_cols,
+                                                                      threshold=config['missing_data_threshold'],
+                                                                      max_workers=config.get('shard_max_workers'),
+                                                                      dtype_schema=extractor.dtype_schema)
+            stage['rows_out'] = count_rows(cleaned_data)
+    except (DataLoadingError, DataValidationError, DataCleaningError) as e:
+        logging.error(str(e))
         return
 
+    # The rules across rows and tables need the concatenated tables
+    try:
+        cleaned_data = transformer.link_stays(cleaned_data)
+        with report.stage('validate_data', rows_in=count_rows(cleaned_data)) as stage:
+            validated_data = transformer.validate_data(data=cleaned_data, rules=split_rules(transformer.rules)[1])
+            stage['rows_out'] = count_rows(validated_data)
+    except (DataValidationError, DataCleaningError) as e:
+        logging.error(str(e))
+        return
+
+    loader = DataLoader(validated_data=validated_data, missing_data=missing_data, output_paths=output_paths, missing_data_output_paths=missing_data_output_paths, db_link=db_link)
+
+    try:
+        # Create table objects
+        table_creator = TableCreator()
+        table_creator.create_tables()
+    except Exception as e:
+        logging.error(f"An error occurred while creating the tables in the PostgreSQL database: {e}")
+        return
+
+    try:
+        with report.stage('export', rows_in=count_rows(validated_data)):
+            loader.export_data()
+            # Export the spending rows whose In EUR differs from the rates to review manually
+            if 'spending' in transformer.fx_mismatches and config.get('fx_mismatch_output_path'):
+                transformer.fx_mismatches['spending'].to_csv(config['fx_mismatch_output_path'], index=False)
+    except DataExportError as e:
+        logging.error(str(e))
+        return
+
+    try:
+        with report.stage('load', rows_in=count_rows(validated_data)):
+            loader.load_data_to_db(schema='public')
+    except Exception as e:
+        logging.error(f"An error occurred while loading the data into the database: {e}")
+
 if __name__ == "__main__":
     main()
@@ -1,6 +1,6 @@
 # postgres_create_tables.py
 import logging
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Date, Float
+from sqlalchemy import create_engine, text, MetaData, Table, Column, Integer, String, Date, Float
 from sqlalchemy.engine import reflection
 from dotenv import load_dotenv
 import os
@@ -34,6 +34,7 @@ class TableCreator:
             Column('city', String),
             Column('country', String),
             Column('comment', String),
+            Column('stay_order', Integer),
             extend_existing=True  # Add this line
         )
 
@@ -66,10 +67,22 @@ class TableCreator:
                 logging.info('Successfully created tables.')
             else:
                 logging.info('Tables already exist. Skipping table creation.')
+                self.add_missing_columns()
         except Exception as e:
             logging.error(f"Failed to create tables: {e}")
 
 
+    def add_missing_columns(self):
+        """Add the columns defined here but missing from the existing tables, e.g. stay_order of spending."""
+        for table in (self.spending, self.places):
+            existing = {column['name'] for column in self.inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    with self.engine.begin() as conn:
+                        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column.type.compile(self.engine.dialect)}'))
+                    logging.info(f"Column {column.name} added to the {table.name} table.")
+
+
 def main():
     table_creator = TableCreator()
     table_creator.create_tables()
@@ -1,6 +1,15 @@
 #transform.py
 import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import numpy as np
 import pandas as pd
+from date_parser import DateParser
+from validation import DEFAULT_RULES, evaluate_rules, log_results, split_rules, repeated_keys
+from pipeline_common.dtype_optimizer import optimize_dtypes, log_report
+from pipeline_common.fx_rates import apply_fx_rates
+from pipeline_common.stay_index import link_stays
+from pipeline_common.missing_data import MissingDataChecker
 
 #logging.basicConfig(filename=config["log_file_path_v2"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
 
@@ -10,87 +19,85 @@ class DataValidationError(Exception):
 class DataCleaningError(Exception):
     """Exception raised when an error occurs while cleaning data."""
 
-class DataTransformer:
-    def __init__(self, data):
-        """Initialize the DataTransformer with the given data."""
+def transform_shard(transformer, parse, name, key, content, required_cols, rules):
+    """
+    Parse, check, clean and validate one object of a table. Module level, so it can run in a process pool.
+
+    The missing data threshold and the rules across rows are not checked here, they apply to all the shards of the table.
+
+    :param rules: The rules on single rows, see validation.split_rules.
+    :return: The number of rows, the missing data, the validated data and the fx mismatches (None without rates) of the object.
+    """
+    df = parse(name, key, content)
+    transformer.data = {name: df}
+    transformer.fx_mismatches = {}
+    missing_data, checked_data = transformer.check_data(required_cols={name: required_cols[name]})
+    validated_data = transformer.validate_data(data=transformer.clean_data(data=checked_data), rules=rules)
+    return len(df), missing_data[name], validated_data[name], transformer.fx_mismatches.get(name)
+
+class DataTransformer(MissingDataChecker):
+    # A proportion of missing data above the threshold fails the validation
+    missing_data_error = DataValidationError
+
+    def __init__(self, data, rules=None, fx_rates=None, fx_mode='check', fx_tolerance=0.02):
+        """
+        Initialize the DataTransformer with the given data.
+
+        :param rules: The validation rules by table name (see validation.evaluate_rules), defaults to DEFAULT_RULES.
+        :param fx_rates: The FxRates clean_data checks (or derives) the In EUR of the spending data with, if any.
+        :param fx_mode: 'check' or 'derive', see fx_rates.apply_fx_rates.
+        :param fx_tolerance: The relative difference allowed between In EUR and the derived value.
+        """
         self.data = data
+        self.rules = rules or DEFAULT_RULES
+        self.validation_results = []
+        self.fx_rates = fx_rates
+        self.fx_mode = fx_mode
+        self.fx_tolerance = fx_tolerance
+        self.fx_mismatches = {}
+        self.date_parser = DateParser()
+
+    def validate_data(self, data, rules=None):
+        """
+        Validate the data with the rules, evaluating all of them before failing.
+
+        The results of the last validation, one per rule with the positions of the violating rows,
+        are kept in validation_results.
+
+        :param rules: The rules to evaluate instead of self.rules, e.g. a part of them (see validation.split_rules).
+        :raises DataValidationError: If a rule of severity 'error' has violations.
+        """
+        try:
+            self.validation_results = evaluate_rules(data, self.rules if rules is None else rules)
+        except Exception as e:
+            raise DataValidationError(f"An error occurred while validating the data: {e}")
+        log_results(self.validation_results)
 
-    def check_data(self, required_cols):
-        """Check for missing data in the required columns."""
-        missing_data = {}
-        checked_data = {}
-
-        for name, df in self.data.items():
-            # Check for nulls in required columns and separate rows with missing coluns
-            missing_data[name] = df[df[required_cols[name]].isnull().any(axis=1)]
-        
-            # Log a warning if any missing values are found
-            if not missing_data[name].empty:
-                logging.warning(f"Null values found in {name} data")
-
-            # Remove rows with missing values from the original data
-            checked_data[name] = df.drop(missing_data[name].index)
-
-        return missing_data, checked_data
-
-    def check_missing_data_threshold(self, missing_data, threshold):
-        """Check if the proportion of missing data exceeds the given threshold."""
-        for name, df in missing_data.items():
-            # IF there are missing data
-            if not df.empty:
-                missing_proportion = len(df) / len(self.data[name])
-                logging.warning(f"Missing data proportion on {name}: {missing_proportion}")
-
-                # Check if missing data exceeds the threshold
-                if missing_proportion > threshold:
-                    raise DataValidationError(f"Proportion of missing data in {name} exceeds threshold({threshold}): {missing_proportion}")
-    
-    def validate_data(self, data):
-        """Validate the data by performing various checks."""
-        for name, df in data.items():
-            df = df.copy() # Create a copy of the DataFrame
-
-            # Check data types
-            if name == 'spending':
-                assert df['Date'].dtype == 'datetime64[ns]', "Date column is not of type datetime"
-                assert df['Amount'].dtype in ['int64', 'float64'], "Amount column is not numeric"
-            if name == 'places':
-                assert df['Arrival_Date'].dtype == 'datetime64[ns]', "Arrival_Date column is not of type datetime"
-                assert df['Nights'].dtype in ['int64', 'float64'], "Nights column is not numeric"
-
-            # Check value ranges
-            if name == 'places':
-                assert df['Nights'].min() >= 0, "Nights column contains negative values"
-
-            # Check for duplicates
-            assert df.duplicated().sum() == 0, "Data contains duplicate rows"
+        failed = [result for result in self.validation_results if result['violations'] and result['severity'] == 'error']
+        if failed:
+            raise DataValidationError("Data validation failed: " + "; ".join(
+                f"{result['rule']} on {result['table']} {', '.join(result['columns'])} ({result['violations']} rows)" for result in failed))
 
         logging.info("Data validated successfully.")
         return data
-        
-    
+
     def clean_data(self, data):
         """Clean the data by performing necessary data cleaning tasks."""
-        def convert_date(value):
-            try:
-                return pd.to_datetime(value)
-            except ValueError:
-                try:
-                    return pd.to_datetime(value, format='%Y.%m.%d.')
-                except ValueError:
-                    return pd.NaT
-
         try:
             for name, df in data.items():
-                df = df.copy() # Create a copy of the DataFrame
+                # A shallow copy, the cleaned columns are replaced rather than modified in place
+                df = df.copy(deep=False)
                 if name == 'spending':
                 # Spending data cleaning
-                    df['Date'] = df['Date'].apply(convert_date)
+                    df['Date'] = self.date_parser.parse(df['Date'])
                     df['Amount'] = pd.to_numeric(df['Amount'], errors='coerce')
                     df['Title'] = df['Title'].str.strip()
+                    if self.fx_rates is not None:
+                        # Keep the rows whose In EUR differs from the rates, to review manually
+                        self.fx_mismatches[name] = apply_fx_rates(df, self.fx_rates, self.fx_mode, self.fx_tolerance)
                 if name == 'places':
                 # Places data cleaning
-                    df['Arrival_Date'] = df['Arrival_Date'].apply(convert_date)
+                    df['Arrival_Date'] = self.date_parser.parse(df['Arrival_Date'])
                     df['Nights'] = pd.to_numeric(df['Nights'], errors='coerce')
 
                 # Update the DataFrame in the data dictionary
@@ -101,3 +108,114 @@ class DataTransformer:
             raise DataCleaningError(f"An error occurred while cleaning the data: {e}")
 
         return data
+
+    def link_stays(self, data):
+        """
+        Store the Order of the stay of every spending row as the integer foreign key column Stay_Order (see stay_index),
+        so the later joins of spending and places use it instead of the City strings.
+        Both tables are needed, so batches, which hold a single table, are not linked.
+        """
+        if 'spending' in data and 'places' in data:
+            try:
+                data['spending'] = link_stays(data['spending'], data['places'])
+            except Exception as e:
+                raise DataCleaningError(f"An error occurred while linking the spending data to the stays: {e}")
+        return data
+
+    def transform_in_chunks(self, chunks, required_cols, threshold):
+        """
+        Check, clean and validate (name, DataFrame) batches one at a time.
+
+        The missing data threshold is checked on the totals of each source once its
+        last batch has been transformed, and the unique rules on the keys of all the
+        batches of the source. Yields (name, missing data, validated data).
+        """
+        row_counts = {}
+        missing_counts = {}
+        seen_keys = {}
+        current_name = None
+        for name, chunk in chunks:
+            if name != current_name:
+                if current_name is not None:
+                    self.check_missing_count(current_name, missing_counts[current_name], row_counts[current_name], threshold)
+                current_name = name
+                row_counts[name] = 0
+                missing_counts[name] = 0
+
+            self.data = {name: chunk}
+            missing_data, checked_data = self.check_data(required_cols=required_cols)
+            row_counts[name] += len(chunk)
+            missing_counts[name] += len(missing_data[name])
+
+            validated_data = self.validate_data(data=self.clean_data(data=checked_data))
+            self.check_batch_keys(name, validated_data[name], seen_keys)
+            yield name, missing_data[name], validated_data[name]
+
+        if current_name is not None:
+            self.check_missing_count(current_name, missing_counts[current_name], row_counts[current_name], threshold)
+
+    def check_batch_keys(self, name, df, seen_keys):
+        """
+        Check the unique rules of the table against the keys of its earlier batches, as validate_data
+        only sees the current batch.
+
+        :param seen_keys: The sorted key hashes of the earlier batches by (name, rule position), see validation.repeated_keys,
+                          updated with the batch.
+        :raises DataValidationError: If a rule of severity 'error' has keys repeated from an earlier batch.
+        """
+        for position, rule in enumerate(self.rules.get(name, [])):
+            columns = rule['columns'] if 'columns' in rule else [rule.get('column')]
+            if rule['rule'] != 'unique' or not all(column in df.columns for column in columns):
+                continue
+            mask, seen_keys[(name, position)] = repeated_keys(df, rule, seen_keys.get((name, position), np.empty(0, dtype=np.uint64)))
+            repeated = int(mask.sum())
+            if not repeated:
+                continue
+            message = f"unique rule on {name} {', '.join(columns)}: {repeated} rows repeat the key of an earlier batch"
+            if rule.get('severity', 'error') == 'error':
+                raise DataValidationError(f"Data validation failed: {message}")
+            logging.warning(f"Validation {message}")
+
+    def transform_shards(self, shards, parse, required_cols, threshold, max_workers=None, dtype_schema=None):
+        """
+        Check, clean and validate tables split over many objects, e.g. one workbook per trip or year, in a pool of processes.
+
+        Every shard is parsed and transformed in a worker as soon as it is received, with the rules on single rows.
+        The missing data threshold is checked on the totals of each table once all its shards are done, then the
+        shards are concatenated in the order of their keys. The rules across rows and tables (unique, reference)
+        are left to validate_data on the whole tables, see validation.split_rules.
+
+        :param shards: The (name, key, bytes) of every object, see DataExtractor.extract_shards.
+        :param parse: The function parsing the (name, key, bytes) of an object into a DataFrame, see DataExtractor.object_parser.
+        :param max_workers: The number of processes, defaults to the number of CPUs.
+        :param dtype_schema: The compact dtypes of the concatenated tables, see dtype_optimizer.optimize_dtypes.
+                             The shards keep the parsed dtypes, as their categories differ.
+        :return: The missing and the validated data by name, in the order of required_cols.
+        """
+        row_rules, _ = split_rules(self.rules)
+        results = {}
+        # Spawned workers, as forking the threads of the PipelineRunner can deadlock on the locks they hold
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {pool.submit(transform_shard, self, parse, name, key, content, required_cols, row_rules): (name, key)
+                       for name, key, content in shards}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        missing_data = {}
+        validated_data = {}
+        for name in required_cols:
+            keys = sorted(key for shard_name, key in results if shard_name == name)
+            if not keys:
+                continue
+            parts = [results[(name, key)] for key in keys]
+            logging.info(f"{name} data transformed from {len(keys)} objects.")
+            self.check_missing_count(name, sum(len(part[1]) for part in parts), sum(part[0] for part in parts), threshold)
+
+            missing_data[name] = pd.concat([part[1] for part in parts], ignore_index=True)
+            validated_data[name], report = optimize_dtypes(pd.concat([part[2] for part in parts], ignore_index=True),
+                                                           (dtype_schema or {}).get(name))
+            log_report(name, report)
+            mismatches = [part[3] for part in parts if part[3] is not None]
+            if mismatches:
+                self.fx_mismatches[name] = pd.concat(mismatches, ignore_index=True)
+        return missing_data, validated_data
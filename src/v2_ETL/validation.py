@@ -0,0 +1,173 @@
+#validation.py
+import logging
+import re
+import numpy as np
+import pandas as pd
+
+#logging.basicConfig(filename=config["log_file_path_v2"], level=logging.INFO, format=' %(asctime)s %(levelname)s %(message)s')
+
+# The checks of the former hard-coded validate_data, used when config.json has no "validation_rules"
+DEFAULT_RULES = {
+    'spending': [
+        {'rule': 'dtype', 'column': 'Date', 'dtype': 'datetime'},
+        {'rule': 'dtype', 'column': 'Amount', 'dtype': 'numeric'},
+        {'rule': 'unique', 'columns': ['Date', 'Title', 'In EUR']}
+    ],
+    'places': [
+        {'rule': 'dtype', 'column': 'Arrival_Date', 'dtype': 'datetime'},
+        {'rule': 'dtype', 'column': 'Nights', 'dtype': 'numeric'},
+        {'rule': 'range', 'column': 'Nights', 'min': 0},
+        {'rule': 'unique', 'columns': ['Order', 'Arrival_Date']}
+    ]
+}
+
+DTYPE_CHECKS = {
+    'datetime': pd.api.types.is_datetime64_any_dtype,
+    'numeric': pd.api.types.is_numeric_dtype,
+    'integer': pd.api.types.is_integer_dtype,
+    'string': lambda s: pd.api.types.is_string_dtype(s) or pd.api.types.is_object_dtype(s),
+    'bool': pd.api.types.is_bool_dtype,
+    'category': lambda s: isinstance(s.dtype, pd.CategoricalDtype)
+}
+
+def _rule_columns(rule):
+    return list(rule['columns']) if 'columns' in rule else [rule['column']]
+
+def _available(data, name, columns):
+    return name in data and all(column in data[name].columns for column in columns)
+
+def _key_hashes(df, columns):
+    """Hash the key columns of every row to one uint64, so keys are compared without building tuples of the whole row."""
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+def check_dtype(df, rule, data):
+    """The column has the dtype, one of the DTYPE_CHECKS names or a numpy / pandas dtype name. Fails every row if not."""
+    series = df[rule['column']]
+    check = DTYPE_CHECKS.get(rule['dtype'])
+    valid = check(series) if check else series.dtype == rule['dtype']
+    return np.zeros(len(df), dtype=bool) if valid else np.ones(len(df), dtype=bool)
+
+def check_range(df, rule, data):
+    """The values are within the inclusive 'min' and / or 'max'. Nulls are left to check_data."""
+    values = df[rule['column']]
+    mask = np.zeros(len(df), dtype=bool)
+    if 'min' in rule:
+        mask |= (values < rule['min']).to_numpy(dtype=bool, na_value=False)
+    if 'max' in rule:
+        mask |= (values > rule['max']).to_numpy(dtype=bool, na_value=False)
+    return mask
+
+def check_regex(df, rule, data):
+    """The values, as strings, fully match the 'pattern'. Each distinct value is matched once."""
+    codes, uniques = pd.factorize(df[rule['column']])
+    pattern = re.compile(rule['pattern'])
+    matches = np.array([pattern.fullmatch(str(value)) is not None for value in uniques], dtype=bool)
+    # Nulls have the code -1 and are not checked
+    return (codes >= 0) & ~matches[codes] if len(uniques) else np.zeros(len(df), dtype=bool)
+
+def check_allowed(df, rule, data):
+    """The values are in the 'values' list."""
+    values = df[rule['column']]
+    return (values.notna() & ~values.isin(rule['values'])).to_numpy(dtype=bool)
+
+def check_unique(df, rule, data):
+    """No two rows share the key 'columns'. The repeated rows are flagged, not their first occurrence."""
+    return pd.Series(_key_hashes(df, _rule_columns(rule))).duplicated().to_numpy()
+
+def repeated_keys(df, rule, seen):
+    """
+    Flag the rows whose key 'columns' of a unique rule are in seen, the sorted uint64 array of the key hashes of the
+    earlier batches of the table. check_unique only sees the rows of one batch. The hashes take 8 bytes per key,
+    and are looked up with a binary search.
+
+    :return: The mask, and seen merged with the keys of df.
+    """
+    hashes = _key_hashes(df, _rule_columns(rule))
+    if len(seen):
+        mask = seen[np.minimum(np.searchsorted(seen, hashes), len(seen) - 1)] == hashes
+    else:
+        mask = np.zeros(len(hashes), dtype=bool)
+    return mask, np.union1d(seen, hashes)
+
+def check_reference(df, rule, data):
+    """
+    The key 'columns' exist in the 'table' (with 'reference_columns', by default the same names).
+    Rows with a null key are not checked.
+    """
+    columns = _rule_columns(rule)
+    reference = data[rule['table']]
+    reference_columns = rule.get('reference_columns', columns)
+    known = _key_hashes(reference.dropna(subset=reference_columns), reference_columns)
+    mask = ~np.isin(_key_hashes(df, columns), known)
+    return mask & df[columns].notna().all(axis=1).to_numpy()
+
+# The rules checked on every row on its own, which give the same result on any split of the rows
+ROW_RULES = ('dtype', 'range', 'regex', 'allowed')
+
+RULES = {
+    'dtype': check_dtype,
+    'range': check_range,
+    'regex': check_regex,
+    'allowed': check_allowed,
+    'unique': check_unique,
+    'reference': check_reference
+}
+
+def evaluate_rules(data, rules):
+    """
+    Evaluate every rule on the data, without stopping at the first violation.
+
+    A rule is a dict with the 'rule' type (see RULES), its 'column' or 'columns', the parameters of the type
+    and an optional 'severity', 'error' (the default) or 'warning'. Rules on a table, column or reference
+    table that is not in the data are skipped, e.g. the referential checks of a single batch.
+
+    :param data: The DataFrames by name.
+    :param rules: The list of rules by table name.
+    :return: One result per rule, with the 'table', 'rule', 'columns', 'severity', whether it was 'skipped',
+             the number of 'violations' and the positions of the violating 'rows' as a numpy array.
+    """
+    results = []
+    for name, table_rules in rules.items():
+        df = data.get(name)
+        for rule in table_rules:
+            if rule['rule'] not in RULES:
+                raise ValueError(f"Unknown validation rule {rule['rule']} on {name}")
+            result = {
+                'table': name,
+                'rule': rule['rule'],
+                'columns': _rule_columns(rule),
+                'severity': rule.get('severity', 'error'),
+                'skipped': False,
+                'violations': 0,
+                'rows': np.array([], dtype=np.int64)
+            }
+            if not _available(data, name, result['columns']) or \
+                    ('table' in rule and not _available(data, rule['table'], rule.get('reference_columns', result['columns']))):
+                result['skipped'] = True
+            else:
+                result['rows'] = np.flatnonzero(RULES[rule['rule']](df, rule, data))
+                result['violations'] = len(result['rows'])
+            results.append(result)
+    return results
+
+def split_rules(rules):
+    """
+    Split the rules by table name into the rules on single rows (ROW_RULES), which can run on every shard of a
+    table on its own, and the rules across rows and tables (unique, reference), which need the whole tables.
+    """
+    row_rules = {name: [rule for rule in table_rules if rule['rule'] in ROW_RULES] for name, table_rules in rules.items()}
+    table_rules = {name: [rule for rule in table_rules if rule['rule'] not in ROW_RULES] for name, table_rules in rules.items()}
+    return row_rules, table_rules
+
+def summarize(results):
+    """The results without the row positions, e.g. to log or write them."""
+    return [{key: value for key, value in result.items() if key != 'rows'} for result in results]
+
+def log_results(results):
+    for result in results:
+        description = f"{result['rule']} rule on {result['table']} {', '.join(result['columns'])}"
+        if result['skipped']:
+            logging.info(f"Validation {description} skipped, the data is not available.")
+        elif result['violations']:
+            log = logging.error if result['severity'] == 'error' else logging.warning
+            log(f"Validation {description}: {result['violations']} violating rows, e.g. {result['rows'][:5].tolist()}")
@@ -0,0 +1,91 @@
+#watermark.py file
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+class WatermarkStore:
+    def __init__(self, folder):
+        """
+        Initialize the WatermarkStore with the folder holding the state of the previous runs.
+
+        Per source, watermarks.json keeps the S3 ETag / LastModified of the last loaded object,
+        its row count and max date, and {name}_hashes.npz keeps one hash per natural key and
+        one hash over all rows sharing that key.
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, 'watermarks.json')
+        self.watermarks = {}
+        self.hashes = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.watermarks = json.load(f)
+
+    def is_unchanged(self, name, etag):
+        """Check if the object was already loaded with the same ETag."""
+        return self.watermarks.get(name, {}).get('etag') == etag
+
+    def _load_hashes(self, name):
+        path = os.path.join(self.folder, f"{name}_hashes.npz")
+        if name not in self.hashes:
+            if os.path.isfile(path):
+                with np.load(path) as stored:
+                    self.hashes[name] = (stored['keys'], stored['groups'])
+            else:
+                self.hashes[name] = (np.array([], dtype='uint64'), np.array([], dtype='uint64'))
+        return self.hashes[name]
+
+    def compute_delta(self, name, df, key_cols):
+        """
+        Compare the data with the previous run using its natural key.
+
+        :return: The rows of every new or changed key, the distinct key values already loaded
+                 that have to be replaced, and the new (keys, groups) hashes for update().
+        """
+        keys = df[key_cols].copy()
+        # Dates are stored as DATE in the database, so the key has the same granularity
+        for col in keys.select_dtypes(include='datetime').columns:
+            keys[col] = keys[col].dt.normalize()
+
+        key_hashes = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+        row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+        # One hash per key: the (wrapping) sum of the row hashes, independent of the row order
+        order = np.argsort(key_hashes, kind='stable')
+        sorted_keys = key_hashes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]][:len(sorted_keys)])
+        unique_keys = sorted_keys[starts]
+        groups = np.add.reduceat(row_hashes[order], starts) if len(starts) else np.array([], dtype='uint64')
+
+        # Look the keys up in the sorted hashes of the previous run
+        stored_keys, stored_groups = self._load_hashes(name)
+        found = np.zeros(len(unique_keys), dtype=bool)
+        unchanged = np.zeros(len(unique_keys), dtype=bool)
+        if len(stored_keys):
+            position = np.minimum(np.searchsorted(stored_keys, unique_keys), len(stored_keys) - 1)
+            found = stored_keys[position] == unique_keys
+            unchanged = found & (stored_groups[position] == groups)
+
+        delta = df[np.isin(key_hashes, unique_keys[~unchanged])]
+        stale_keys = keys[np.isin(key_hashes, unique_keys[found & ~unchanged])].drop_duplicates()
+
+        logging.info(f"{name}: {len(delta)} new or changed rows, {len(stale_keys)} keys to replace.")
+        return delta, stale_keys, (unique_keys, groups)
+
+    def update(self, name, metadata, hashes, df, date_col):
+        """Record the state of a loaded source, call save() to persist it."""
+        self.hashes[name] = hashes
+        self.watermarks[name] = {
+            **metadata,
+            'rows': len(df),
+            'max_date': str(df[date_col].max()) if not df.empty else None
+        }
+
+    def save(self):
+        """Write the watermarks and key hashes to the state folder."""
+        os.makedirs(self.folder, exist_ok=True)
+        for name, (keys, groups) in self.hashes.items():
+            np.savez(os.path.join(self.folder, f"{name}_hashes.npz"), keys=keys, groups=groups)
+        with open(self.path, 'w') as f:
+            json.dump(self.watermarks, f, indent=4)
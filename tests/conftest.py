@@ -0,0 +1,12 @@
+# conftest.py
+
+import os
+import sys
+
+# The pipeline modules import their siblings directly (e.g. `from snowflake_connector import ...`),
+# so the source folders need to be on the path, the same way they are when the scripts are run.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ('src', os.path.join('src', 'v1_DataProcessor'), os.path.join('src', 'v2_ETL'), 'benchmarks'):
+    path = os.path.join(ROOT, folder)
+    if path not in sys.path:
+        sys.path.insert(0, path)
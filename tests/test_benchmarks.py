@@ -0,0 +1,30 @@
+# test_benchmarks.py
+
+import json
+import pandas as pd
+from synthetic_data import make_spending, make_places
+from run_benchmarks import SUITES, run_benchmarks, save_results, compare
+
+def test_synthetic_data():
+    spending = make_spending(1000, seed=1)
+    places = make_places(1000, seed=1)
+
+    # The same seed gives the same data, with the columns of the raw files
+    pd.testing.assert_frame_equal(spending, make_spending(1000, seed=1))
+    assert list(spending.columns) == ['Title', 'Date', 'Amount', 'Currency', 'In EUR', 'Category', 'Payment Method', 'City', 'Country', 'Comment']
+    assert list(places.columns)[:6] == ['Order', 'Arrival_Date', 'Nights', 'Country', 'City', 'Host_Name']
+
+    # Some rows miss a required value, but not more than the threshold
+    assert 0 < spending[['Title', 'Date', 'In EUR', 'Category', 'City', 'Country']].isnull().any(axis=1).mean() < 0.1
+
+def test_run_and_compare(tmp_path):
+    report = run_benchmarks(list(SUITES), [500], repeat=1)
+    assert {result['suite'] for result in report['results']} == set(SUITES)
+
+    path = save_results(report, str(tmp_path))
+    with open(path) as f:
+        baseline = json.load(f)
+
+    comparison = compare(report, baseline)
+    assert len(comparison) == len(SUITES)
+    assert all(row['ratio'] == 1 for row in comparison)
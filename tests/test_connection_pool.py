@@ -0,0 +1,101 @@
+# test_connection_pool.py
+
+import sqlite3
+import threading
+from connection_pool import ConnectionPool, set_pool
+from snowflake_connector import SnowflakeConnector
+
+def sqlite_pool(**kwargs):
+    opened = []
+    def connect():
+        con = sqlite3.connect(':memory:', check_same_thread=False)
+        opened.append(con)
+        return con
+    return ConnectionPool(connect, **kwargs), opened
+
+def test_connections_are_reused():
+    pool, opened = sqlite_pool(max_size=2)
+
+    # Two connectors used one after the other share the same session
+    for _ in range(2):
+        connector = SnowflakeConnector(pool)
+        connector.connect()
+        connector.execute_query("SELECT 1")
+        connector.close()
+        # Closing twice gives the session back only once
+        connector.close()
+
+    assert len(opened) == 1
+    assert len(pool.idle) == 1
+
+def test_pool_is_bounded_and_thread_safe():
+    pool, opened = sqlite_pool(max_size=2)
+    barrier = threading.Barrier(4)
+
+    def work():
+        barrier.wait()
+        with pool.connection() as con:
+            con.execute("SELECT 1")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(opened) <= 2
+    assert len(pool.idle) == len(opened)
+
+def test_broken_connection_is_replaced():
+    pool, opened = sqlite_pool(health_check_interval=0)
+    with pool.connection() as con:
+        pass
+    con.close()
+
+    # The idle connection fails its health check and a new one is opened
+    with pool.connection() as con:
+        con.execute("SELECT 1")
+    assert len(opened) == 2
+
+def test_use_schema_only_when_it_changes():
+    switches = []
+    pool, opened = sqlite_pool(use_schema=lambda con, database, schema: switches.append((database, schema)))
+
+    for _ in range(2):
+        with pool.connection('TRAVEL_DATA', 'TRAVEL'):
+            pass
+    assert switches == [('TRAVEL_DATA', 'TRAVEL')]
+
+def test_switched_sessions_are_reset():
+    # The database / schema of every session, as a USE statement of the caller would change it
+    sessions = {}
+    def use_schema(con, database, schema):
+        sessions[id(con)] = (database, schema)
+    pool, opened = sqlite_pool(use_schema=use_schema, current_schema=lambda con: sessions.get(id(con), ('TRAVEL_DATA', 'PUBLIC')))
+
+    # A session opened in the default schema and switched by its caller is switched back on the next acquire
+    with pool.connection() as con:
+        sessions[id(con)] = ('TRAVEL_DATA', 'TRAVEL')
+    with pool.connection() as con:
+        assert sessions[id(con)] == ('TRAVEL_DATA', 'PUBLIC')
+    assert len(opened) == 1
+
+    # A session opened without a database cannot be switched back, it is replaced
+    pool, opened = sqlite_pool(use_schema=use_schema, current_schema=lambda con: sessions.get(id(con), (None, None)))
+    with pool.connection('TRAVEL_DATA', 'TRAVEL'):
+        pass
+    with pool.connection() as con:
+        assert sessions.get(id(con), (None, None)) == (None, None)
+    assert len(opened) == 2
+    assert opened[0] not in [con for con, _ in pool.idle]
+
+def test_shared_pool_can_be_replaced():
+    pool, opened = sqlite_pool()
+    set_pool(pool)
+    try:
+        connector = SnowflakeConnector()
+        connector.connect()
+        assert connector.pool is pool
+        connector.close()
+    finally:
+        set_pool(None)
@@ -1,8 +1,10 @@
 # test_data_analyzer.py
 
+import numpy as np
 import pandas as pd
 import pytest
 from src.v1_DataProcessor.data_analyzer import DataAnalyzer
+from pipeline_common.stay_index import assign_stays, link_stays, STAY_KEY
 
 def test_perform_analysis():
     # Create some example data
@@ -29,4 +31,112 @@ def test_perform_analysis():
         'avg_nights': 2
     }
 
+
+def test_spending_vs_nights():
+    # A city visited twice, with three spending rows
+    spending_data = pd.DataFrame({
+        'In EUR': [10, 20, 30, 5],
+        'City': ['City1', 'City1', 'City1', 'City2']
+    })
+    places_data = pd.DataFrame({
+        'Nights': [1, 2, 4],
+        'City': ['City1', 'City1', 'City3']
+    })
+
+    analyzer = DataAnalyzer(spending_data, places_data)
+    result = analyzer.spending_vs_nights()
+
+    # One row per city on both sides, the totals are not multiplied by the join
+    assert result.to_dict('records') == [{'City': 'City1', 'In EUR': 60, 'Nights': 3}]
+
+def test_summary_cube():
+    spending_data = pd.DataFrame({
+        'In EUR': [10, 20, 30, None],
+        'City': ['City1', 'City1', 'City2', 'City3'],
+        'Country': ['A', 'A', 'B', 'B'],
+        'Category': ['Food', 'Food', 'Food', 'Transport'],
+        'Date': pd.to_datetime(['2023-01-01 10:00', '2023-01-01 12:00', '2023-01-02 09:00', '2023-01-03 09:00'])
+    })
+    places_data = pd.DataFrame({'Nights': [1, 2], 'City': ['City1', 'City2'], 'Country': ['A', 'B']})
+
+    analyzer = DataAnalyzer(spending_data, places_data)
+    cube = analyzer.build_cube()
+
+    # The two City1 rows of the same day are one cube row
+    assert len(cube.cubes['In EUR']) == 3
+
+    # The cube answers the queries without the raw rows
+    assert cube.total('In EUR') == 60
+    assert cube.mean('In EUR') == 20
+    assert cube.top('In EUR', 'City', 1).to_dict() == {'City1': 30}
+    assert cube.rollup('In EUR', ['Country'])['sum'].to_dict() == {'A': 30, 'B': 30}
+
+def make_trip_data():
+    spending_data = pd.DataFrame({
+        'In EUR': [10.0, 20.0, 5.0, 30.0, 8.0, 2.0],
+        'City': ['Athens', 'Athens', 'Athens', 'Vienna', 'Athens', 'Sofia'],
+        'Date': pd.to_datetime(['2023-01-03 09:00', '2023-01-01 10:00', '2023-01-02 20:00',
+                                '2023-01-10 12:00', '2023-01-20 08:00', '2023-01-08 15:00'])
+    })
+    # Athens is visited twice, Vienna is a day trip without nights
+    places_data = pd.DataFrame({
+        'Order': [1, 3, 2, 4],
+        'City': ['Athens', 'Athens', 'Vienna', 'Zagreb'],
+        'Arrival_Date': pd.to_datetime(['2023-01-01', '2023-01-19', '2023-01-10', '2023-01-05']),
+        'Nights': [3, 2, 0, 3]
+    })
+    return spending_data, places_data
+
+def test_assign_stays():
+    spending_data, places_data = make_trip_data()
+    stays = assign_stays(spending_data['Date'], places_data['Arrival_Date'], places_data['Nights'])
+
+    # Positions in places_data, -1 after a stay ended or for a stay without nights
+    assert stays.tolist() == [0, 0, 0, -1, 1, -1]
+    assert assign_stays(pd.Series([pd.NaT, pd.Timestamp('2023-01-04')]), places_data['Arrival_Date'], places_data['Nights']).tolist() == [-1, -1]
+
+def test_spending_over_time():
+    spending_data, places_data = make_trip_data()
+    analyzer = DataAnalyzer(spending_data, places_data)
+
+    # Every calendar day from the first to the last, days without spending count as 0
+    daily = analyzer.spending_over_time('day', window=2)
+    assert len(daily) == 20
+    assert daily['In EUR'].tolist()[:4] == [20.0, 5.0, 10.0, 0.0]
+    assert daily['Rolling In EUR'].tolist()[:4] == [20.0, 12.5, 7.5, 5.0]
+    assert daily['Cumulative In EUR'].iloc[-1] == 75.0
+
+    # Weeks start on Monday
+    weekly = analyzer.spending_over_time('week')
+    assert weekly['Period'].dt.dayofweek.eq(0).all()
+    assert weekly['In EUR'].tolist() == [20.0, 17.0, 30.0, 8.0]
+
+    with pytest.raises(ValueError):
+        analyzer.spending_over_time('year')
+
+def test_cost_per_stay():
+    spending_data, places_data = make_trip_data()
+    costs = DataAnalyzer(spending_data, places_data).cost_per_stay()
+
+    # The two visits of Athens are kept apart
+    assert costs['Order'].tolist() == [1, 3, 2, 4]
+    assert costs['In EUR'].tolist() == [35.0, 8.0, 0.0, 0.0]
+    assert costs['Spending Rows'].tolist() == [3, 1, 0, 0]
+    assert costs['Cost per Night'].iloc[:2].tolist() == [35.0 / 3, 4.0]
+    assert np.isnan(costs['Cost per Night'].iloc[2])
+
+def test_link_stays():
+    spending_data, places_data = make_trip_data()
+    linked = link_stays(spending_data, places_data)
+
+    # The Order of the stay as an integer key, missing outside the stays, the input is not modified
+    assert linked[STAY_KEY].dtype == 'Int64'
+    assert linked[STAY_KEY].tolist() == [1, 1, 1, pd.NA, 3, pd.NA]
+    assert STAY_KEY not in spending_data.columns
+
+    # The spending vs nights join uses the stay key, each visit of Athens is one row
+    result = DataAnalyzer(linked, places_data).spending_vs_nights()
+    assert result.to_dict('records') == [{'Order': 1, 'City': 'Athens', 'In EUR': 35.0, 'Nights': 3},
+                                         {'Order': 3, 'City': 'Athens', 'In EUR': 8.0, 'Nights': 2}]
+
 # More tests to be added
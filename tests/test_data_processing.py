@@ -1,8 +1,11 @@
 # test_data_processing.py
 
+import os
 import pandas as pd
+import pyarrow as pa
 import pytest
-from v1_DataProcessor.data_processor import DataProcessor
+from v1_DataProcessor.data_processor import DataProcessor, run
+from intermediate_store import read_intermediate, to_frame, IntermediateWriter
 
 def test_load_data():
     # Create a DataProcessor with file paths to the test Excel files
@@ -39,4 +42,191 @@ def test_check_data():
     # Check that the checked data does not contain any missing values
     assert checked_data['test'].isnull().sum().sum() == 0
 
+def test_check_data_threshold():
+    processor = DataProcessor(file_paths={})
+    processor.data = {'test': pd.DataFrame({'A': [1, None, None], 'B': [4, 5, 6]})}
+
+    # The threshold is checked before the data is split
+    with pytest.raises(ValueError):
+        processor.check_data(required_cols={'test': ['A']}, threshold=0.5)
+
+    missing_data, checked_data = processor.check_data(required_cols={'test': ['A']}, threshold=0.7)
+    assert len(missing_data['test']) == 2
+    assert checked_data['test']['B'].tolist() == [4]
+
+def test_process_data_in_chunks(tmp_path):
+    # Write a small CSV file so the batches are easy to predict
+    path = tmp_path / 'places.csv'
+    pd.DataFrame({
+        'Arrival_Date': ['2023-01-01', None, '2023-01-05', '2023-01-07', '2023-01-09'],
+        'Nights': [2, 3, 2, 2, 1]
+    }).to_csv(path, index=False)
+
+    processor = DataProcessor(file_paths={'places': str(path)})
+
+    # Process the file in batches of two rows
+    batches = list(processor.process_data_in_chunks(required_cols={'places': ['Arrival_Date', 'Nights']}, threshold=0.5, chunk_size=2))
+
+    # Check that every batch is bounded and that the totals add up
+    assert [len(missing) + len(cleaned) for _, missing, cleaned in batches] == [2, 2, 1]
+    assert processor.row_counts['places'] == 5
+    assert processor.missing_counts['places'] == 1
+    assert sum(len(cleaned) for _, _, cleaned in batches) == 4
+
+def test_process_data_in_chunks_threshold(tmp_path):
+    path = tmp_path / 'places.csv'
+    pd.DataFrame({'Arrival_Date': ['2023-01-01', None, None], 'Nights': [2, 3, 2]}).to_csv(path, index=False)
+
+    processor = DataProcessor(file_paths={'places': str(path)})
+
+    # The threshold is checked on the totals of the whole file
+    with pytest.raises(ValueError):
+        list(processor.process_data_in_chunks(required_cols={'places': ['Arrival_Date']}, threshold=0.5, chunk_size=1))
+
+def test_process_data_sharded(tmp_path):
+    # One file per year, 1 of the 5 rows is missing
+    pd.DataFrame({'Arrival_Date': ['2023-01-01', None], 'Nights': [2, 1]}).to_csv(tmp_path / 'places_2023.csv', index=False)
+    pd.DataFrame({'Arrival_Date': ['2022-05-01', '2022-05-03', '2022-05-06'], 'Nights': [2, 3, 1]}).to_csv(tmp_path / 'places_2022.csv', index=False)
+
+    processor = DataProcessor(file_paths={'places': str(tmp_path / 'places_*.csv')}, dtype_schema={'places': {'Nights': 'small_int'}})
+
+    # The threshold is only exceeded if it is checked per file, not on the totals
+    missing_data, cleaned_data = processor.process_data_sharded(required_cols={'places': ['Arrival_Date']}, threshold=0.2, max_workers=2)
+    assert len(missing_data['places']) == 1
+    assert processor.row_counts['places'] == 5
+
+    # The files are concatenated in the order of their paths
+    assert cleaned_data['places']['Arrival_Date'].dt.year.tolist() == [2022, 2022, 2022, 2023]
+    assert str(cleaned_data['places']['Nights'].dtype) == 'Int8'
+
+    with pytest.raises(ValueError):
+        processor.process_data_sharded(required_cols={'places': ['Arrival_Date']}, threshold=0.1, max_workers=2)
+
+def test_export_intermediate_data(tmp_path):
+    cleaned_data = {'spending': pd.DataFrame({
+        'Date': pd.to_datetime(['2023-01-01', '2023-01-02']),
+        'In EUR': [10.5, 20.0],
+        'Comment': [None, None]
+    })}
+    processor = DataProcessor(file_paths={}, export_missing_data=False)
+
+    # Export only the intermediate data, without CSV output
+    path = str(tmp_path / 'spending.arrow')
+    processor.export_data(cleaned_data=cleaned_data, output_paths={}, missing_data={}, missing_data_output_paths={},
+                          intermediate_paths={'spending': path})
+
+    # Check that the dtypes survive the round-trip
+    loaded = read_intermediate(path)
+    assert loaded['Date'].dtype == 'datetime64[ns]'
+    pd.testing.assert_series_equal(loaded['In EUR'], cleaned_data['spending']['In EUR'])
+
+def test_intermediate_writer(tmp_path):
+    path = str(tmp_path / 'places.arrow')
+
+    # The first batch has no comment at all, the second one has, but no nights
+    writer = IntermediateWriter(path)
+    writer.write(pd.DataFrame({'Nights': [1, 2], 'Comment': [None, None]}))
+    writer.write(pd.DataFrame({'Nights': [None], 'Comment': ['Nice']}))
+    writer.close()
+
+    # The integers stay integers
+    loaded = read_intermediate(path)
+    assert str(loaded['Nights'].dtype) == 'Int64'
+    assert loaded['Nights'].tolist() == [1, 2, pd.NA]
+    assert loaded['Comment'].tolist() == [None, None, 'Nice']
+
+    # A fraction does not fit the integer column of the first batch
+    writer = IntermediateWriter(str(tmp_path / 'fractions.arrow'))
+    writer.write(pd.DataFrame({'Nights': [1, 2]}))
+    with pytest.raises(TypeError):
+        writer.write(pd.DataFrame({'Nights': [3.5]}))
+    writer.close()
+
+def test_intermediate_writer_dtype_schema(tmp_path):
+    path = str(tmp_path / 'places.arrow')
+
+    # The compact dtypes are applied on read, the batches have no categories of their own
+    writer = IntermediateWriter(path, dtype_schema={'Nights': 'small_int', 'City': 'category'})
+    writer.write(pd.DataFrame({'Nights': [1, 2], 'City': ['Paris', 'Berlin']}))
+    writer.write(pd.DataFrame({'Nights': [3], 'City': ['Paris']}))
+    writer.close()
+
+    loaded = read_intermediate(path)
+    assert str(loaded['Nights'].dtype) == 'Int8'
+    assert isinstance(loaded['City'].dtype, pd.CategoricalDtype)
+    assert loaded['City'].tolist() == ['Paris', 'Berlin', 'Paris']
+
+def _run_config(tmp_path, streaming):
+    folder = tmp_path / ('streaming' if streaming else 'in_memory')
+    folder.mkdir()
+    return {
+        'spending_file_path_local': str(tmp_path / 'spending.csv'),
+        'places_file_path_local': str(tmp_path / 'places.csv'),
+        'spending_required_cols': ['Title', 'Date', 'In EUR', 'City'],
+        'places_required_cols': ['Arrival_Date', 'Nights', 'City'],
+        'read_cols': {'spending': ['Amount'], 'places': ['Order']},
+        'dtype_schema': {'spending': {'City': 'category'}, 'places': {'Order': 'small_int', 'Nights': 'small_int'}},
+        'cleaned_spending_intermediate_path': str(folder / 'spending.arrow'),
+        'cleaned_places_intermediate_path': str(folder / 'places.arrow'),
+        'export_cleaned_csv': False,
+        'missing_spending_output_path': str(folder / 'missing_spending.csv'),
+        'missing_places_output_path': str(folder / 'missing_places.csv'),
+        'missing_data_threshold': 0.5,
+        'streaming_mode': streaming,
+        'chunk_size': 2
+    }
+
+def test_run_streaming(tmp_path):
+    pd.DataFrame({
+        'Title': ['Food', 'Rent', None, 'Bus', 'Food'],
+        'Date': ['2023-01-01', '2023-01-02', '2023-01-03', '2023-01-04', '2023-02-01'],
+        'Amount': [20, 50, 5, 3, 10],
+        'In EUR': [20.0, 50.0, 5.0, 3.0, 10.0],
+        'City': ['Paris', 'Paris', 'Berlin', 'Berlin', 'Rome']
+    }).to_csv(tmp_path / 'spending.csv', index=False)
+    pd.DataFrame({
+        'Order': [1, 2, 3],
+        'Arrival_Date': ['2023-01-01', '2023-01-03', None],
+        'Nights': [2, 3, 1],
+        'City': ['Paris', 'Berlin', 'Rome']
+    }).to_csv(tmp_path / 'places.csv', index=False)
+
+    in_memory = run(_run_config(tmp_path, streaming=False))
+    config = _run_config(tmp_path, streaming=True)
+    streamed = run(config, checkpoint=False)
+
+    # The batches are linked to the stays like the in-memory data, and handed over as memory-mapped tables
+    for name in ['spending', 'places']:
+        assert isinstance(streamed[name], pa.Table)
+        pd.testing.assert_frame_equal(to_frame(streamed[name]), in_memory[name].reset_index(drop=True), check_dtype=False)
+    spending = to_frame(streamed['spending'])
+    assert spending['Stay_Order'].tolist() == [1, 1, 2, pd.NA]
+
+    # The dtype schema is applied on read, the other integer columns are nullable
+    assert isinstance(spending['City'].dtype, pd.CategoricalDtype)
+    assert str(spending['Amount'].dtype) == 'Int64'
+    assert str(to_frame(streamed['places'])['Nights'].dtype) == 'Int8'
+
+    # Without a checkpoint no intermediate file is left behind
+    assert sorted(os.listdir(tmp_path / 'streaming')) == ['missing_places.csv', 'missing_spending.csv']
+
 # More tests to be added
+
+def test_run_streaming_fx_mismatches(tmp_path):
+    pd.DataFrame({
+        'Title': ['Food', 'Rent', 'Bus'],
+        'Date': ['2023-01-01', '2023-01-01', '2023-01-02'],
+        'Amount': [20.0, 50.0, 3.0],
+        'Currency': ['USD', 'EUR', 'USD'],
+        'In EUR': [30.0, 50.0, 9.0],
+        'City': ['Paris', 'Paris', 'Paris']
+    }).to_csv(tmp_path / 'spending.csv', index=False)
+    pd.DataFrame({'Order': [1], 'Arrival_Date': ['2023-01-01'], 'Nights': [2], 'City': ['Paris']}).to_csv(tmp_path / 'places.csv', index=False)
+    (tmp_path / 'rates.csv').write_text("Date,USD\n2023-01-01,1.0\n")
+    config = _run_config(tmp_path, streaming=True)
+    config['read_cols']['spending'] += ['Currency']
+    config.update({'fx_rates_path': str(tmp_path / 'rates.csv'), 'fx_mismatch_output_path': str(tmp_path / 'fx_mismatches.csv')})
+
+    # The mismatches of every batch are kept, not only those of the last one
+    assert run(config, checkpoint=False) is not None
+    assert pd.read_csv(tmp_path / 'fx_mismatches.csv')['Title'].tolist() == ['Food', 'Bus']
@@ -1,9 +1,8 @@
 # test_data_visualizer.py
 
 import pandas as pd
-import pytest
-import matplotlib.pyplot as plt
 import os
+from src.v1_DataProcessor import data_visualizer
 from src.v1_DataProcessor.data_visualizer import DataVisualizer
 
 def test_create_spending_distribution_plot():
@@ -26,4 +25,54 @@ def test_create_spending_distribution_plot():
     # Check that the plot was saved correctly
     assert os.path.exists('tests/spending_distribution.png')
 
+def test_create_all_plots_parallel(tmp_path):
+    spending_data = pd.DataFrame({
+        'In EUR': [10, 20, 30],
+        'Category': ['Food', 'Food', 'Transport'],
+        'City': ['City1', 'City2', 'City3']
+    })
+    places_data = pd.DataFrame({
+        'Nights': [1, 2, 3],
+        'City': ['City1', 'City2', 'City3']
+    })
+
+    # Render every plot in a process pool
+    visualizer = DataVisualizer(spending_data, places_data, vizualization_folder=str(tmp_path))
+    visualizer.create_all_plots(parallel=True)
+
+    for file_name in ['spending_distribution.png', 'spending_by_category.png', 'spending_vs_nights.png']:
+        assert (tmp_path / file_name).exists()
+
+def test_plot_cache(tmp_path, monkeypatch):
+    spending_data = pd.DataFrame({'In EUR': [10, 20, 30], 'City': ['City1', 'City2', 'City3']})
+    places_data = pd.DataFrame({'Nights': [1, 2, 3], 'City': ['City1', 'City2', 'City3']})
+    cache_folder = tmp_path / 'cache'
+
+    # The first run renders the plot and stores it in the cache
+    visualizer = DataVisualizer(spending_data, places_data, vizualization_folder=str(tmp_path), cache_folder=str(cache_folder))
+    visualizer.create_spending_distribution_plot()
+    assert len(os.listdir(cache_folder)) == 1
+
+    # The same input is copied from the cache without rendering
+    (tmp_path / 'spending_distribution.png').unlink()
+    def no_figure(*args, **kwargs):
+        raise AssertionError("The plot was rendered")
+    monkeypatch.setattr(data_visualizer, 'Figure', no_figure)
+    visualizer.create_spending_distribution_plot()
+    assert (tmp_path / 'spending_distribution.png').exists()
+
+    # A renderer whose code changed gets a new render
+    rendered = []
+    def render_spending_distribution(data, figsize, path):
+        rendered.append(path)
+        open(path, 'wb').close()
+    monkeypatch.setattr(data_visualizer, 'render_spending_distribution', render_spending_distribution)
+    visualizer.create_spending_distribution_plot()
+    assert len(rendered) == 1
+
+    # Changed data gets a new render
+    visualizer.spending_data = pd.DataFrame({'In EUR': [10, 20, 40], 'City': ['City1', 'City2', 'City3']})
+    visualizer.create_spending_distribution_plot()
+    assert len(rendered) == 2
+
 # More tests to be added
@@ -0,0 +1,88 @@
+# test_dtype_optimizer.py
+
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from pipeline_common.dtype_optimizer import convert_column, optimize_dtypes
+from aggregations import SummaryCube
+from materialized_views import MaterializedViews
+from stage_loader import LocalStage, StagedLoader, read_table
+from load import DataLoader
+
+PLACES_SCHEMA = {'Order': 'small_int', 'Nights': 'small_int', 'City': 'category', 'G_FLG': 'small_int',
+                 'Comfort': 'small_int', 'Rating': 'float32', 'Host_Name': 'category'}
+
+def make_places_data():
+    return pd.DataFrame({
+        'Order': [1, 2, 3],
+        'Arrival_Date': pd.to_datetime(['2023-01-01', '2023-01-03', '2023-01-06']),
+        'Nights': [2, 3, 300],
+        'City': ['Athens', 'Vienna', 'Athens'],
+        'G_FLG': [np.nan, 1.0, np.nan],
+        'Comfort': [3.5, np.nan, 4.0],
+        'Rating': [0.1, 0.2, 0.3]
+    })
+
+def test_convert_column():
+    # Whole numbers become the smallest nullable integer type, with nulls kept
+    assert convert_column(pd.Series([1.0, np.nan, 10.0]), 'small_int').dtype == 'Int8'
+    assert convert_column(pd.Series([1, 300]), 'small_int').dtype == 'Int16'
+    # Fractions fall back to float32 when they fit it exactly, and stay float64 otherwise
+    assert convert_column(pd.Series([1.5, np.nan]), 'small_int').dtype == 'float32'
+    assert convert_column(pd.Series([0.1, 2.0]), 'float32').dtype == 'float64'
+    # Text is never parsed as numbers
+    assert convert_column(pd.Series(['Yes', 'No']), 'small_int').dtype == object
+    assert isinstance(convert_column(pd.Series(['a', 'b', 'a']), 'category').dtype, pd.CategoricalDtype)
+    with pytest.raises(ValueError):
+        convert_column(pd.Series([1]), 'int4')
+
+def test_optimize_dtypes_report():
+    df = make_places_data()
+    optimized, report = optimize_dtypes(df, PLACES_SCHEMA)
+
+    assert optimized['Nights'].dtype == 'Int16' and optimized['G_FLG'].dtype == 'Int8'
+    assert optimized['Comfort'].dtype == 'float32' and optimized['Rating'].dtype == 'float64'
+    pd.testing.assert_series_equal(optimized['Nights'].astype('int64'), df['Nights'])
+
+    # One entry per converted column, the input is not modified
+    assert [column['column'] for column in report] == ['Order', 'Nights', 'City', 'G_FLG', 'Comfort']
+    assert all(column['bytes_saved'] == column['bytes_before'] - column['bytes_after'] for column in report)
+    assert report[0]['bytes_saved'] > 0
+    assert df['City'].dtype == object
+
+def test_compact_dtypes_carry_through(tmp_path):
+    places_data, _ = optimize_dtypes(make_places_data(), PLACES_SCHEMA)
+    spending_data, _ = optimize_dtypes(pd.DataFrame({
+        'Date': pd.to_datetime(['2023-01-01', '2023-01-02']),
+        'In EUR': [10.0, 5.0],
+        'City': ['Athens', 'Athens'],
+        'Category': ['Food', 'Transport']
+    }), {'City': 'category', 'Category': 'category'})
+
+    # The analysis only groups the categories that occur
+    cube = SummaryCube(spending_data, places_data)
+    assert cube.top('Nights', 'City').to_dict() == {'Athens': 302, 'Vienna': 3}
+    assert len(cube.rollup('In EUR', ['Category'])) == 2
+
+    # The staged load and the refresh of the aggregates take the categorical columns
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE PLACES ("ORDER" INTEGER, CITY TEXT, COUNTRY TEXT, NIGHTS INTEGER)')
+    materialized = MaterializedViews(con)
+    materialized.ensure()
+    table = read_table(places_data.assign(Country='GR')[['Order', 'City', 'Country', 'Nights']],
+                       {'Order': 'ORDER', 'City': 'CITY', 'Country': 'COUNTRY', 'Nights': 'NIGHTS'})
+    StagedLoader(LocalStage(str(tmp_path / 'stage'), con), max_workers=1).load(table, 'PLACES')
+    materialized.refresh('PLACES', table.to_pandas())
+    assert pd.read_sql_query("SELECT * FROM nights_by_city ORDER BY 1", con).values.tolist() == [['Athens', 'GR', 302], ['Vienna', 'GR', 3]]
+
+    # The v2 INSERT load takes the nullable integers
+    db_link = f"sqlite:///{tmp_path / 'test.db'}"
+    places = places_data.drop(columns=['Rating']).assign(Country='GR', Host_Name='John', Couchsurfing_FLG=1, Bike_FLG=np.nan, Gender='F',
+                                                         Hosts_Personality_Point=5, Location_Point=4, Comment='Nice')
+    DataLoader(validated_data={'places': places}, output_paths={}, missing_data={}, missing_data_output_paths={},
+               db_link=db_link).load_data_to_db(schema=None)
+    loaded = pd.read_sql('SELECT * FROM places', create_engine(db_link))
+    assert loaded['nights'].tolist() == [2, 3, 300]
+    assert loaded['g_flg'].isna().tolist() == [True, False, True]
@@ -0,0 +1,36 @@
+# test_excel_reader.py
+
+import pandas as pd
+import pytest
+from pipeline_common.excel_reader import available_engines, select_engine, read_excel, read_header, check_header, used_columns
+from v1_DataProcessor.data_processor import DataProcessor
+
+@pytest.mark.parametrize('engine', available_engines())
+def test_read_excel(engine):
+    expected = pd.read_excel('tests/test_spending_data.xlsx')
+
+    # Every engine gives the same frame as pd.read_excel, with only the usecols that are in the file
+    pd.testing.assert_frame_equal(read_excel('tests/test_spending_data.xlsx', engine=engine), expected)
+    df = read_excel('tests/test_spending_data.xlsx', usecols=['Date', 'In_EUR', 'Not a column'], engine=engine)
+    pd.testing.assert_frame_equal(df, expected[['Date', 'In_EUR']])
+
+def test_select_engine():
+    assert select_engine('auto') == available_engines()[0]
+    with pytest.raises(ValueError):
+        select_engine('xlrd')
+
+def test_header_probe():
+    header = read_header('tests/test_places_data.xlsx')
+    assert header == list(pd.read_excel('tests/test_places_data.xlsx', nrows=0).columns)
+    with pytest.raises(ValueError):
+        check_header(header, ['Arrival_Date', 'Departure_Date'], 'places')
+
+    usecols = used_columns({'places': ['City', 'Nights'], 'spending': ['Title']}, {'places': ['Order', 'City']})
+    assert usecols == {'places': ['City', 'Nights', 'Order'], 'spending': None}
+
+    # The file is read without the other columns, and a file without a required column fails before it is parsed
+    processor = DataProcessor(file_paths={'places': 'tests/test_places_data.xlsx'}, usecols=usecols)
+    processor.load_data(required_cols={'places': ['City', 'Nights']})
+    assert list(processor.data['places'].columns) == ['Order', 'Nights', 'City']
+    with pytest.raises(ValueError):
+        processor.load_data(required_cols={'places': ['Departure_Date']})
@@ -0,0 +1,125 @@
+# test_extract.py
+
+import datetime
+import hashlib
+import os
+import shutil
+import pandas as pd
+import pytest
+from extract import DataExtractor, DataLoadingError, read_excel_in_chunks
+from watermark import WatermarkStore
+
+class FakeS3:
+    """Filesystem-backed stand-in for the boto3 S3 client: bucket/key maps to folder/bucket/key."""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def _path(self, bucket, key):
+        return os.path.join(self.folder, bucket, key)
+
+    def head_object(self, Bucket, Key):
+        path = self._path(Bucket, Key)
+        with open(path, 'rb') as f:
+            etag = hashlib.md5(f.read()).hexdigest()
+        return {'ETag': f'"{etag}"', 'LastModified': datetime.datetime.fromtimestamp(os.path.getmtime(path)),
+                'ContentLength': os.path.getsize(path)}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, Config=None):
+        with open(self._path(Bucket, Key), 'rb') as f:
+            shutil.copyfileobj(f, Fileobj)
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        # A single page of every key under the prefix
+        root = os.path.join(self.folder, Bucket)
+        keys = [os.path.relpath(os.path.join(folder, name), root).replace(os.sep, '/') for folder, _, names in os.walk(root) for name in names]
+        yield {'Contents': [{'Key': key} for key in sorted(keys) if key.startswith(Prefix)]}
+
+@pytest.fixture
+def s3(tmp_path):
+    os.makedirs(tmp_path / 'bucket')
+    shutil.copy('tests/test_spending_data.xlsx', tmp_path / 'bucket' / 'spending.xlsx')
+    shutil.copy('tests/test_places_data.xlsx', tmp_path / 'bucket' / 'travels.xlsx')
+    return FakeS3(str(tmp_path))
+
+@pytest.mark.parametrize('parse_in_processes', [False, True])
+def test_extract_data(s3, parse_in_processes):
+    extractor = DataExtractor(file_paths={'spending': 'spending.xlsx', 'places': 'travels.xlsx'}, bucket='bucket',
+                              max_workers=2, parse_in_processes=parse_in_processes, s3=s3)
+
+    data = extractor.extract_data()
+
+    # Check that both objects were loaded, in the configured order
+    assert list(data) == ['spending', 'places']
+    assert len(data['spending']) == 2
+    assert data['places']['City'].tolist() == ['Paris', 'Berlin']
+
+def test_extract_data_missing_object(s3):
+    extractor = DataExtractor(file_paths={'spending': 'missing.xlsx'}, bucket='bucket', s3=s3)
+
+    with pytest.raises(DataLoadingError):
+        extractor.extract_data()
+
+def test_extract_data_columns(s3):
+    extractor = DataExtractor(file_paths={'places': 'travels.xlsx'}, bucket='bucket', s3=s3,
+                              usecols={'places': ['Order', 'City']}, required_cols={'places': ['City']})
+
+    # Only the used columns are read
+    assert list(extractor.extract_data()['places'].columns) == ['Order', 'City']
+
+    # A missing required column is found on the header, before the file is parsed
+    extractor.required_cols = {'places': ['Departure_Date']}
+    with pytest.raises(DataLoadingError):
+        extractor.extract_data()
+
+def test_extract_changed_data(s3, tmp_path):
+    file_paths = {'spending': 'spending.xlsx', 'places': 'travels.xlsx'}
+    watermarks = WatermarkStore(str(tmp_path / 'state'))
+
+    # Pretend the places object was already loaded
+    etag = s3.head_object(Bucket='bucket', Key='travels.xlsx')['ETag']
+    watermarks.watermarks['places'] = {'etag': etag}
+
+    extractor = DataExtractor(file_paths=file_paths, bucket='bucket', s3=s3)
+    data = extractor.extract_changed_data(watermarks)
+
+    # Only the changed object is downloaded, but the metadata of both is recorded
+    assert list(data) == ['spending']
+    assert set(extractor.metadata) == {'spending', 'places'}
+
+    # The unchanged places are loaded along with the changed spending, to link the stays of the spending rows
+    extractor = DataExtractor(file_paths=file_paths, bucket='bucket', s3=s3)
+    data = extractor.extract_changed_data(watermarks, linked={'spending': ['places']})
+    assert set(data) == {'spending', 'places'}
+
+def test_read_excel_in_chunks():
+    # Read the test Excel file one row at a time
+    chunks = list(read_excel_in_chunks('tests/test_places_data.xlsx', chunk_size=1))
+
+    # Check that the batches contain the same rows as a full read
+    assert len(chunks) == 2
+    expected = pd.read_excel('tests/test_places_data.xlsx')
+    assert list(chunks[0].columns) == list(expected.columns)
+    assert pd.concat(chunks)['City'].tolist() == expected['City'].tolist()
+
+def test_extract_shards(s3, tmp_path):
+    os.makedirs(tmp_path / 'bucket' / 'places')
+    shutil.copy('tests/test_places_data.xlsx', tmp_path / 'bucket' / 'places' / 'trip_2022.xlsx')
+    shutil.copy('tests/test_places_data.xlsx', tmp_path / 'bucket' / 'places' / 'trip_2023.xlsx')
+    (tmp_path / 'bucket' / 'places' / 'notes.txt').write_text('not data')
+
+    # A prefix stands for its data objects, a glob for the keys it matches, a plain path for itself
+    extractor = DataExtractor(file_paths={'spending': 'spending.xlsx', 'places': 'places/'}, bucket='bucket', s3=s3)
+    assert extractor.list_shards() == {'spending': ['spending.xlsx'], 'places': ['places/trip_2022.xlsx', 'places/trip_2023.xlsx']}
+    extractor.file_paths = {'places': 'places/*_2023.xlsx'}
+    assert extractor.list_shards() == {'places': ['places/trip_2023.xlsx']}
+
+    shards = list(extractor.extract_shards())
+    assert [(name, key) for name, key, _ in shards] == [('places', 'places/trip_2023.xlsx')]
+
+    extractor.file_paths = {'places': 'places/*_2024.xlsx'}
+    with pytest.raises(DataLoadingError):
+        extractor.list_shards()
@@ -0,0 +1,64 @@
+# test_fx_rates.py
+
+import io
+import numpy as np
+import pandas as pd
+from pipeline_common.fx_rates import FxRates, _read_rates, apply_fx_rates
+from transform import DataTransformer
+from v1_DataProcessor.data_processor import DataProcessor
+
+# ECB style: one column per currency, units per EUR, N/A on days without a rate
+RATES_CSV = "Date,HUF,USD,\n2023-01-03,400.0,1.06,\n2023-01-02,398.0,N/A,\n2022-12-30,395.0,1.07,\n"
+
+def make_spending_data():
+    return pd.DataFrame({
+        'Title': [' Lunch', 'Bus', 'Hostel', 'Coffee', 'Museum'],
+        'Date': pd.to_datetime(['2023-01-02 12:00', '2023-01-03 09:00', '2023-01-01 20:00', '2023-01-02 08:00', '2023-02-01 10:00']),
+        'Amount': [3980, 10.6, 21.4, 3.5, 2000],
+        'Currency': pd.Categorical(['HUF', 'USD', 'USD', 'EUR', 'HUF']),
+        'In EUR': [10.0, 10.0, 25.0, 3.5, 5.0]
+    })
+
+def test_convert(tmp_path):
+    path = tmp_path / 'rates.csv'
+    path.write_text(RATES_CSV)
+    fx = FxRates.from_file(str(path))
+    derived = fx.convert(make_spending_data())
+
+    # The last rate on or before the date, the base currency as is, no rate older than max_age_days
+    assert np.allclose(derived[:4], [10.0, 10.0, 20.0, 3.5])
+    assert np.isnan(derived[4])
+
+    # The parsed file is served from the LRU until it changes
+    hits = _read_rates.cache_info().hits
+    FxRates.from_file(str(path))
+    assert _read_rates.cache_info().hits == hits + 1
+
+    # The memory-mapped Arrow file gives the same rates
+    fx.save(str(tmp_path / 'rates.arrow'))
+    pd.testing.assert_frame_equal(FxRates.from_file(str(tmp_path / 'rates.arrow')).rates, fx.rates)
+
+def test_apply_fx_rates():
+    fx = FxRates(pd.read_csv(io.StringIO(RATES_CSV)))
+    df = make_spending_data()
+
+    # Only the Hostel row differs, the Museum row has no rate to compare with
+    mismatches = apply_fx_rates(df, fx)
+    assert mismatches.index.tolist() == [2] and mismatches['Derived In EUR'].tolist() == [20.0]
+    assert df['In EUR'].tolist() == [10.0, 10.0, 25.0, 3.5, 5.0]
+
+    apply_fx_rates(df, fx, mode='derive')
+    assert df['In EUR'].tolist() == [10.0, 10.0, 20.0, 3.5, 5.0]
+
+def test_clean_data_flags_mismatches():
+    fx = FxRates(pd.read_csv(io.StringIO(RATES_CSV)))
+
+    transformer = DataTransformer(data={}, fx_rates=fx)
+    transformer.clean_data({'spending': make_spending_data()})
+    assert transformer.fx_mismatches['spending']['Title'].tolist() == ['Hostel']
+
+    processor = DataProcessor(file_paths={}, fx_rates=fx, fx_mode='derive')
+    cleaned = processor.clean_data({'spending': make_spending_data()})
+    # The flagged rows keep the spreadsheet value
+    assert processor.fx_mismatches['spending']['In EUR'].tolist() == [25.0]
+    assert cleaned['spending']['In EUR'].tolist() == [10.0, 10.0, 20.0, 3.5, 5.0]
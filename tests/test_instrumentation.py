@@ -0,0 +1,67 @@
+# test_instrumentation.py
+
+import json
+import pandas as pd
+import pytest
+from pipeline_common.instrumentation import RunReport, count_rows
+from pipeline_runner import PipelineRunner
+
+def test_stage_records_measures():
+    report = RunReport('v2')
+    data = {'spending': pd.DataFrame({'A': [1, 2, 3]}), 'places': pd.DataFrame({'B': [1]})}
+
+    with report.stage('clean_data', rows_in=count_rows(data)) as stage:
+        stage['rows_out'] = 3
+
+    record = report.stages[0]
+    assert record['stage'] == 'clean_data' and record['success']
+    assert record['rows_in'] == 4 and record['rows_out'] == 3
+    assert record['wall_seconds'] >= 0 and record['cpu_seconds'] >= 0
+
+def test_failed_stage_is_recorded():
+    report = RunReport('v2')
+
+    # The error still reaches the caller
+    with pytest.raises(ValueError):
+        with report.stage('validate_data'):
+            raise ValueError("invalid")
+
+    assert report.stages[0]['success'] is False
+
+def test_instrument_decorator():
+    report = RunReport('v1')
+
+    @report.instrument('drop_missing')
+    def drop_missing(df):
+        return df.dropna()
+
+    drop_missing(pd.DataFrame({'A': [1, None, 3]}))
+
+    assert report.stages[0]['rows_in'] == 3
+    assert report.stages[0]['rows_out'] == 2
+
+def test_runner_report():
+    report = RunReport('v1')
+    runner = PipelineRunner(report=report)
+    runner.add_stage('process', lambda: {'places': pd.DataFrame({'Nights': [1, 2]})})
+    runner.add_stage('analyze', lambda process: process['places']['Nights'].sum(), depends_on=['process'])
+    runner.run()
+
+    records = {record['stage']: record for record in report.stages}
+    assert records['process']['rows_out'] == 2
+    assert records['analyze']['rows_in'] == 2
+
+def test_write_report(tmp_path):
+    report = RunReport('v2')
+    with report.stage('extract') as stage:
+        stage['rows_out'] = 10
+
+    path = report.write(str(tmp_path), prometheus=True)
+
+    with open(path) as f:
+        written = json.load(f)
+    assert written['pipeline'] == 'v2'
+    assert written['stages'][0]['rows_out'] == 10
+
+    prometheus = (tmp_path / 'v2_run.prom').read_text()
+    assert 'pipeline_stage_rows_out{pipeline="v2",stage="extract"} 10.0' in prometheus
@@ -0,0 +1,169 @@
+# test_load.py
+
+import io
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from pipeline_common.fx_rates import FxRates
+from load import DataLoader, CsvChunkStream
+from watermark import WatermarkStore
+from transform import DataTransformer, DataValidationError
+from main import run_in_chunks
+
+def make_spending_data():
+    return pd.DataFrame({
+        'Title': ['Food', 'Rent', 'Bus'],
+        'Date': pd.to_datetime(['2023-01-01', '2023-01-01', '2023-01-02']),
+        'Amount': [20.0, 50.0, 3.5],
+        'Currency': ['EUR', 'EUR', 'EUR'],
+        'In EUR': [20.0, 50.0, 3.5],
+        'Category': ['Food', 'Rent', 'Transport'],
+        'Payment Method': ['Cash', 'Card', 'Card'],
+        'City': ['Paris', 'Paris', 'Paris'],
+        'Country': ['France', 'France', 'France'],
+        'Comment': [None, 'Expensive', None]
+    })
+
+def test_csv_chunk_stream():
+    df = pd.DataFrame({'a': range(10), 'b': [1.5, None] * 5})
+
+    # Read the stream in small pieces, the way COPY does
+    stream = CsvChunkStream(df, chunk_size=3)
+    content = ''
+    while True:
+        data = stream.read(7)
+        if not data:
+            break
+        content += data
+
+    # Check that the chunks add up to the full CSV
+    assert content == df.to_csv(index=False, header=False)
+
+def test_load_data_to_db_fallback(tmp_path):
+    db_link = f"sqlite:///{tmp_path / 'test.db'}"
+    loader = DataLoader(validated_data={'spending': make_spending_data()}, output_paths={}, missing_data={},
+                        missing_data_output_paths={}, db_link=db_link, chunk_size=2)
+
+    # SQLite has no COPY, so the INSERT fallback is used
+    loader.load_data_to_db(schema=None)
+    loader.load_data_to_db(schema=None)
+
+    loaded = pd.read_sql('SELECT * FROM spending', create_engine(db_link))
+    assert len(loaded) == 6
+    assert list(loaded.columns)[:3] == ['title', 'date', 'amount']
+
+def make_places_data():
+    return pd.DataFrame({
+        'Order': [1, 2],
+        'Arrival_Date': pd.to_datetime(['2023-01-01', '2023-01-03']),
+        'Nights': [2, 3],
+        'Country': ['France', 'Germany'],
+        'City': ['Paris', 'Berlin'],
+        'Host_Name': ['John', 'Jane'],
+        'Couchsurfing_FLG': [1, 0],
+        'G_FLG': [None, 1.0],
+        'Bike_FLG': [None, None],
+        'Gender': ['M', 'F'],
+        'Hosts_Personality_Point': [5.0, 4.0],
+        'Location_Point': [4.0, 5.0],
+        'Comfort': [3.0, 4.0],
+        'Comment': ['Nice', 'Good']
+    })
+
+def test_incremental_upsert(tmp_path):
+    db_link = f"sqlite:///{tmp_path / 'test.db'}"
+    key_cols = {'places': ['Order']}
+    places = make_places_data()
+
+    def run(df):
+        # Load only the delta and record the new state, the way main.load_incremental does
+        watermarks = WatermarkStore(str(tmp_path / 'state'))
+        delta, stale_keys, hashes = watermarks.compute_delta('places', df, key_cols['places'])
+        loader = DataLoader(validated_data={'places': delta}, output_paths={}, missing_data={},
+                            missing_data_output_paths={}, db_link=db_link)
+        loader.upsert_data_to_db(schema=None, key_cols=key_cols, stale_keys={'places': stale_keys})
+        watermarks.update('places', {'etag': 'etag'}, hashes, df, 'Arrival_Date')
+        watermarks.save()
+        return delta
+
+    # First run loads everything, an identical second run loads nothing
+    assert len(run(places)) == 2
+    assert len(run(places)) == 0
+
+    # A changed row and a new row are upserted
+    changed = pd.concat([places, make_places_data().iloc[[0]].assign(Order=3)], ignore_index=True)
+    changed.loc[1, 'Nights'] = 4
+    assert len(run(changed)) == 2
+
+    loaded = pd.read_sql('SELECT * FROM places ORDER BY "order"', create_engine(db_link))
+    assert loaded['order'].tolist() == [1, 2, 3]
+    assert loaded['nights'].tolist() == [2, 4, 2]
+    assert WatermarkStore(str(tmp_path / 'state')).is_unchanged('places', 'etag')
+
+def test_incremental_upsert_null_key(tmp_path):
+    db_link = f"sqlite:///{tmp_path / 'test.db'}"
+    key_cols = {'places': ['Order']}
+    places = make_places_data().astype({'Order': 'Int64'})
+    places.loc[1, 'Order'] = None
+    watermarks = WatermarkStore(str(tmp_path / 'state'))
+
+    def run(df):
+        delta, stale_keys, hashes = watermarks.compute_delta('places', df, key_cols['places'])
+        loader = DataLoader(validated_data={'places': delta}, output_paths={}, missing_data={},
+                            missing_data_output_paths={}, db_link=db_link)
+        loader.upsert_data_to_db(schema=None, key_cols=key_cols, stale_keys={'places': stale_keys})
+        watermarks.update('places', {'etag': 'etag'}, hashes, df, 'Arrival_Date')
+
+    # The changed row without an Order replaces its earlier version instead of being inserted again
+    run(places)
+    changed = places.copy()
+    changed.loc[1, 'Nights'] = 4
+    run(changed)
+
+    loaded = pd.read_sql('SELECT * FROM places ORDER BY "order"', create_engine(db_link))
+    assert len(loaded) == 2
+    assert loaded['nights'].tolist() == [4, 2]
+
+class BatchExtractor:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def extract_data_in_chunks(self):
+        return iter(self.chunks)
+
+def test_run_in_chunks_single_transaction(tmp_path):
+    db_link = f"sqlite:///{tmp_path / 'test.db'}"
+    places = make_places_data()
+    places['Arrival_Date'] = ['2023-01-01', None]
+
+    def run(threshold):
+        loader = DataLoader(validated_data={}, output_paths={'places': str(tmp_path / 'places.csv')}, missing_data={},
+                            missing_data_output_paths={'places': str(tmp_path / 'missing_places.csv')}, db_link=db_link)
+        extractor = BatchExtractor([('places', places.iloc[[0]]), ('places', places.iloc[[1]])])
+        return run_in_chunks(extractor, DataTransformer(data={}), loader, required_cols={'places': ['Arrival_Date']},
+                             threshold=threshold, schema=None)
+
+    # The first batch is loaded before the threshold is exceeded at the end of the file, and rolled back
+    with pytest.raises(DataValidationError):
+        run(threshold=0.4)
+    assert pd.read_sql('SELECT COUNT(*) AS n FROM places', create_engine(db_link))['n'][0] == 0
+    assert not list(tmp_path.glob('*.csv*'))
+
+    assert run(threshold=0.5) == 1
+    assert len(pd.read_sql('SELECT * FROM places', create_engine(db_link))) == 1
+    assert len(pd.read_csv(tmp_path / 'missing_places.csv')) == 1
+
+def test_run_in_chunks_fx_mismatches(tmp_path):
+    spending = make_spending_data()
+    spending['Currency'] = ['USD', 'EUR', 'USD']
+    spending['In EUR'] = [30.0, 50.0, 9.0]
+    fx = FxRates(pd.read_csv(io.StringIO("Date,USD\n2023-01-01,1.0\n")))
+    loader = DataLoader(validated_data={}, output_paths={'spending': str(tmp_path / 'spending.csv')}, missing_data={},
+                        missing_data_output_paths={'spending': str(tmp_path / 'missing_spending.csv')}, db_link=f"sqlite:///{tmp_path / 'test.db'}")
+    extractor = BatchExtractor([('spending', spending.iloc[[0, 1]]), ('spending', spending.iloc[[2]])])
+    path = tmp_path / 'fx_mismatches.csv'
+
+    # The mismatches of every batch are kept, not only those of the last one
+    run_in_chunks(extractor, DataTransformer(data={}, fx_rates=fx), loader, required_cols={'spending': ['Title']},
+                  threshold=0.5, schema=None, fx_mismatch_output_path=str(path))
+    assert pd.read_csv(path)['Title'].tolist() == ['Food', 'Bus']
@@ -0,0 +1,115 @@
+# test_materialized_views.py
+
+import sqlite3
+import pandas as pd
+from connection_pool import ConnectionPool
+from materialized_views import MaterializedViews, VIEWS
+from snowflake_view_creator import ViewCreator
+
+def places(orders, cities, countries, nights):
+    return pd.DataFrame({'ORDER': orders, 'CITY': cities, 'COUNTRY': countries, 'NIGHTS': nights})
+
+def spending(stays, cities, countries, categories, dates, amounts):
+    return pd.DataFrame({'STAY_ORDER': stays, 'CITY': cities, 'COUNTRY': countries, 'CATEGORY': categories, 'DATE': dates, 'IN_EUR': amounts})
+
+def query(con, sql):
+    return pd.read_sql_query(sql, con)
+
+def test_refresh_matches_full_rebuild():
+    con = sqlite3.connect(':memory:')
+    materialized = MaterializedViews(con)
+
+    # First load, the aggregate tables are built from the existing rows
+    first_places = places([1, 2], ['Athens', 'Vienna'], ['GR', 'AT'], [2, 3])
+    first_spending = spending([1, 1], ['Athens', 'Athens'], ['GR', 'GR'], ['Food', 'Transport'], ['2023-01-01', '2023-01-01'], [10.0, 5.0])
+    first_places.to_sql('PLACES', con, index=False)
+    first_spending.to_sql('SPENDING', con, index=False)
+    materialized.ensure()
+    for name in VIEWS:
+        materialized.create_view(name)
+
+    # Second load, only the new rows are added to the aggregates
+    # Athens is visited a second time
+    new_places = places([3, 4], ['Athens', 'Chania'], ['GR', 'GR'], [1, 4])
+    new_spending = spending([1, 3, 4], ['Athens', 'Athens', 'Chania'], ['GR', 'GR', 'GR'], ['Food', 'Food', 'Food'],
+                            ['2023-01-02', '2023-01-05', '2023-01-06'], [20.0, 4.0, 7.5])
+    new_places.to_sql('PLACES', con, index=False, if_exists='append')
+    materialized.refresh('PLACES', new_places)
+    new_spending.to_sql('SPENDING', con, index=False, if_exists='append')
+    materialized.refresh('SPENDING', new_spending)
+
+    refreshed = {name: query(con, f"SELECT * FROM {name} ORDER BY 1, 2") for name in VIEWS}
+
+    # The delta table is dropped after the refresh
+    assert query(con, "SELECT name FROM sqlite_master WHERE name LIKE '%_DELTA'").empty
+
+    # The views give the same result as aggregates recomputed from all the rows
+    materialized.rebuild()
+    for name in VIEWS:
+        pd.testing.assert_frame_equal(refreshed[name], query(con, f"SELECT * FROM {name} ORDER BY 1, 2"))
+
+    # The spending is joined to each stay by its Order, the two visits of Athens are kept apart
+    assert refreshed['spending_vs_nights'].values.tolist() == [[1, 'Athens', 'GR', 35.0, 2], [3, 'Athens', 'GR', 4.0, 1], [4, 'Chania', 'GR', 7.5, 4]]
+
+def test_refresh_null_keys():
+    con = sqlite3.connect(':memory:')
+    materialized = MaterializedViews(con)
+    spending([None], [None], ['GR'], ['Food'], ['2023-01-01'], [10.0]).to_sql('SPENDING', con, index=False)
+    materialized.ensure('SPENDING')
+
+    # The rows without a stay or a country are added to the stored NULL-key rows on every refresh
+    for amount in [5.0, 2.5]:
+        new_spending = spending([None], [None], [None], ['Food'], ['2023-01-01'], [amount])
+        new_spending.to_sql('SPENDING', con, index=False, if_exists='append')
+        materialized.refresh('SPENDING', new_spending)
+
+    assert query(con, "SELECT * FROM spending_by_stay").values.tolist() == [[None, 17.5]]
+    assert query(con, "SELECT Country, total_spending FROM spending_by_country_category ORDER BY 1").values.tolist() == [[None, 7.5], ['GR', 10.0]]
+
+def test_ensure_skips_missing_source():
+    con = sqlite3.connect(':memory:')
+    places([1], ['Athens'], ['GR'], [2]).to_sql('PLACES', con, index=False)
+
+    # SPENDING was never loaded, only the places aggregate is created
+    MaterializedViews(con).ensure()
+    tables = set(query(con, "SELECT name FROM sqlite_master WHERE type = 'table'")['name'])
+    assert tables == {'PLACES', 'nights_by_city', 'nights_by_stay'}
+
+def test_ensure_skips_missing_key_column():
+    con = sqlite3.connect(':memory:')
+    materialized = MaterializedViews(con)
+    places([1], ['Athens'], ['GR'], [2]).to_sql('PLACES', con, index=False)
+    # A SPENDING table loaded before the stays were linked
+    spending([1], ['Athens'], ['GR'], ['Food'], ['2023-01-01'], [10.0]).drop(columns='STAY_ORDER').to_sql('SPENDING', con, index=False)
+
+    # Only the aggregate keyed on Stay_Order is skipped, the others are built and refreshed
+    assert not materialized.ensure()
+    tables = set(query(con, "SELECT name FROM sqlite_master WHERE type = 'table'")['name'])
+    assert tables == {'PLACES', 'SPENDING', 'spending_by_country_category', 'spending_by_date', 'spending_by_city', 'nights_by_city', 'nights_by_stay'}
+    new_spending = spending([1], ['Athens'], ['GR'], ['Food'], ['2023-01-02'], [5.0]).drop(columns='STAY_ORDER')
+    materialized.refresh('SPENDING', new_spending)
+    assert query(con, "SELECT total_spending FROM spending_by_date ORDER BY Date")['total_spending'].tolist() == [10.0, 5.0]
+
+def test_spending_vs_nights_without_stay_order():
+    con = sqlite3.connect(':memory:')
+    materialized = MaterializedViews(con)
+    places([1, 2], ['Athens', 'Vienna'], ['GR', 'AT'], [2, 3]).to_sql('PLACES', con, index=False)
+    spending([1, 1], ['Athens', 'Athens'], ['GR', 'GR'], ['Food', 'Food'], ['2023-01-01', '2023-01-02'], [10.0, 5.0]).drop(columns='STAY_ORDER').to_sql('SPENDING', con, index=False)
+    materialized.ensure()
+
+    # Without Stay_Order the spending is joined to the nights by city
+    materialized.create_view('spending_vs_nights')
+    assert query(con, "SELECT * FROM spending_vs_nights").values.tolist() == [['Athens', 'GR', 15.0, 2]]
+
+def test_create_all_views_rebuilds_spending():
+    con = sqlite3.connect(':memory:')
+    places([1], ['Athens'], ['GR'], [2]).to_sql('PLACES', con, index=False)
+    spending([1], ['Athens'], ['GR'], ['Food'], ['2023-01-01'], [10.0]).to_sql('SPENDING', con, index=False)
+    creator = ViewCreator(ConnectionPool(lambda: con))
+    assert creator.create_all_views()
+
+    # SPENDING is changed outside of the pipeline, the next views see its current rows
+    spending([1], ['Athens'], ['GR'], ['Food'], ['2023-01-02'], [5.0]).to_sql('SPENDING', con, index=False, if_exists='append')
+    assert creator.create_all_views()
+    assert query(con, "SELECT * FROM spending_per_country").values.tolist() == [['GR', 15.0]]
+    assert query(con, "SELECT Stay_Order, total_spending FROM spending_vs_nights").values.tolist() == [[1, 15.0]]
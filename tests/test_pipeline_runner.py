@@ -0,0 +1,45 @@
+# test_pipeline_runner.py
+
+import threading
+import pytest
+from pipeline_runner import PipelineRunner
+
+def test_run_passes_results():
+    runner = PipelineRunner()
+    runner.add_stage('process', lambda: {'spending': [1, 2, 3]})
+    runner.add_stage('analyze', lambda process: sum(process['spending']), depends_on=['process'])
+
+    results = runner.run()
+
+    assert results['analyze'] == 6
+
+def test_independent_stages_run_concurrently():
+    # Both stages wait for each other, so the run only finishes if they run at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    runner = PipelineRunner(max_workers=2)
+    runner.add_stage('process', lambda: 'data')
+    runner.add_stage('analyze', lambda process: barrier.wait(), depends_on=['process'])
+    runner.add_stage('visualize', lambda process: barrier.wait(), depends_on=['process'])
+
+    results = runner.run()
+
+    assert set(results) == {'process', 'analyze', 'visualize'}
+
+def test_failed_stage_skips_dependents():
+    def fail():
+        raise ValueError("boom")
+
+    runner = PipelineRunner()
+    runner.add_stage('process', fail)
+    runner.add_stage('load', lambda process: 'loaded', depends_on=['process'])
+    runner.add_stage('views', lambda load: 'created', depends_on=['load'])
+    runner.add_stage('other', lambda: 'done')
+
+    results = runner.run()
+
+    assert results == {'other': 'done'}
+
+def test_unknown_dependency():
+    runner = PipelineRunner()
+    with pytest.raises(ValueError):
+        runner.add_stage('analyze', lambda process: None, depends_on=['process'])
@@ -0,0 +1,123 @@
+# test_run_cache.py
+
+import os
+import time
+import pandas as pd
+import pyarrow as pa
+import pytest
+from pipeline_common.run_cache import RunCache, file_hash
+from pipeline_common.dtype_optimizer import with_dtype_schema
+import v1_main
+from v1_main import stage_keys, cached_stages
+from main import cache_keys
+
+def test_store_and_lookup(tmp_path):
+    cache = RunCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'places.csv'
+    output.write_text('City\nAthens\n')
+    frames = {'places': pd.DataFrame({'City': pd.Categorical(['Athens', 'Vienna']), 'Nights': pd.array([2, None], dtype='Int8')})}
+
+    key = RunCache.key('process', {'places': file_hash(str(output))}, {'missing_data_threshold': 0.1})
+    assert cache.lookup('process', key) is None
+    cache.store('process', key, frames=frames, value={'Total': 1.5}, files=[str(output)])
+
+    # The frames keep their dtypes, the value and the output files are restored
+    entry = cache.lookup('process', key)
+    pd.testing.assert_frame_equal(cache.load_frames(entry)['places'], frames['places'])
+    assert cache.load_value(entry) == {'Total': 1.5}
+    output.unlink()
+    cache.restore_files(entry)
+    assert output.read_text() == 'City\nAthens\n'
+
+    # A changed output file is restored, an unchanged one is left as is
+    output.write_text('City\nSofia\n')
+    cache.restore_files(entry)
+    assert output.read_text() == 'City\nAthens\n'
+
+    # Force ignores the stored entries
+    assert RunCache(str(tmp_path / 'cache'), force=True).lookup('process', key) is None
+
+def test_store_arrow_table(tmp_path):
+    cache = RunCache(str(tmp_path / 'cache'))
+    table = pa.table({'City': ['Athens', 'Vienna'], 'Nights': [2, 3]})
+    table = table.cast(with_dtype_schema(table.schema, {'City': 'category', 'Nights': 'small_int'}))
+
+    # The memory-mapped tables of streaming mode are stored as is, and loaded with the dtypes of their schema
+    cache.store('process', 'streamed', frames={'places': table})
+    loaded = cache.load_frames(cache.lookup('process', 'streamed'))['places']
+    assert isinstance(loaded['City'].dtype, pd.CategoricalDtype)
+    assert str(loaded['Nights'].dtype) == 'Int8'
+
+def test_eviction(tmp_path):
+    cache = RunCache(str(tmp_path / 'cache'), max_bytes=None, max_age_days=1)
+    frame = {'spending': pd.DataFrame({'In EUR': range(1000)})}
+    cache.store('analyze', 'old', frames=frame)
+    cache.store('analyze', 'used', frames=frame)
+    cache.store('analyze', 'new', frames=frame)
+
+    # An entry unused for longer than max_age_days is evicted
+    two_days_ago = time.time() - 2 * 86400
+    os.utime(tmp_path / 'cache' / 'analyze' / 'old' / 'manifest.json', (two_days_ago, two_days_ago))
+    cache.evict()
+    assert cache.lookup('analyze', 'old') is None
+
+    # Above max_bytes, the least recently used entries go first
+    one_hour_ago = time.time() - 3600
+    os.utime(tmp_path / 'cache' / 'analyze' / 'new' / 'manifest.json', (one_hour_ago, one_hour_ago))
+    cache.lookup('analyze', 'used')
+    size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(tmp_path / 'cache') for name in names)
+    cache.max_bytes = size - 1
+    cache.evict()
+    assert cache.lookup('analyze', 'new') is None
+    assert cache.lookup('analyze', 'used') is not None
+
+def test_stage_keys(tmp_path):
+    spending, places = tmp_path / 'spending.xlsx', tmp_path / 'travels.xlsx'
+    spending.write_bytes(b'spending')
+    places.write_bytes(b'places')
+    config = {'spending_file_path_local': str(spending), 'places_file_path_local': str(places), 'missing_data_threshold': 0.1}
+    keys = stage_keys(config)
+
+    # A new spending file recomputes the stages reading it, the places are not reloaded
+    spending.write_bytes(b'new spending')
+    changed = stage_keys(config)
+    assert [name for name in keys if keys[name] != changed[name]] == ['process', 'analyze', 'visualize']
+
+    # A config change recomputes every stage
+    changed = stage_keys(dict(config, missing_data_threshold=0.2))
+    assert all(keys[name] != changed[name] for name in keys)
+
+def test_failed_load_is_not_cached(tmp_path, monkeypatch):
+    spending, places = tmp_path / 'spending.xlsx', tmp_path / 'travels.xlsx'
+    spending.write_bytes(b'spending')
+    places.write_bytes(b'places')
+    config = {'spending_file_path_local': str(spending), 'places_file_path_local': str(places), 'missing_data_threshold': 0.1}
+    cache = RunCache(str(tmp_path / 'cache'))
+    load_stage = cached_stages(config, cache)[3]
+
+    # A failed load raises and is retried by the next run with the same places
+    def failed_load(places_data, target_file_mb, max_workers):
+        raise RuntimeError("Failed to load data into the PLACES table")
+    monkeypatch.setattr(v1_main.snowflake_manager, 'load_places', failed_load)
+    with pytest.raises(RuntimeError):
+        load_stage({'places': pd.DataFrame()})
+    assert cache.lookup('load', stage_keys(config)['load']) is None
+
+    monkeypatch.setattr(v1_main.snowflake_manager, 'load_places', lambda places_data, target_file_mb, max_workers: 2)
+    assert load_stage({'places': pd.DataFrame()}) == 2
+    assert cache.load_value(cache.lookup('load', stage_keys(config)['load'])) == 2
+
+def test_cache_keys():
+    class Extractor:
+        def __init__(self, etags):
+            self.etags = etags
+
+        def get_etags(self):
+            return self.etags
+
+    tables, run = cache_keys(Extractor({'spending': '"a"', 'places': '"b"'}), {})
+    changed_tables, changed_run = cache_keys(Extractor({'spending': '"c"', 'places': '"b"'}), {})
+
+    # Only the table whose object changed is transformed again
+    assert tables['places'] == changed_tables['places'] and tables['spending'] != changed_tables['spending']
+    assert run != changed_run
@@ -0,0 +1,84 @@
+# test_snowflake_connector.py
+
+import sqlite3
+from connection_pool import ConnectionPool
+from snowflake_connector import SnowflakeConnector
+
+class FakeAsyncConnection:
+    """Stand-in for a Snowflake connection, every query runs for two status checks."""
+    def __init__(self):
+        self.submitted = []
+        self.checks = {}
+
+    def cursor(self):
+        return FakeAsyncCursor(self)
+
+    def get_query_status_throw_if_error(self, query_id):
+        if 'FAIL' in self.submitted[query_id]:
+            raise Exception(f"SQL compilation error in query {query_id}")
+        self.checks[query_id] = self.checks.get(query_id, 0) + 1
+        return self.checks[query_id]
+
+    def is_still_running(self, status):
+        return status < 2
+
+    def close(self):
+        pass
+
+class FakeAsyncCursor:
+    def __init__(self, con):
+        self.con = con
+        self.sfqid = None
+
+    def execute_async(self, query):
+        self.con.submitted.append(query)
+        self.sfqid = len(self.con.submitted) - 1
+
+    def execute(self, query, num_statements=1):
+        self.con.submitted.append(query)
+
+    def close(self):
+        pass
+
+def connected(con):
+    connector = SnowflakeConnector(ConnectionPool(lambda: con))
+    connector.connect()
+    return connector
+
+def test_execute_batch_reports_errors():
+    connector = connected(sqlite3.connect(':memory:'))
+
+    results = connector.execute_batch(["CREATE TABLE a (x INTEGER)", "SELECT * FROM missing", "CREATE TABLE b (x INTEGER)"])
+
+    # The failing statement is reported, the others still run
+    assert [result['success'] for result in results] == [True, False, True]
+    assert 'missing' in results[1]['error']
+    assert all(result['seconds'] is not None for result in results)
+
+def test_execute_script_stops_at_first_error():
+    connector = connected(sqlite3.connect(':memory:'))
+
+    results = connector.execute_script(["CREATE TABLE a (x INTEGER)", "INSERT INTO missing VALUES (1)", "CREATE TABLE b (x INTEGER)"])
+
+    assert [result['success'] for result in results] == [True, False, False]
+    assert results[2]['error'] is None
+
+def test_execute_batch_async():
+    con = FakeAsyncConnection()
+    connector = connected(con)
+
+    results = connector.execute_batch(["CREATE VIEW a AS SELECT 1", "FAIL", "CREATE VIEW b AS SELECT 2"], poll_interval=0)
+
+    # Every statement is submitted before waiting on any of them
+    assert con.submitted == ["CREATE VIEW a AS SELECT 1", "FAIL", "CREATE VIEW b AS SELECT 2"]
+    assert [result['success'] for result in results] == [True, False, True]
+    assert 'SQL compilation error' in results[1]['error']
+
+def test_execute_script_single_request():
+    con = FakeAsyncConnection()
+    connector = connected(con)
+
+    results = connector.execute_script(["CREATE DATABASE IF NOT EXISTS A", "USE DATABASE A"])
+
+    assert con.submitted == ["CREATE DATABASE IF NOT EXISTS A;\nUSE DATABASE A"]
+    assert all(result['success'] for result in results)
@@ -0,0 +1,39 @@
+# test_stage_loader.py
+
+import os
+import sqlite3
+import pandas as pd
+from intermediate_store import write_intermediate
+from stage_loader import LocalStage, StagedLoader, read_table
+
+def test_staged_load(tmp_path):
+    places_data = pd.DataFrame({
+        'Order': range(1000),
+        'Arrival_Date': pd.date_range('2023-01-01', periods=1000),
+        'City': ['Athens', 'Vienna'] * 500,
+        'Comment': [None] * 1000
+    })
+    path = str(tmp_path / 'places.arrow')
+    write_intermediate(places_data, path)
+
+    con = sqlite3.connect(':memory:')
+    stage = LocalStage(str(tmp_path / 'stage'), con)
+    # A tiny target size, so the data is split in several files
+    loader = StagedLoader(stage, target_file_size=2000, max_workers=2)
+
+    table = read_table(path, {'Order': 'ORDER', 'City': 'CITY'})
+    stats = loader.load(table, 'PLACES')
+
+    assert stats['rows'] == 1000
+    assert stats['files'] > 1
+    assert stats['bytes'] > 0 and stats['rows_per_second'] > 0
+
+    # Every row is loaded once and the stage is purged
+    loaded = pd.read_sql_query('SELECT * FROM PLACES', con)
+    assert list(loaded.columns) == ['ORDER', 'Arrival_Date', 'CITY', 'Comment']
+    assert sorted(loaded['ORDER']) == list(range(1000))
+    assert os.listdir(tmp_path / 'stage') == []
+
+def test_read_table_from_dataframe():
+    table = read_table(pd.DataFrame({'In EUR': [1.5], 'Comment': [None]}), {'In EUR': 'IN_EUR'})
+    assert table.column_names == ['IN_EUR', 'Comment']
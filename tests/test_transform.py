@@ -0,0 +1,142 @@
+# test_transform.py
+
+import pandas as pd
+import pytest
+from date_parser import DateParser, convert_date
+from sqlalchemy import create_engine
+from extract import parse_object
+from transform import DataTransformer, DataValidationError
+from validation import split_rules
+from load import DataLoader
+
+def test_transform_in_chunks():
+    chunks = [
+        ('places', pd.DataFrame({'Arrival_Date': ['2023.01.01.', None], 'Nights': [2, 3]})),
+        ('places', pd.DataFrame({'Arrival_Date': ['2023-01-05'], 'Nights': [1]})),
+    ]
+    transformer = DataTransformer(data={})
+
+    # The threshold is only exceeded if it is checked per batch, not on the totals
+    batches = list(transformer.transform_in_chunks(chunks, required_cols={'places': ['Arrival_Date']}, threshold=0.4))
+
+    assert sum(len(validated) for _, _, validated in batches) == 2
+    assert sum(len(missing) for _, missing, _ in batches) == 1
+
+def test_transform_in_chunks_threshold():
+    chunks = [('places', pd.DataFrame({'Arrival_Date': [None, None, '2023-01-05'], 'Nights': [1, 2, 3]}))]
+    transformer = DataTransformer(data={})
+
+    with pytest.raises(DataValidationError):
+        list(transformer.transform_in_chunks(chunks, required_cols={'places': ['Arrival_Date']}, threshold=0.5))
+
+def test_transform_in_chunks_unique_across_batches():
+    chunks = [
+        ('places', pd.DataFrame({'Order': [1, 2], 'Arrival_Date': ['2023-01-01', '2023-01-03'], 'Nights': [2, 3]})),
+        ('places', pd.DataFrame({'Order': [2], 'Arrival_Date': ['2023-01-03'], 'Nights': [3]})),
+    ]
+    transformer = DataTransformer(data={})
+
+    # Each batch has unique keys on its own, the repeated key is in the second batch
+    with pytest.raises(DataValidationError):
+        list(transformer.transform_in_chunks(chunks, required_cols={'places': ['Arrival_Date']}, threshold=0.5))
+
+def make_shards():
+    def csv_bytes(df):
+        return df.to_csv(index=False).encode()
+    return [
+        ('places', 'places/2023.csv', csv_bytes(pd.DataFrame({'Order': [3, 4], 'Arrival_Date': ['2023-01-01', None], 'Nights': [2, 1]}))),
+        ('places', 'places/2022.csv', csv_bytes(pd.DataFrame({'Order': [1, 2, 2], 'Arrival_Date': ['2022-05-01', '2022.05.03.', '2022-05-03'], 'Nights': [2, 3, 3]}))),
+    ]
+
+def test_transform_shards():
+    transformer = DataTransformer(data={})
+
+    # 1 of 5 rows is missing, the threshold is only exceeded if it is checked per shard
+    missing_data, validated_data = transformer.transform_shards(make_shards(), parse_object, required_cols={'places': ['Arrival_Date']},
+                                                                threshold=0.2, max_workers=2, dtype_schema={'places': {'Order': 'small_int'}})
+    assert len(missing_data['places']) == 1
+
+    # The shards are concatenated in the order of their keys, with the dtypes of the schema
+    assert validated_data['places']['Order'].tolist() == [1, 2, 2, 3]
+    assert str(validated_data['places']['Order'].dtype) == 'Int8'
+
+    # The repeated stay spans two rows of a shard, the unique rule is left to the whole table
+    with pytest.raises(DataValidationError):
+        transformer.validate_data(validated_data, rules=split_rules(transformer.rules)[1])
+
+    with pytest.raises(DataValidationError):
+        transformer.transform_shards(make_shards(), parse_object, required_cols={'places': ['Arrival_Date']}, threshold=0.1, max_workers=2)
+
+def test_check_data_fails_fast():
+    data = {
+        'spending': pd.DataFrame({'Title': [None, None, 'Bus'], 'In EUR': [1.0, 2.0, 3.0]}),
+        'places': pd.DataFrame({'City': ['Vienna', 'Athens'], 'Nights': [2, 3]})
+    }
+    transformer = DataTransformer(data=data)
+
+    # The threshold is checked on the null counts, before the data is split
+    with pytest.raises(DataValidationError):
+        transformer.check_data(required_cols={'spending': ['Title'], 'places': ['City']}, threshold=0.5)
+
+    # The missing rows are returned as positions
+    rows = transformer.find_missing_rows(required_cols={'spending': ['Title', 'In EUR'], 'places': ['City']})
+    assert rows['spending'].tolist() == [0, 1]
+    assert rows['places'].tolist() == []
+
+def test_check_data_repeated_index():
+    # Rows are split by position, so repeated index labels (e.g. from concatenated batches) are kept apart
+    df = pd.DataFrame({'Title': ['Bus', None, 'Lunch']}, index=[0, 0, 1])
+    transformer = DataTransformer(data={'spending': df})
+
+    missing_data, checked_data = transformer.check_data(required_cols={'spending': ['Title']})
+
+    assert missing_data['spending']['Title'].isnull().all() and len(missing_data['spending']) == 1
+    assert checked_data['spending']['Title'].tolist() == ['Bus', 'Lunch']
+
+def test_check_data_without_missing_rows():
+    df = pd.DataFrame({'Title': [' Bus ', 'Lunch'], 'Date': ['2023.01.01.', '2023.01.02.'], 'Amount': [1, 2]})
+    transformer = DataTransformer(data={'spending': df})
+
+    # Complete data is passed on without a copy, and cleaning leaves the raw data untouched
+    missing_data, checked_data = transformer.check_data(required_cols={'spending': ['Title']})
+    assert checked_data['spending'] is df and missing_data['spending'].empty
+    cleaned = transformer.clean_data(dict(checked_data))
+    assert cleaned['spending']['Title'].tolist() == ['Bus', 'Lunch']
+    assert df['Title'].tolist() == [' Bus ', 'Lunch']
+
+def test_date_parser_matches_convert_date():
+    # Mix of known formats, a free-form date, datetimes and unparseable values
+    values = pd.Series(['2022.04.25.', '2022-04-25 17:00:31', '04/05/2022', 'abc', None, pd.Timestamp('2021-03-03'), '2022.04.25.'])
+
+    parser = DateParser()
+    result = parser.parse(values)
+
+    # Check that the result is the same as parsing value by value
+    pd.testing.assert_series_equal(result, values.apply(convert_date))
+
+    # Check that repeated values are served from the cache
+    assert '2022.04.25.' in parser.cache
+    pd.testing.assert_series_equal(parser.parse(values), result)
+
+def test_link_stays_and_load(tmp_path):
+    data = {
+        'spending': pd.DataFrame({'Title': ['Bus', 'Lunch'], 'Date': pd.to_datetime(['2023-01-02 10:00', '2023-01-09 12:00']),
+                                  'In EUR': [2.0, 12.0]}),
+        'places': pd.DataFrame({'Order': pd.array([7, 8], dtype='Int8'), 'Arrival_Date': pd.to_datetime(['2023-01-01', '2023-01-04']),
+                                'Nights': [3, 2], 'City': ['Athens', 'Vienna']})
+    }
+    linked = DataTransformer(data={}).link_stays(dict(data))
+
+    # The key keeps the compact dtype of Order
+    assert linked['spending']['Stay_Order'].dtype == 'Int8'
+    assert linked['spending']['Stay_Order'].tolist() == [7, pd.NA]
+
+    # The key is loaded as an integer column, data without it loads with the column left out
+    db_link = f"sqlite:///{tmp_path / 'test.db'}"
+    DataLoader(validated_data={'spending': linked['spending']}, output_paths={}, missing_data={}, missing_data_output_paths={},
+               db_link=db_link).load_data_to_db(schema=None)
+    loaded = pd.read_sql('SELECT title, stay_order FROM spending', create_engine(db_link))
+    assert loaded['stay_order'].tolist()[0] == 7 and pd.isna(loaded['stay_order'].tolist()[1])
+    DataLoader(validated_data={'spending': data['spending']}, output_paths={}, missing_data={}, missing_data_output_paths={},
+               db_link=db_link).load_data_to_db(schema=None)
+    assert len(pd.read_sql('SELECT * FROM spending', create_engine(db_link))) == 4
@@ -0,0 +1,106 @@
+# test_validation.py
+
+import numpy as np
+import pandas as pd
+import pytest
+from transform import DataTransformer, DataValidationError
+from validation import evaluate_rules, summarize, repeated_keys
+
+def make_data():
+    spending = pd.DataFrame({
+        'Date': pd.to_datetime(['2023-01-01', '2023-01-02', '2023-01-02', '2023-01-03']),
+        'Title': ['Bus', 'Lunch', 'Lunch', 'Museum'],
+        'Currency': ['EUR', 'HUF', 'HUF', 'euro'],
+        'In EUR': [2.0, 10.0, 10.0, -5.0],
+        'City': ['Vienna', 'Athens', 'Athens', 'Sofia']
+    })
+    places = pd.DataFrame({
+        'Order': [1, 2],
+        'Arrival_Date': pd.to_datetime(['2023-01-01', '2023-01-02']),
+        'Nights': [1, -2],
+        'City': ['Vienna', 'Athens'],
+        'Couchsurfing_FLG': [1, 2]
+    })
+    return {'spending': spending, 'places': places}
+
+RULES = {
+    'spending': [
+        {'rule': 'dtype', 'column': 'Date', 'dtype': 'datetime'},
+        {'rule': 'range', 'column': 'In EUR', 'min': 0},
+        {'rule': 'regex', 'column': 'Currency', 'pattern': '[A-Z]{3}'},
+        {'rule': 'unique', 'columns': ['Date', 'Title']},
+        {'rule': 'reference', 'columns': ['City'], 'table': 'places', 'severity': 'warning'}
+    ],
+    'places': [
+        {'rule': 'dtype', 'column': 'Nights', 'dtype': 'datetime'},
+        {'rule': 'range', 'column': 'Nights', 'min': 0, 'max': 30},
+        {'rule': 'allowed', 'column': 'Couchsurfing_FLG', 'values': [0, 1]},
+        {'rule': 'unique', 'columns': ['Order']},
+        {'rule': 'unique', 'columns': ['Host_Name']}
+    ]
+}
+
+def test_evaluate_rules():
+    results = evaluate_rules(make_data(), RULES)
+
+    # Every rule is evaluated, with the positions of the violating rows
+    rows = {(result['table'], result['rule'], tuple(result['columns'])): result['rows'].tolist() for result in results}
+    assert rows[('spending', 'dtype', ('Date',))] == []
+    assert rows[('spending', 'range', ('In EUR',))] == [3]
+    assert rows[('spending', 'regex', ('Currency',))] == [3]
+    # Only the repeated row is flagged, not its first occurrence
+    assert rows[('spending', 'unique', ('Date', 'Title'))] == [2]
+    assert rows[('spending', 'reference', ('City',))] == [3]
+    assert rows[('places', 'dtype', ('Nights',))] == [0, 1]
+    assert rows[('places', 'range', ('Nights',))] == [1]
+    assert rows[('places', 'allowed', ('Couchsurfing_FLG',))] == [1]
+    assert rows[('places', 'unique', ('Order',))] == []
+
+    # Rules on columns that are not in the data are skipped
+    assert results[-1]['skipped'] and results[-1]['violations'] == 0
+
+    # The summary leaves out the row positions
+    assert all('rows' not in result for result in summarize(results))
+
+def test_evaluate_rules_without_reference_table():
+    # A batch of spending only, e.g. in streaming mode: the referential check is skipped
+    results = evaluate_rules({'spending': make_data()['spending']}, {'spending': RULES['spending']})
+    assert [result['skipped'] for result in results] == [False, False, False, False, True]
+
+def test_validate_data_reports_all_errors():
+    transformer = DataTransformer(data={}, rules=RULES)
+
+    with pytest.raises(DataValidationError) as error:
+        transformer.validate_data(make_data())
+
+    # All the failing rules are reported, not only the first one, warnings do not fail the validation
+    message = str(error.value)
+    assert 'range on spending In EUR (1 rows)' in message and 'allowed on places Couchsurfing_FLG (1 rows)' in message
+    assert 'reference' not in message
+    assert len(transformer.validation_results) == 10
+
+def test_validate_data_default_rules():
+    data = make_data()
+    data['spending'] = data['spending'].drop_duplicates()
+    data['places']['Nights'] = [1, 2]
+
+    # The default rules are the former checks: dtypes, Nights >= 0 and unique keys
+    validated = DataTransformer(data={}).validate_data(data)
+    assert validated is data
+
+def test_range_on_nullable_integers():
+    # The compact small_int dtypes are nullable, the missing values are not range violations
+    places = pd.DataFrame({'Location_Point': pd.array([3, None, 7], dtype='Int8')})
+    results = evaluate_rules({'places': places}, {'places': [{'rule': 'range', 'column': 'Location_Point', 'min': 0, 'max': 5}]})
+    assert results[0]['rows'].tolist() == [2]
+
+def test_repeated_keys():
+    rule = {'rule': 'unique', 'columns': ['Order']}
+    mask, seen = repeated_keys(pd.DataFrame({'Order': [3, 1, 2]}), rule, np.empty(0, dtype=np.uint64))
+    assert not mask.any()
+
+    # The keys of the earlier batches are kept sorted, 8 bytes each
+    assert seen.dtype == np.uint64 and len(seen) == 3 and (np.diff(seen) > 0).all()
+    mask, seen = repeated_keys(pd.DataFrame({'Order': [4, 2, 9, 1]}), rule, seen)
+    assert mask.tolist() == [False, True, False, True]
+    assert len(seen) == 5